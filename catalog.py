@@ -0,0 +1,241 @@
+from common import *
+
+
+class Catalog:
+    # Tables, columns, keys, sizes, sequences and partitions of the source database loaded with a few set-based
+    # queries, so that query generation and metadata writing don't issue per-table catalog queries
+
+    def __init__(self):
+        self.tables = {}        # (schema, table) -> table info
+        self.sequences = []     # sequences owned by table columns
+        self.children = {}      # (schema, table) of a partitioned table -> its partitions
+        self.foreign_keys = []  # foreign keys between the loaded tables
+        self.table_objects = {} # (classid, oid) of indexes and constraints -> table info
+
+    async def load(self, ctx, db_conn):
+        exclude_schemas = ctx.exclude_schemas + ['pg_catalog', 'information_schema', 'pg_toast']
+
+        tables = await db_conn.fetch("""
+            SELECT
+                c.oid,
+                n.nspname,
+                c.relname,
+                c.relkind = 'p' AS partitioned,
+                pg_relation_size(c.oid) AS rel_size,
+                pg_total_relation_size(c.oid) AS total_size,
+                pg_relation_size(c.oid) / current_setting('block_size')::int AS rel_pages,
+                CASE WHEN c.reltuples >= 0 THEN c.reltuples::bigint END AS rel_rows
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE
+                c.relkind IN ('r', 'p') AND
+                has_table_privilege(c.oid, 'SELECT') AND
+                n.nspname <> ALL($1::text[]) AND
+                n.nspname NOT LIKE 'pg_temp_%'
+            ORDER BY n.nspname, c.relname
+        """, exclude_schemas)
+
+        tables_by_oid = {}
+        for v in tables:
+            table = {
+                "oid": v[0],
+                "schema": v[1],
+                "table": v[2],
+                "partitioned": v[3],
+                "size": v[4],
+                "total_size": v[5],
+                "pages": v[6],
+                "rows": v[7],           # estimate from the last ANALYZE/VACUUM, None if not analyzed
+                "columns": [],
+                "key": [],
+                "indexed_columns": [],  # columns of indexes and foreign keys
+                "parent": None
+            }
+            self.tables[(v[1], v[2])] = table
+            tables_by_oid[v[0]] = table
+
+        columns = await db_conn.fetch("""
+            SELECT a.attrelid, a.attname
+            FROM pg_attribute a
+            WHERE
+                a.attrelid = ANY($1::oid[]) AND
+                a.attnum > 0 AND
+                NOT a.attisdropped
+            ORDER BY a.attrelid, a.attnum
+        """, list(tables_by_oid.keys()))
+        for v in columns:
+            tables_by_oid[v[0]]["columns"].append(v[1])
+
+        # primary key, otherwise the narrowest unique index on NOT NULL columns
+        keys = await db_conn.fetch("""
+            SELECT DISTINCT ON (i.indrelid)
+                i.indrelid,
+                (
+                    SELECT array_agg(a.attname ORDER BY k.n)
+                    FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, n)
+                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                    WHERE k.n <= i.indnkeyatts
+                ) AS key_columns
+            FROM pg_index i
+            WHERE
+                i.indrelid = ANY($1::oid[]) AND
+                i.indisunique AND
+                i.indisvalid AND
+                i.indpred IS NULL AND
+                i.indexprs IS NULL AND
+                NOT EXISTS (
+                    SELECT 1
+                    FROM unnest(i.indkey::int2[]) AS k(attnum)
+                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                    WHERE NOT a.attnotnull
+                )
+            ORDER BY i.indrelid, i.indisprimary DESC, i.indnkeyatts, i.indexrelid
+        """, list(tables_by_oid.keys()))
+        for v in keys:
+            tables_by_oid[v[0]]["key"] = list(v[1])
+
+        partitions = await db_conn.fetch("""
+            SELECT i.inhrelid, i.inhparent
+            FROM pg_inherits i
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relkind = 'p' AND i.inhrelid = ANY($1::oid[])
+        """, list(tables_by_oid.keys()))
+        for v in partitions:
+            if v[1] in tables_by_oid:
+                parent = tables_by_oid[v[1]]
+                tables_by_oid[v[0]]["parent"] = (parent["schema"], parent["table"])
+                self.children.setdefault((parent["schema"], parent["table"]), []).append(tables_by_oid[v[0]])
+
+        # constraints cloned to partitions have "conparentid" of the constraint of the partitioned table
+        foreign_keys = await db_conn.fetch("""
+            SELECT
+                c.conname,
+                c.conrelid,
+                c.confrelid,
+                (
+                    SELECT array_agg(a.attname ORDER BY k.n)
+                    FROM unnest(c.conkey) WITH ORDINALITY AS k(attnum, n)
+                    JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+                ) AS columns,
+                (
+                    SELECT array_agg(a.attname ORDER BY k.n)
+                    FROM unnest(c.confkey) WITH ORDINALITY AS k(attnum, n)
+                    JOIN pg_attribute a ON a.attrelid = c.confrelid AND a.attnum = k.attnum
+                ) AS ref_columns
+            FROM pg_constraint c
+            WHERE
+                c.contype = 'f' AND
+                c.conparentid = 0 AND
+                c.conrelid = ANY($1::oid[]) AND
+                c.confrelid = ANY($1::oid[])
+            ORDER BY c.conrelid, c.conname
+        """, list(tables_by_oid.keys()))
+        for v in foreign_keys:
+            table = tables_by_oid[v[1]]
+            ref_table = tables_by_oid[v[2]]
+            self.foreign_keys.append({
+                "name": v[0],
+                "schema": table["schema"],
+                "table": table["table"],
+                "columns": list(v[3]),
+                "ref_schema": ref_table["schema"],
+                "ref_table": ref_table["table"],
+                "ref_columns": list(v[4])
+            })
+
+        # columns whose statistics are used by plans of index scans and foreign key checks
+        indexed_columns = await db_conn.fetch("""
+            SELECT k.relid, a.attname
+            FROM (
+                SELECT i.indrelid, unnest(i.indkey::int2[]) FROM pg_index i
+                UNION
+                SELECT c.conrelid, unnest(c.conkey) FROM pg_constraint c WHERE c.contype = 'f'
+                UNION
+                SELECT c.confrelid, unnest(c.confkey) FROM pg_constraint c WHERE c.contype = 'f'
+            ) AS k(relid, attnum)
+            JOIN pg_attribute a ON a.attrelid = k.relid AND a.attnum = k.attnum
+            WHERE k.relid = ANY($1::oid[])
+            ORDER BY k.relid, a.attnum
+        """, list(tables_by_oid.keys()))
+        for v in indexed_columns:
+            tables_by_oid[v[0]]["indexed_columns"].append(v[1])
+
+        # catalog ids of post-data objects are the same as in the TOC of the pg_dump archive
+        table_objects = await db_conn.fetch("""
+            SELECT 'pg_class'::regclass::oid, i.indexrelid, i.indrelid
+            FROM pg_index i
+            WHERE i.indrelid = ANY($1::oid[])
+            UNION ALL
+            SELECT 'pg_constraint'::regclass::oid, c.oid, c.conrelid
+            FROM pg_constraint c
+            WHERE c.conrelid = ANY($1::oid[])
+        """, list(tables_by_oid.keys()))
+        for v in table_objects:
+            self.table_objects[(v[0], v[1])] = tables_by_oid[v[2]]
+
+        # sequences of serial columns have "auto" dependency on the column, of identity columns "internal"
+        # "last_value" of pg_sequences is NULL until nextval() is called, "SELECT last_value FROM seq"
+        # returns the start value in this case
+        sequences = await db_conn.fetch("""
+            SELECT
+                t.oid,
+                a.attname AS column_name,
+                pn_s.nspname,
+                s.relname AS sequence_name,
+                COALESCE(ps.last_value, ps.start_value) AS last_value
+            FROM pg_class AS t
+            JOIN pg_attribute AS a ON a.attrelid = t.oid
+            JOIN pg_depend AS d ON d.refobjid = t.oid AND d.refobjsubid = a.attnum
+            JOIN pg_class AS s ON s.oid = d.objid
+            JOIN pg_namespace AS pn_s ON pn_s.oid = s.relnamespace
+            JOIN pg_sequences AS ps ON ps.schemaname = pn_s.nspname AND ps.sequencename = s.relname
+            WHERE
+                t.oid = ANY($1::oid[])
+                AND s.relkind = 'S'
+                AND d.deptype IN ('a', 'i')
+                AND d.classid = 'pg_catalog.pg_class'::regclass
+                AND d.refclassid = 'pg_catalog.pg_class'::regclass
+        """, list(tables_by_oid.keys()))
+        for v in sequences:
+            table = tables_by_oid[v[0]]
+            self.sequences.append({
+                "table_schema": table["schema"],
+                "table": table["table"],
+                "column": v[1],
+                "schema": v[2],
+                "seq_name": v[3],
+                "value": v[4]
+            })
+
+        ctx.logger.info(
+            "Catalog loaded: %s table(s), %s column(s), %s partition(s), %s foreign key(s), %s sequence(s)" % (
+                len(self.tables), len(columns), len(partitions), len(self.foreign_keys), len(self.sequences)
+            )
+        )
+        return self
+
+    def get_table(self, schema, table):
+        return self.tables.get((schema, table))
+
+    def get_ancestors(self, tbl):
+        # partitioned tables above the partition, the nearest first
+        res = []
+        while tbl["parent"] is not None:
+            tbl = self.get_table(*tbl["parent"])
+            res.append(tbl)
+        return res
+
+    def get_partitions(self, tbl):
+        # leaf partitions of a partitioned table at all levels
+        res = []
+        for v in self.children.get((tbl["schema"], tbl["table"]), []):
+            res.extend(self.get_partitions(v) if v["partitioned"] else [v])
+        return res
+
+    def get_data_tables(self, tbl):
+        # tables which hold the rows read from the table
+        return self.get_partitions(tbl) if tbl["partitioned"] else [tbl]
+
+    def get_sequences(self, tables):
+        # sequences owned by columns of the given (schema, table) pairs
+        return [v for v in self.sequences if (v["table_schema"], v["table"]) in tables]
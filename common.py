@@ -1,4 +1,6 @@
+import asyncio
 import decimal
+import heapq
 import json
 import sys
 import traceback
@@ -41,6 +43,16 @@ class AnonMode(BasicEnum, Enum):
     SYNC_STRUCT_DUMP = 'sync-struct-dump'        # synchronize the structure of one or more tables (dump stage)
     SYNC_STRUCT_RESTORE = 'sync-struct-restore'  # synchronize the structure of one or more tables (restore stage)
     CREATE_DICT = 'create-dict'   # create dictionary
+    PIPE = 'pipe'           # copy data from source to target database using dictionary, without files
+    VERIFY = 'verify'       # check files of a dump directory against metadata.json
+    PROFILE_DICT = 'profile-dict'   # measure the cost of dictionary expressions on a sample of rows
+
+
+class CompressCodec(BasicEnum, Enum):
+    GZIP = 'gzip'
+    PIGZ = 'pigz'   # multi-threaded gzip
+    ZSTD = 'zstd'
+    LZ4 = 'lz4'
 
 
 class ScanMode(BasicEnum, Enum):
@@ -86,6 +98,95 @@ def exception_handler(func):
     return f
 
 
+async def run_pg_util(ctx, command, name):
+    # runs pg_dump/pg_restore without blocking the event loop, the output is logged line by line
+    ctx.logger.debug(str(command))
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    out_lines = []
+    err_lines = []
+
+    async def read_stream(stream, lines):
+        async for line in stream:
+            line = line.decode("utf-8").rstrip()
+            lines.append(line)
+            ctx.logger.info("%s: %s" % (name, line))
+
+    try:
+        await asyncio.gather(read_stream(proc.stdout, out_lines), read_stream(proc.stderr, err_lines))
+        await proc.wait()
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    return proc.returncode, out_lines, err_lines
+
+
+async def wait_all(aws):
+    # runs awaitables concurrently, the first failure cancels the others and is raised
+    futures = [asyncio.ensure_future(v) for v in aws]
+    try:
+        done, pending = await asyncio.wait(futures, return_when=asyncio.FIRST_EXCEPTION)
+    except asyncio.CancelledError:
+        for v in futures:
+            v.cancel()
+        await asyncio.wait(futures)
+        raise
+    for v in pending:
+        v.cancel()
+    if pending:
+        await asyncio.wait(pending)
+    for v in futures:
+        if v in done and v.exception() is not None:
+            raise v.exception()
+    return [v.result() for v in futures]
+
+
+class CopyPipe:
+    # Bounded buffer between "COPY ... TO STDOUT" on the source and "COPY ... FROM STDIN" on the target,
+    # the source is paused when the target is slower, so at most (max_chunks + 1) * chunk_size bytes are held
+    chunk_size = 1024 * 1024
+    max_chunks = 4
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=self.max_chunks)
+        self.buffer = []
+        self.buffered = 0
+
+    async def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            await self.flush()
+
+    async def flush(self):
+        if self.buffered > 0:
+            await self.queue.put(b"".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    async def close(self):
+        await self.flush()
+        await self.queue.put(None)
+
+    async def chunks(self):
+        while True:
+            data = await self.queue.get()
+            if data is None:
+                return
+            yield data
+
+
+def get_copy_format_options(ctx):
+    # copy_from_query() takes options as arguments, only the data format is taken from "--copy-options"
+    match = re.search(r"\b(binary|csv|text)\b", ctx.args.copy_options, re.IGNORECASE)
+    return {"format": match.group(1).lower()} if match is not None else {}
+
+
 def get_major_version(str_version):
     return version(re.findall(r"(\d+)", str_version)[0])
 
@@ -117,6 +218,34 @@ def chunkify(lst, n):
     return [lst[i::n] for i in range(n)]
 
 
+def lpt_schedule(items, cost_func, workers):
+    # longest-processing-time-first: the most expensive tasks are dispatched first, each next task
+    # goes to the least loaded worker, so the predicted makespan is the load of the busiest worker
+    ordered = sorted(items, key=cost_func, reverse=True)
+    loads = [0] * max(int(workers), 1)
+    for v in ordered:
+        heapq.heapreplace(loads, loads[0] + cost_func(v))
+    return ordered, max(loads)
+
+
+def log_schedule(ctx, name, ordered, cost_func, makespan, label_func, format_cost=pretty_size):
+    total = sum([cost_func(v) for v in ordered])
+    ctx.logger.info("%s schedule: %s task(s), total cost %s, predicted makespan %s on %s worker(s)" % (
+            name,
+            str(len(ordered)),
+            format_cost(total),
+            format_cost(makespan),
+            str(ctx.args.threads)
+        )
+    )
+    if ctx.args.debug:
+        ctx.logger.debug("%s order:\n%s" % (
+                name,
+                "\n".join(["%s: %s" % (format_cost(cost_func(v)), label_func(v)) for v in ordered])
+            )
+        )
+
+
 def recordset_to_list(rs):
     res = []
     for rec in rs:
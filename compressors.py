@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+from common import *
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+# "compress" and "decompress" are shell commands for COPY ... TO/FROM PROGRAM on the database server,
+# "threads" is appended to "compress" when "--compress-threads" is set
+CODECS = {
+    CompressCodec.GZIP: {
+        "ext": "gz",
+        "default_level": 6,
+        "compress": "gzip -%s",
+        "decompress": "gunzip -c"
+    },
+    CompressCodec.PIGZ: {
+        "ext": "gz",
+        "default_level": 6,
+        "compress": "pigz -%s",
+        "threads": "-p %s",
+        "decompress": "pigz -dc"
+    },
+    CompressCodec.ZSTD: {
+        "ext": "zst",
+        "default_level": 3,
+        "compress": "zstd -q -c -%s",
+        "threads": "-T%s",
+        "decompress": "zstd -q -dc"
+    },
+    CompressCodec.LZ4: {
+        "ext": "lz4",
+        "default_level": 1,
+        "compress": "lz4 -q -c -%s",
+        "decompress": "lz4 -q -dc"
+    },
+}
+
+COMPRESSED_FILE_EXTENSIONS = tuple(set(["." + v["ext"] for v in CODECS.values()]))
+
+
+def get_table_codec(ctx, a_obj):
+    # dictionary entries may override "--compress" and "--compress-level" with "compress" and "compress_level"
+    if a_obj is not None and "compress" in a_obj:
+        codec = CompressCodec(a_obj["compress"])
+        level = a_obj.get("compress_level", CODECS[codec]["default_level"])
+    else:
+        codec = ctx.args.compress
+        level = ctx.args.compress_level
+    if level is None:
+        level = CODECS[codec]["default_level"]
+    if ctx.args.client_side_dump:
+        error = get_client_codec_error(codec)
+        if error is not None:
+            raise Exception(error)
+    return codec, int(level)
+
+
+def get_client_codec_error(codec):
+    # zstd and lz4 of --client-side-dump need Python modules from requirements-optional.txt
+    if codec == CompressCodec.ZSTD and zstandard is None:
+        return "Python module \"zstandard\" is required for --compress=zstd with --client-side-dump, " \
+               "see requirements-optional.txt"
+    if codec == CompressCodec.LZ4 and lz4 is None:
+        return "Python module \"lz4\" is required for --compress=lz4 with --client-side-dump, " \
+               "see requirements-optional.txt"
+    return None
+
+
+def get_codec_file_name(name, codec):
+    return "%s.dat.%s" % (name, CODECS[codec]["ext"])
+
+
+def get_compress_program(ctx, codec, level):
+    program = CODECS[codec]["compress"] % level
+    if ctx.args.compress_threads > 0 and "threads" in CODECS[codec]:
+        program += " " + CODECS[codec]["threads"] % ctx.args.compress_threads
+    return program
+
+
+def get_decompress_program(codec):
+    return CODECS[codec]["decompress"]
+
+
+class ChecksumFile:
+    # Binary file which computes the size and sha256 of the bytes written to it, so a file compressed
+    # on the client gets its checksum without being read back
+    def __init__(self, file_name):
+        self.name = file_name
+        self.file = open(file_name, 'wb')
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def close(self):
+        self.file.close()
+
+    def stat(self):
+        return [self.size, self.sha.hexdigest()]
+
+
+def open_compressed_file(codec, level, file):
+    # file object for client-side compression, the compression runs in write(). "file" is not closed with it
+    if get_client_codec_error(codec) is not None:
+        raise Exception(get_client_codec_error(codec))
+    if codec in (CompressCodec.GZIP, CompressCodec.PIGZ):
+        return gzip.GzipFile(fileobj=file, mode='wb', compresslevel=level)
+    if codec == CompressCodec.ZSTD:
+        return zstandard.ZstdCompressor(level=level).stream_writer(file, closefd=False)
+    if codec == CompressCodec.LZ4:
+        return lz4.frame.open(file, 'wb', compression_level=level)
+    raise Exception("Unknown codec: %s" % codec)
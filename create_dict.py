@@ -266,6 +266,7 @@ async def scan_obj_func(name, ctx, pool, task):
 
 def process_impl(name, ctx, queue, items):
     tasks_res = []
+    scan_timings = {}   # (schema, table) -> seconds of scanning its fields
 
     status_ratio = 10
     if len(items) > 1000:
@@ -273,6 +274,14 @@ def process_impl(name, ctx, queue, items):
     if len(items) > 50000:
         status_ratio = 1000
 
+    async def timed_scan(pool, item):
+        start_t = time.time()
+        try:
+            return await scan_obj_func(name, ctx, pool, item)
+        finally:
+            key = (item['nspname'], item['relname'])
+            scan_timings[key] = scan_timings.get(key, 0) + time.time() - start_t
+
     async def run():
         pool = await asyncpg.create_pool(
             **ctx.conn_params,
@@ -289,7 +298,7 @@ def process_impl(name, ctx, queue, items):
                     await pool.close()
                     raise exception
 
-            task_res = loop.create_task(scan_obj_func(name, ctx, pool, item))
+            task_res = loop.create_task(timed_scan(pool, item))
             tasks_res.append(task_res)
             tasks.add(task_res)
             if i % status_ratio:
@@ -314,7 +323,7 @@ def process_impl(name, ctx, queue, items):
         if v.result() is not None and len(v.result()) > 0:
             tasks_res_final.append(v.result())
 
-    queue.put(tasks_res_final)
+    queue.put([tasks_res_final, scan_timings])
     queue.put(None)     # Shut down the worker
     queue.close()
 
@@ -331,7 +340,9 @@ async def init_process(name, ctx, items):
         result = await queue.coro_get()
         if result is None:
             break
-        res = result
+        res, scan_timings = result
+        for k, v in scan_timings.items():
+            ctx.scan_timings[k] = ctx.scan_timings.get(k, 0) + v
     await p.coro_join()
     end_t = time.time()
     ctx.logger.info(
@@ -0,0 +1,16 @@
+{
+	"dictionary": [
+		{
+			"schema":"schm_part",
+			"table":"events",
+			"fields": {
+					"email":"anon_funcs.partial_email(email)"
+			}
+		},
+		{
+			"schema":"schm_part",
+			"table":"messages",
+			"raw_sql": "SELECT id, kind, 'text const' as msg FROM schm_part.messages"
+		}
+	]
+}
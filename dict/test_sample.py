@@ -0,0 +1,19 @@
+{
+	"dictionary": [
+		{
+			"schema":"schm_subset",
+			"table":"customers",
+			"fields": {
+					"email":"anon_funcs.partial_email(email)"
+			},
+			"sample": {"rows": 100, "method": "bernoulli", "seed": 1}
+		},
+		{
+			"schema":"schm_subset",
+			"table":"payments",
+			"fields": {},
+			"sample": {"bytes": 65536, "method": "bernoulli", "seed": 2}
+		}
+	],
+	"sample": {"percent": 50, "method": "bernoulli", "seed": 3}
+}
@@ -0,0 +1,14 @@
+{
+	"dictionary": [
+		{
+			"schema": "stress",
+			"table_mask": "^tbl_\d+$",
+			"fields": {
+				"first_name": "anon_funcs.random_string(10)",
+				"last_name": "anon_funcs.random_string(10)",
+				"email": "anon_funcs.partial_email(email)",
+				"phone": "anon_funcs.random_phone('+7')"
+			}
+		}
+	]
+}
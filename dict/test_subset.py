@@ -0,0 +1,18 @@
+{
+	"dictionary": [
+		{
+			"schema":"schm_subset",
+			"table":"customers",
+			"fields": {
+					"email":"anon_funcs.partial_email(email)"
+			}
+		}
+	],
+	"subset": [
+		{
+			"schema":"schm_subset",
+			"table":"customers",
+			"where":"id % 100 = 0"
+		}
+	]
+}
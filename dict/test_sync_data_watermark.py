@@ -0,0 +1,18 @@
+{
+	"dictionary": [
+		{
+			"schema":"schm_mask_include_1",
+			"table":"tbl_123",
+			"watermark": "id",
+			"fields": {
+					"val":"anon_funcs.partial(val,1,'***',3)"
+			}
+		}
+    ],
+	"dictionary_exclude": [
+		{
+			"schema_mask": "*",
+			"table_mask": "*",
+		}
+	]
+}
@@ -0,0 +1,19 @@
+{
+	"dictionary": [
+		{
+			"schema":"schm_watermark",
+			"table":"tbl_upd",
+			"watermark": "updated_at",
+			"watermark_key": ["code"],
+			"fields": {
+					"val":"upper(val)"
+			}
+		}
+    ],
+	"dictionary_exclude": [
+		{
+			"schema_mask": "*",
+			"table_mask": "*",
+		}
+	]
+}
@@ -0,0 +1,33 @@
+{
+	"dictionary": [
+		{
+			"schema":"schm_other_1",
+			"table":"some_tbl",
+			"fields": {
+					"val":"anon_funcs.no_such_func(val)"
+			}
+		},
+		{
+			"schema":"schm_mask_ext_exclude_2",
+			"table":"card_numbers",
+			"raw_sql": """
+				SELECT c.*
+				FROM schm_mask_ext_exclude_2.card_numbers c
+				JOIN schm_mask_ext_exclude_2.card_numbers c2 ON c2.val = c.val
+			"""
+		},
+		{
+			"schema":"schm_other_2",
+			"table":"some_tbl",
+			"fields": {
+					"val":"'text const'"
+			}
+		}
+	],
+	"dictionary_exclude": [
+		{
+			"schema_mask": "*",
+			"table_mask": "*",
+		}
+	]
+}
@@ -1,14 +1,23 @@
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
 import os
+import time
 import asyncpg
 import asyncio
 from hashlib import sha256
 from common import *
+from compressors import *
+from catalog import *
+from ledger import *
+from progress import *
+from history import *
+from explain import *
+from subset import *
 
 
-async def run_pg_dump(ctx, section):
+async def run_pg_dump(ctx, section, sn_id=None):
     os.environ["PGPASSWORD"] = ctx.args.db_user_password
 
     specific_tables = []
@@ -24,6 +33,9 @@ async def run_pg_dump(ctx, section):
         tmp_list.append(["--exclude-schema", v])
     exclude_schemas = [item for sublist in tmp_list for item in sublist]
 
+    # with the snapshot of the data export the schema is dumped in the same state as the data
+    snapshot = ["--snapshot", sn_id] if sn_id is not None else []
+
     command = [
         ctx.args.pg_dump,
         "-h", ctx.args.db_host,
@@ -31,6 +43,7 @@ async def run_pg_dump(ctx, section):
         "-U", ctx.args.db_user,
         *exclude_schemas,
         *specific_tables,
+        *snapshot,
         "--section", section, "-E", "UTF8", "-F", "c", "-s", "-f",
         os.path.join(
             ctx.args.output_dir,
@@ -41,39 +54,161 @@ async def run_pg_dump(ctx, section):
     if not ctx.args.db_host:
         del command[command.index("-h"):command.index("-h") + 2]
 
-    ctx.logger.debug(str(command))
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    err, out = proc.communicate()
-    if err.decode("utf-8") != "":
-        msg = 'ERROR: database schema dump has failed! \n%s' % err.decode("utf-8")
+    returncode, out, err = await run_pg_util(ctx, command, "pg_dump %s" % section)
+    if returncode != 0:
+        msg = 'ERROR: database schema dump has failed! \n%s' % "\n".join(err)
         ctx.logger.error(msg)
         raise RuntimeError(msg)
+    if ctx.ledger is not None:
+        ctx.ledger.write("section", name=section)
+
+
+class CompressedFileSink:
+    # Receives COPY output chunks on the event loop and writes them to a compressed file in a thread pool.
+    # zlib, zstd and lz4 release the GIL, so files are compressed in parallel while the next chunk is being received.
+    buffer_size = 1024 * 1024
+
+    def __init__(self, executor, file):
+        self.loop = asyncio.get_event_loop()
+        self.executor = executor
+        self.file = file
+        self.buffer = []
+        self.buffered = 0
+        self.pending = None
+
+    async def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.buffer_size:
+            await self.flush()
+
+    async def flush(self):
+        if self.pending is not None:
+            await self.pending
+            self.pending = None
+        if self.buffered > 0:
+            data = b"".join(self.buffer)
+            self.buffer = []
+            self.buffered = 0
+            self.pending = self.loop.run_in_executor(self.executor, self.file.write, data)
+
+    async def close(self):
+        try:
+            await self.flush()
+            if self.pending is not None:
+                await self.pending
+        finally:
+            await self.loop.run_in_executor(self.executor, self.file.close)
+
+
+async def copy_to_local_file(ctx, db_conn, query, full_file_name, codec, level):
+    # returns the COPY status and [size, sha256] of the file, the compressed bytes are hashed as they are written
+    loop = asyncio.get_event_loop()
+    raw_file = await loop.run_in_executor(ctx.compress_executor, ChecksumFile, full_file_name)
+    try:
+        file = open_compressed_file(codec, level, raw_file)
+    except Exception:
+        raw_file.close()
+        raise
+    sink = CompressedFileSink(ctx.compress_executor, file)
+
+    async def write(data):
+        if ctx.progress is not None:
+            ctx.progress.add_bytes(query, len(data))
+        await sink.write(data)
 
-    for v in out.decode("utf-8").split("\n"):
-        ctx.logger.info(v)
+    try:
+        res = await db_conn.copy_from_query(query, output=write, **get_copy_format_options(ctx))
+    finally:
+        try:
+            await sink.close()
+        finally:
+            await loop.run_in_executor(ctx.compress_executor, raw_file.close)
+    return res, raw_file.stat()
 
 
-async def dump_obj_func(ctx, pool, task, sn_id):
+async def dump_obj_func(ctx, db_conn, task, file_name, file_info):
     ctx.logger.info('================> Started task %s' % str(task))
+    if ctx.progress is not None:
+        ctx.progress.start_task(task, db_conn)
 
-    db_conn = await pool.acquire()
     try:
-        await db_conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ;")
-        await db_conn.execute("SET TRANSACTION SNAPSHOT '%s';" % sn_id)
-        res = await db_conn.execute(task)
+        if ctx.args.client_side_dump and not ctx.args.validate_dict:
+            res, ctx.task_file_stats[hash(task)] = await copy_to_local_file(
+                ctx,
+                db_conn,
+                task,
+                os.path.join(ctx.args.output_dir, file_name),
+                CompressCodec(file_info["codec"]),
+                file_info["compress_level"]
+            )
+        else:
+            res = await db_conn.execute(task)
         count_rows = re.findall(r"(\d+)", res)[0]
         ctx.task_results[hash(task)] = count_rows
+        if ctx.progress is not None:
+            ctx.progress.finish_task(task, count_rows)
         ctx.logger.debug("COPY %s [rows] Task: %s " % (count_rows, str(task)))
     except Exception as e:
         ctx.logger.error("Exception in dump_obj_func:\n" + exception_helper())
         raise Exception("Can't execute task: %s" % task)
-    finally:
-        await db_conn.close()
-        await pool.release(db_conn)
 
     ctx.logger.info('<================ Finished task %s' % str(task))
 
 
+class SnapshotWorker:
+    # Long-lived connection that imports the exported snapshot once and runs all its tasks inside that transaction,
+    # instead of a new connection and snapshot import per task
+    def __init__(self, ctx, worker_id, sn_id):
+        self.ctx = ctx
+        self.worker_id = worker_id
+        self.sn_id = sn_id
+        self.db_conn = None
+        self.tasks_done = 0
+        self.busy_time = 0
+        self.started = None
+        self.finished = None
+
+    async def run(self, tasks, handler):
+        # "tasks" is an iterator shared by all workers, each worker takes the next task when it becomes free
+        self.started = time.time()
+        try:
+            self.db_conn = await asyncpg.connect(**self.ctx.conn_params)
+            await self.db_conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ;")
+            await self.db_conn.execute("SET TRANSACTION SNAPSHOT '%s';" % self.sn_id)
+            for task in tasks:
+                start_t = time.time()
+                await handler(self.db_conn, task)
+                self.busy_time += time.time() - start_t
+                self.tasks_done += 1
+        finally:
+            self.finished = time.time()
+            if self.db_conn is not None:
+                await self.db_conn.close()
+
+
+async def run_snapshot_workers(ctx, sn_id, tasks, handler):
+    workers = [SnapshotWorker(ctx, n + 1, sn_id) for n in range(ctx.args.threads)]
+    tasks = iter(tasks)
+    start_t = time.time()
+    await wait_all([v.run(tasks, handler) for v in workers])
+    log_worker_stats(ctx, workers, time.time() - start_t)
+
+
+def log_worker_stats(ctx, workers, elapsed):
+    # idle time includes connecting, importing the snapshot and waiting for the slowest worker
+    total_busy = 0
+    for v in workers:
+        total_busy += v.busy_time
+        ctx.logger.info("Worker %s: %s task(s), busy %.2fs, idle %.2fs" % (
+            v.worker_id, v.tasks_done, v.busy_time, max(elapsed - v.busy_time, 0))
+        )
+    if elapsed > 0:
+        ctx.logger.info("Workers utilization: %.1f%% of %s worker(s) in %.2fs" % (
+            100 * total_busy / (elapsed * len(workers)), len(workers), elapsed)
+        )
+
+
 def find_obj_in_dict(dictionary_obj, schema, table):
     result = None
     for v in dictionary_obj:
@@ -115,89 +250,403 @@ def find_obj_in_dict(dictionary_obj, schema, table):
     return result
 
 
-async def generate_dump_queries(ctx, db_conn):
-    db_objs = await db_conn.fetch("""
-            SELECT table_schema, table_name
-            FROM information_schema.tables
-            WHERE
-                table_schema not in (%s) and
-                table_type = 'BASE TABLE'
-        """ % ', '.join(["'" + v + "'" for v in ctx.exclude_schemas + ['pg_catalog', 'information_schema']])
+class MaskGroup:
+    # Prefilter for a group of dictionary rules: exact names, masks combined into one alternation and "*"
+    def __init__(self):
+        self.names = set()
+        self.masks = []
+        self.match_all = False
+        self.regex = None
+
+    def add(self, v, name_key, mask_key):
+        if name_key in v:
+            self.names.add(v[name_key])
+        if mask_key in v:
+            if v[mask_key] == "*":
+                self.match_all = True
+            else:
+                self.masks.append(v[mask_key])
+
+    def compile(self):
+        if self.masks and not self.match_all:
+            # patterns with groups could change their meaning inside the combined pattern (backreferences)
+            if all([re.compile(v).groups == 0 for v in self.masks]):
+                try:
+                    self.regex = re.compile("|".join(["(?:%s)" % v for v in self.masks]))
+                except re.error:
+                    self.match_all = True
+            else:
+                self.match_all = True
+        return self
+
+    def may_match(self, name):
+        return self.match_all or name in self.names or (self.regex is not None and self.regex.search(name) is not None)
+
+
+class DictionaryIndex:
+    # Compiled form of "dictionary" or "dictionary_exclude", find() returns the same entry as find_obj_in_dict():
+    # the first entry with equal "schema" and "table", otherwise the last entry matched by names or masks
+    def __init__(self, dictionary_obj):
+        self.exact = {}
+        self.schema_rules = {}      # rules without "schema_mask", grouped by "schema"
+        self.schema_prefilters = {}
+        self.mask_rules = []        # rules with "schema_mask"
+        self.mask_prefilter = MaskGroup()
+
+        for pos, v in enumerate(dictionary_obj):
+            if "schema" in v and "table" in v:
+                self.exact.setdefault((v["schema"], v["table"]), v)
+            rule = [pos, v, self.compile_mask(v.get("schema_mask")), self.compile_mask(v.get("table_mask"))]
+            if "schema_mask" in v:
+                self.mask_rules.append(rule)
+                self.mask_prefilter.add(v, "schema", "schema_mask")
+            elif "schema" in v:
+                self.schema_rules.setdefault(v["schema"], []).append(rule)
+                self.schema_prefilters.setdefault(v["schema"], MaskGroup()).add(v, "table", "table_mask")
+
+        self.mask_prefilter.compile()
+        for v in self.schema_prefilters.values():
+            v.compile()
+        # reversed, so the first matched rule is the last one in the dictionary
+        self.mask_rules.reverse()
+        for v in self.schema_rules.values():
+            v.reverse()
+
+    @staticmethod
+    def compile_mask(mask):
+        if mask is None or mask == "*":
+            return mask
+        return re.compile(mask)
+
+    @staticmethod
+    def mask_matched(mask, name):
+        return mask is not None and (mask == "*" or mask.search(name) is not None)
+
+    @staticmethod
+    def find_last(rules, schema, table):
+        for rule in rules:
+            v = rule[1]
+            if ("schema" in v and v["schema"] == schema) or DictionaryIndex.mask_matched(rule[2], schema):
+                if ("table" in v and v["table"] == table) or DictionaryIndex.mask_matched(rule[3], table):
+                    return rule
+        return None
+
+    def find(self, schema, table):
+        result = self.exact.get((schema, table))
+        if result is not None:
+            return result
+
+        found = []
+        if schema in self.schema_rules and self.schema_prefilters[schema].may_match(table):
+            found.append(self.find_last(self.schema_rules[schema], schema, table))
+        if self.mask_rules and self.mask_prefilter.may_match(schema):
+            found.append(self.find_last(self.mask_rules, schema, table))
+        found = [v for v in found if v is not None]
+        if not found:
+            return None
+        return max(found, key=lambda v: v[0])[1]
+
+    def find_table(self, catalog, tbl):
+        # rules of partitioned tables apply to their partitions: an entry with the exact name of the table or of
+        # the nearest partitioned table above it, otherwise the same by names and masks.
+        # Returns the entry and the table it was found for
+        chain = [tbl] + catalog.get_ancestors(tbl)
+        for v in chain:
+            if (v["schema"], v["table"]) in self.exact:
+                return self.exact[(v["schema"], v["table"])], v
+        for v in chain:
+            result = self.find(v["schema"], v["table"])
+            if result is not None:
+                return result, v
+        return None, None
+
+
+def make_ctid_slices(pages, slices_count):
+    # returns list of [start_page, end_page], the last slice is open-ended to catch pages added after the estimate
+    step = max(-(-pages // slices_count), 1)
+    slices = []
+    for start in range(0, pages, step):
+        slices.append([start, start + step if start + step < pages else None])
+    return slices if slices else [[0, None]]
+
+
+def ctid_slice_condition(slice_bounds):
+    conditions = []
+    if slice_bounds[0] > 0:
+        conditions.append("ctid >= '(%s,0)'::tid" % slice_bounds[0])
+    if slice_bounds[1] is not None:
+        conditions.append("ctid < '(%s,0)'::tid" % slice_bounds[1])
+    return ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+
+def slicing_enabled(ctx):
+    if ctx.args.dump_slice_threshold <= 0 or ctx.args.validate_dict or ctx.args.validate_full:
+        return False
+    if get_major_version(ctx.pg_version) < get_major_version("14"):
+        # without "TID Range Scan" every slice would read the whole table
+        ctx.logger.warning("Option --dump-slice-threshold ignored: PostgreSQL 14+ is required")
+        return False
+    return True
+
+
+def load_prev_watermarks(ctx, output_dir):
+    # watermarks of the previous sync-data-dump into the same directory
+    metadata_file = os.path.join(output_dir, "metadata.json")
+    if not os.path.exists(metadata_file):
+        return
+    with open(metadata_file, "r") as f:
+        metadata = json.loads(f.read())
+    for v in metadata.get("files", {}).values():
+        if "watermark" in v and v["watermark"]["to"] is not None:
+            ctx.prev_watermarks[(v["schema"], v["table"])] = v["watermark"]
+    ctx.logger.info("Loaded watermarks of %s table(s) from previous dump" % len(ctx.prev_watermarks))
+
+
+async def get_table_watermark(ctx, db_conn, tbl, a_obj):
+    # rows with "watermark" column above the value of the previous run and up to the current maximum
+    table_name = "\"%s\".\"%s\"" % (tbl["schema"], tbl["table"])
+    if "raw_sql" in a_obj:
+        ctx.logger.warning("Watermark of %s is ignored: not supported with raw_sql" % table_name)
+        return None
+    column = a_obj["watermark"]
+    if column not in tbl["columns"]:
+        raise Exception("Watermark column %s not found in %s" % (column, table_name))
+
+    # restore replaces target rows by the key, an anonymized key would match no rows and duplicate them
+    key = a_obj.get("watermark_key", tbl["key"])
+    anonymized = [v for v in key if v in a_obj.get("fields", {})]
+    if anonymized:
+        raise Exception("Watermark key of %s is anonymized (%s), set \"watermark_key\" to columns kept as is" % (
+            table_name, ", ".join(anonymized))
+        )
+
+    prev = ctx.prev_watermarks.get((tbl["schema"], tbl["table"]))
+    if prev is not None and prev["column"] != column:
+        ctx.logger.warning("Watermark column of %s changed, the table will be dumped in full" % table_name)
+        prev = None
+    if ctx.args.plan:
+        # --plan doesn't scan the table for max(), the upper bound is unknown
+        max_value = None
+    else:
+        max_value = await db_conn.fetchval("SELECT max(\"%s\")::text FROM %s" % (column, table_name))
+
+    watermark = {
+        "column": column,
+        "key": key,
+        "from": prev["to"] if prev is not None else None,
+        "to": max_value if max_value is not None else (prev["to"] if prev is not None else None),
+        "table_rows": tbl["rows"]   # reltuples at the time of the dump, for --plan of the next run
+    }
+    ctx.logger.info("Watermark of %s: %s > %s and <= %s" % (
+        table_name, column, watermark["from"], watermark["to"])
     )
+    return watermark
+
+
+def get_watermark_delta_size(ctx, tbl, size):
+    # --plan of the next sync-data-dump estimates the delta by the growth of reltuples since the previous run,
+    # updated rows are not counted
+    prev = ctx.prev_watermarks.get((tbl["schema"], tbl["table"]))
+    if prev is None or prev.get("table_rows") is None or not tbl["rows"]:
+        return size
+    return size * max(tbl["rows"] - prev["table_rows"], 0) / tbl["rows"]
+
+
+def watermark_condition(watermark):
+    conditions = []
+    if watermark["from"] is not None:
+        conditions.append("\"%s\" > '%s'" % (watermark["column"], watermark["from"].replace("'", "''")))
+    if watermark["to"] is not None:
+        conditions.append("\"%s\" <= '%s'" % (watermark["column"], watermark["to"].replace("'", "''")))
+    return conditions
+
+
+def get_sample_percent(budget, tables):
+    # percent of the tables for the budget, None if the tables are within the budget
+    if "percent" in budget:
+        return float(budget["percent"]) if float(budget["percent"]) < 100 else None
+    if "rows" in budget:
+        requested, total = budget["rows"], sum([v["rows"] or 0 for v in tables])
+    else:
+        requested, total = budget["bytes"], sum([v["size"] for v in tables])
+    return 100.0 * requested / total if requested < total else None
+
+
+def get_table_samples(ctx, catalog, dump_tables):
+    # "sample" of a dictionary entry is the budget of the table (of all its partitions), "sample" at the top level
+    # of the dictionary is shared by all other tables in proportion to their size. A budget of "rows" or "bytes" is
+    # translated into a TABLESAMPLE percent by pg_class statistics, so rows are taken from the whole heap
+    budgets = {}
+    shared = []
+    for tbl, a_obj, rule_tbl in dump_tables:
+        own = a_obj is not None and "sample" in a_obj
+        if (a_obj is not None and "raw_sql" in a_obj) or (ctx.subset is not None and ctx.subset.contains(tbl)):
+            if own:
+                ctx.logger.warning("Sample of \"%s\".\"%s\" is ignored: not supported with %s" % (
+                    tbl["schema"], tbl["table"], "raw_sql" if "raw_sql" in a_obj else "subset")
+                )
+            continue
+        if own:
+            name = "%s.%s" % (rule_tbl["schema"], rule_tbl["table"])
+            budgets.setdefault(name, {"budget": a_obj["sample"], "tables": []})["tables"].append(tbl)
+        else:
+            shared.append(tbl)
+    if "sample" in ctx.dictionary_obj and shared:
+        budgets["*"] = {"budget": ctx.dictionary_obj["sample"], "tables": shared}
+
+    samples = {}
+    for name, v in budgets.items():
+        budget = v["budget"]
+        if len([k for k in ["rows", "bytes", "percent"] if k in budget]) != 1:
+            raise Exception("Sample %s requires one of \"rows\", \"bytes\" or \"percent\"" % name)
+        method = budget.get("method", "system").upper()
+        if method not in ("SYSTEM", "BERNOULLI"):
+            raise Exception("Sample %s: unknown method %s" % (name, budget["method"]))
+
+        data_tables = [t for tbl in v["tables"] for t in catalog.get_data_tables(tbl)]
+        if "rows" in budget and any([t["rows"] is None and t["pages"] > 0 for t in data_tables]):
+            ctx.logger.warning("Sample %s: some tables are not analyzed, the sample may exceed the budget" % name)
+        percent = get_sample_percent(budget, data_tables)
+        ctx.logger.info("Sample %s: %s of %s table(s) with %s" % (
+            name, "%.4f%%" % percent if percent is not None else "100%", len(v["tables"]), method)
+        )
+        for tbl in v["tables"]:
+            samples[(tbl["schema"], tbl["table"])] = {
+                "budget": name,
+                "requested": dict([(k, budget[k]) for k in ["rows", "bytes", "percent"] if k in budget]),
+                "method": method,
+                "percent": percent,
+                "seed": budget.get("seed")
+            }
+    return samples
+
+
+def sample_clause(sample):
+    if sample is None or sample["percent"] is None:
+        return ""
+    clause = " TABLESAMPLE %s (%s)" % (sample["method"], sample["percent"])
+    if sample["seed"] is not None:
+        clause += " REPEATABLE (%s)" % int(sample["seed"])
+    return clause
+
+
+def get_sample_report(catalog, files):
+    # achieved rows of each budget against the requested, bytes are estimated by the average row size of pg_class
+    report = {}
+    for v in files.values():
+        if "sample" not in v:
+            continue
+        item = report.setdefault(v["sample"]["budget"], {
+            "requested": v["sample"]["requested"],
+            "method": v["sample"]["method"],
+            "percent": v["sample"]["percent"],
+            "tables": 0,
+            "rows": 0,
+            "bytes": 0
+        })
+        tables = catalog.get_data_tables(catalog.get_table(v["schema"], v["table"]))
+        rows = sum([t["rows"] or 0 for t in tables])
+        item["tables"] += 1
+        item["rows"] += int(v["rows"])
+        item["bytes"] += int(int(v["rows"]) * sum([t["size"] for t in tables]) / rows) if rows > 0 else 0
+    return report
+
+
+async def generate_dump_queries(ctx, db_conn, catalog):
     queries = []
     files = {}
 
     included_objs = []      # for debug purposes
     excluded_objs = []      # for debug purposes
 
-    for item in db_objs:
-        table_name = "\"" + item[0] + "\".\"" + item[1] + "\""
+    use_slices = slicing_enabled(ctx)
+    use_watermarks = ctx.args.mode == AnonMode.SYNC_DATA_DUMP and \
+        not ctx.args.validate_dict and not ctx.args.validate_full
+    slices_count = ctx.args.dump_slices if ctx.args.dump_slices > 0 else ctx.args.threads
+
+    dictionary_index = DictionaryIndex(ctx.dictionary_obj['dictionary'])
+    exclude_index = DictionaryIndex(ctx.dictionary_obj['dictionary_exclude']) \
+        if 'dictionary_exclude' in ctx.dictionary_obj else None
 
-        if item[0] == 'public' and item[1] == 'tbl_100':
-            x = 1
+    dump_tables = []
+    for tbl in catalog.tables.values():
+        item = [tbl["schema"], tbl["table"], tbl["size"], tbl["pages"]]
+        table_name = "\"" + item[0] + "\".\"" + item[1] + "\""
 
-        a_obj = find_obj_in_dict(ctx.dictionary_obj['dictionary'], item[0], item[1])
+        a_obj, rule_tbl = dictionary_index.find_table(catalog, tbl)
         found_white_list = not(a_obj is None)
 
         # dictionary_exclude has the highest priority
-        if 'dictionary_exclude' in ctx.dictionary_obj:
-            exclude_obj = find_obj_in_dict(ctx.dictionary_obj['dictionary_exclude'], item[0], item[1])
+        if exclude_index is not None:
+            exclude_obj = exclude_index.find_table(catalog, tbl)[0]
             found = not(exclude_obj is None)
             if found and not found_white_list:
                 excluded_objs.append([exclude_obj, item[0], item[1], 'if found and not found_white_list'])
                 ctx.logger.info("Skipping: " + str(table_name))
                 continue
 
+        # partitioned tables have no data of their own: each partition is a separate task and is restored directly
+        # into the partition. Only "raw_sql" of a partitioned table reads the whole hierarchy, its partitions
+        # are skipped then
+        own_raw_sql = found_white_list and "raw_sql" in a_obj and rule_tbl is tbl
+        if tbl["partitioned"] and not own_raw_sql:
+            continue
+        if found_white_list and "raw_sql" in a_obj and not own_raw_sql:
+            ctx.logger.info("Skipping partition %s: dumped by raw_sql of \"%s\".\"%s\"" % (
+                table_name, rule_tbl["schema"], rule_tbl["table"])
+            )
+            continue
+        dump_tables.append((tbl, a_obj, rule_tbl))
+
+    samples = get_table_samples(ctx, catalog, dump_tables)
+
+    for tbl, a_obj, rule_tbl in dump_tables:
+        item = [tbl["schema"], tbl["table"], tbl["size"], tbl["pages"]]
+        table_name = "\"" + item[0] + "\".\"" + item[1] + "\""
+        found_white_list = not(a_obj is None)
+
+        if tbl["partitioned"]:
+            item[2] = sum([v["size"] for v in catalog.get_data_tables(tbl)])
+        ancestors = catalog.get_ancestors(tbl)
+
+        subset_condition = None
+        if ctx.subset is not None and ctx.subset.contains(tbl):
+            if found_white_list and "raw_sql" in a_obj:
+                ctx.logger.warning("Table %s is dumped in full: subset is not supported with raw_sql" % table_name)
+            else:
+                subset_condition = ctx.subset.get_condition(tbl)
+                item[2] = ctx.subset.get_size(tbl, item[2])
+
+        sample = samples.get((tbl["schema"], tbl["table"]))
+        if sample is not None and sample["percent"] is not None:
+            item[2] = item[2] * sample["percent"] / 100
+
         hashed_name = hashlib.md5((item[0] + "_" + item[1]).encode()).hexdigest()
-        full_file_name = "%s.dat.gz" % os.path.join(ctx.args.output_dir, hashed_name)
-        files["%s.dat.gz" % hashed_name] = {"schema": item[0], "table": item[1]}
+        codec, level = get_table_codec(ctx, a_obj)
+
+        # tables above "--dump-slice-threshold" are dumped in ctid ranges, each range to its own file
+        slices = [None]
+        if use_slices and item[2] > ctx.args.dump_slice_threshold * 1024 * 1024 and \
+                (not found_white_list or "raw_sql" not in a_obj) and subset_condition is None and \
+                sample_clause(sample) == "":
+            slices = make_ctid_slices(item[3], slices_count)
+            ctx.logger.info("Table %s (%s) will be dumped in %s slices" % (
+                table_name, pretty_size(item[2]), len(slices))
+            )
 
         if not found_white_list:
             included_objs.append([a_obj, item[0], item[1], 'if not found_white_list'])
             # there is no table in the dictionary, so it will be transferred "as is"
-            if not ctx.args.validate_dict:
-                query = "COPY (SELECT * FROM %s %s) to PROGRAM 'gzip > %s' %s" % (
-                    table_name,
-                    (ctx.validate_limit if ctx.args.validate_full else ""),
-                    full_file_name,
-                    ctx.args.copy_options
-                )
-                ctx.logger.info(str(query))
-                queries.append(query)
-            else:
-                query = "SELECT * FROM %s %s" % (table_name, ctx.validate_limit)
-                ctx.logger.info(str(query))
-                queries.append(query)
+            sql_expr = "*"
         else:
             included_objs.append([a_obj, item[0], item[1], 'if found_white_list'])
             # table found in dictionary
             if "raw_sql" in a_obj:
                 # the table is transferred using "raw_sql"
-                if not ctx.args.validate_dict:
-                    query = "COPY (%s %s) to PROGRAM 'gzip > %s' %s" % (
-                        a_obj['raw_sql'],
-                        (ctx.validate_limit if ctx.args.validate_full else ""),
-                        full_file_name,
-                        ctx.args.copy_options
-                    )
-                    ctx.logger.info(str(query))
-                    queries.append(query)
-                else:
-                    query = a_obj['raw_sql'] + " " + ctx.validate_limit
-                    ctx.logger.info(str(query))
-                    queries.append(query)
+                sql_expr = None
             else:
                 # the table is transferred with the specific fields for anonymization
-                fields_list = await db_conn.fetch(
-                    """
-                        SELECT column_name FROM information_schema.columns
-                        WHERE table_schema = '%s' AND table_name='%s'
-                        ORDER BY ordinal_position ASC
-                    """ % (
-                        item[0].replace("'", "''"),
-                        item[1].replace("'", "''")
-                    )
-                )
+                fields_list = [[v] for v in tbl["columns"]]
 
                 sql_expr = ""
 
@@ -224,20 +673,64 @@ async def generate_dump_queries(ctx, db_conn):
                     if cnt != len(fields_list) - 1:
                         sql_expr += ",\n"
 
-                if not ctx.args.validate_dict:
-                    query = "COPY (SELECT %s FROM %s %s) to PROGRAM 'gzip > %s' %s" % (
-                        sql_expr,
-                        table_name,
-                        (ctx.validate_limit if ctx.args.validate_full else ""),
-                        full_file_name,
-                        ctx.args.copy_options
-                    )
-                    ctx.logger.info(str(query))
-                    queries.append(query)
-                else:
-                    query = "SELECT %s FROM %s %s" % (sql_expr, table_name, ctx.validate_limit)
-                    ctx.logger.info(str(query))
-                    queries.append(query)
+        watermark = None
+        if use_watermarks and found_white_list and "watermark" in a_obj:
+            watermark = await get_table_watermark(ctx, db_conn, tbl, a_obj)
+            if ctx.args.plan and watermark is not None and watermark["from"] is not None:
+                item[2] = get_watermark_delta_size(ctx, tbl, item[2])
+
+        for slice_num, slice_bounds in enumerate(slices):
+            if slice_bounds is None:
+                file_name = get_codec_file_name(hashed_name, codec)
+                files[file_name] = {"schema": item[0], "table": item[1]}
+                condition = ""
+            else:
+                file_name = get_codec_file_name("%s.%s" % (hashed_name, slice_num + 1), codec)
+                files[file_name] = {
+                    "schema": item[0],
+                    "table": item[1],
+                    "slice": {
+                        "part": slice_num + 1,
+                        "parts": len(slices),
+                        "start_page": slice_bounds[0],
+                        "end_page": slice_bounds[1]
+                    }
+                }
+                condition = ctid_slice_condition(slice_bounds)
+            files[file_name].update({"codec": str(codec), "compress_level": level})
+            if ancestors:
+                files[file_name]["partition_root"] = [ancestors[-1]["schema"], ancestors[-1]["table"]]
+            if sample is not None:
+                files[file_name]["sample"] = sample
+            conditions = []
+            if subset_condition is not None:
+                files[file_name]["subset"] = True
+                conditions.append(subset_condition)
+            if watermark is not None:
+                files[file_name]["watermark"] = watermark
+                conditions.extend(watermark_condition(watermark))
+            if conditions:
+                condition = ("%s AND " % condition if condition else "WHERE ") + " AND ".join(conditions)
+            if ctx.args.validate_full:
+                condition = ("%s %s" % (condition, ctx.validate_limit)).strip()
+            full_file_name = os.path.join(ctx.args.output_dir, file_name)
+
+            if ctx.args.validate_dict:
+                condition = ctx.validate_limit
+            if sql_expr is None:
+                query = "%s %s" % (a_obj['raw_sql'], condition)
+            else:
+                query = "SELECT %s FROM ONLY %s%s %s" % (sql_expr, table_name, sample_clause(sample), condition)
+            if not ctx.args.validate_dict and not ctx.args.client_side_dump and ctx.args.mode != AnonMode.PIPE:
+                query = "COPY (%s) to PROGRAM '%s > %s' %s" % (
+                    query,
+                    get_compress_program(ctx, codec, level),
+                    full_file_name,
+                    ctx.args.copy_options
+                )
+            ctx.logger.info(str(query))
+            queries.append(query)
+            ctx.task_costs[hash(query)] = item[2] / len(slices)
 
     if ctx.args.verbose == VerboseOptions.DEBUG:
         ctx.logger.debug("included_objs:\n" + json.dumps(included_objs, indent=4))
@@ -246,93 +739,291 @@ async def generate_dump_queries(ctx, db_conn):
     return queries, files
 
 
-async def make_dump_impl(ctx, db_conn, sn_id):
-    loop = asyncio.get_event_loop()
-    tasks = set()
-    pool = await asyncpg.create_pool(
-        **ctx.conn_params,
-        min_size=ctx.args.threads,
-        max_size=ctx.args.threads
+def resume_dump(ctx):
+    # the ledger of the interrupted dump must belong to the same dictionary and mode
+    ctx.ledger.load()
+    if not ctx.ledger.runs:
+        return
+    first_run = ctx.ledger.runs[0]
+    if first_run["dictionary_content_hash"] != sha256(ctx.dictionary_content.encode('utf-8')).hexdigest():
+        raise Exception("Dictionary %s was changed after the interrupted dump, --resume is not possible" % (
+            ctx.args.dict_file)
+        )
+    if first_run["mode"] != str(ctx.args.mode):
+        raise Exception("Interrupted dump was made in mode %s, --resume is not possible" % first_run["mode"])
+    for v in first_run["watermarks"]:
+        ctx.prev_watermarks[(v[0], v[1])] = v[2]
+    ctx.logger.info("Resuming dump after %s run(s): finished sections %s, finished files %s" % (
+        len(ctx.ledger.runs), list(ctx.ledger.sections.keys()), len(ctx.ledger.files))
     )
 
-    queries, files = await generate_dump_queries(ctx, db_conn)
-    if not queries:
-        await pool.close()
-        raise Exception("No objects for dump!")
 
-    zipped_list = list(zip([hash(v) for v in queries], files))
+def ledger_file_valid(ctx, record):
+    if record["size"] is None:
+        # written by a remote database server, can't be checked from here
+        return True
+    full_file_name = os.path.join(ctx.args.output_dir, record["name"])
+    return os.path.exists(full_file_name) and os.path.getsize(full_file_name) == record["size"]
+
+
+def get_finished_tables(ctx):
+    # tables with all files finished by one run, files of different runs may have different slice bounds
+    ledger_tables = {}
+    for record in ctx.ledger.files.values():
+        ledger_tables.setdefault((record["info"]["schema"], record["info"]["table"]), []).append(record)
+
+    finished = {}
+    for table, records in ledger_tables.items():
+        parts = set([v["info"]["slice"]["part"] if "slice" in v["info"] else 1 for v in records])
+        parts_count = records[0]["info"]["slice"]["parts"] if "slice" in records[0]["info"] else 1
+        if len(set([v["run"] for v in records])) == 1 and parts == set(range(1, parts_count + 1)) and \
+                all([ledger_file_valid(ctx, v) for v in records]):
+            finished[table] = records
+    return finished
+
+
+def apply_dump_ledger(ctx, queries, files, query_files):
+    # files of finished tables are taken from the ledger, other tables are exported again
+    finished = get_finished_tables(ctx)
+    remaining = []
+    for query in queries:
+        file_info = files[query_files[hash(query)]]
+        if (file_info["schema"], file_info["table"]) not in finished:
+            remaining.append(query)
+        else:
+            del files[query_files[hash(query)]]
 
-    for v in queries:
-        if len(tasks) >= ctx.args.threads:
-            # Wait for some dump to finish before adding a new one
-            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-            exception = done.pop().exception()
-            if exception is not None:
-                await pool.close()
-                raise exception
-        tasks.add(loop.create_task(dump_obj_func(ctx, pool, v, sn_id)))
-
-    # Wait for the remaining dumps to finish
-    await asyncio.wait(tasks)
-    await pool.close()
+    reused = 0
+    for records in finished.values():
+        for v in records:
+            files[v["name"]] = dict(v["info"], size=v["size"], checksum=v["checksum"])
+            reused += 1
 
-    # Generate metadata.json
-    query = """
-        SELECT
-            pn_t.nspname,
-            t.relname AS table_name,
-            a.attname AS column_name,
-            pn_s.nspname,
-            s.relname AS sequence_name
-        FROM pg_class AS t
-        JOIN pg_attribute AS a ON a.attrelid = t.oid
-        JOIN pg_depend AS d ON d.refobjid = t.oid AND d.refobjsubid = a.attnum
-        JOIN pg_class AS s ON s.oid = d.objid
-        JOIN pg_namespace AS pn_t ON pn_t.oid = t.relnamespace
-        JOIN pg_namespace AS pn_s ON pn_s.oid = s.relnamespace
-        WHERE
-            t.relkind IN ('r', 'p')
-            AND s.relkind = 'S'
-            AND d.deptype = 'a'
-            AND d.classid = 'pg_catalog.pg_class'::regclass
-            AND d.refclassid = 'pg_catalog.pg_class'::regclass
-        """
-    ctx.logger.debug(str(query))
-
-    seq_res = await db_conn.fetch(query)
+    # partial files of the interrupted run which are not a part of the new plan
+    for file_name in os.listdir(ctx.args.output_dir):
+        if file_name.endswith(COMPRESSED_FILE_EXTENSIONS) and file_name not in files:
+            os.remove(os.path.join(ctx.args.output_dir, file_name))
+
+    ctx.logger.info("Resume: %s file(s) of %s table(s) are taken from the ledger, %s task(s) remaining" % (
+        reused, len(finished), len(remaining))
+    )
+    return remaining, reused
+
+
+def get_seq_lastvals(catalog, tables):
+    # sequences of partitions are usually owned by columns of the partitioned table
+    tables = set(tables)
+    for v in list(tables):
+        tables.update([(t["schema"], t["table"]) for t in catalog.get_ancestors(catalog.get_table(*v))])
     seq_res_dict = {}
-    for v in seq_res:
-        seq_name = v[3] + "." + v[4]
-        seq_val = await db_conn.fetchval("""select last_value from \"""" + v[3] + """\".\"""" + v[4] + "\"")
+    for v in catalog.get_sequences(tables):
+        seq_res_dict[v["schema"] + "." + v["seq_name"]] = {
+            "schema": v["schema"], "seq_name": v["seq_name"], "value": v["value"]
+        }
+    return seq_res_dict
+
+
+def get_post_data_tables(catalog, tables):
+    # "classid oid" of TOC entries of indexes and constraints -> table, restore builds them after the table is loaded
+    return {
+        "%s %s" % k: [v["schema"], v["table"]] for k, v in catalog.table_objects.items()
+        if (v["schema"], v["table"]) in tables and not v["partitioned"]
+    }
+
+
+def get_analyze_columns(catalog, tables):
+    # columns of indexes and foreign keys of the tables and their partition roots, restore with --quick-analyze
+    # analyzes them first
+    nodes = set()
+    for v in tables:
+        tbl = catalog.get_table(*v)
+        ancestors = catalog.get_ancestors(tbl)
+        nodes.add((ancestors[-1]["schema"], ancestors[-1]["table"]) if ancestors else v)
+    return [
+        [v[0], v[1], catalog.get_table(*v)["indexed_columns"]] for v in sorted(nodes)
+        if catalog.get_table(*v)["indexed_columns"]
+    ]
+
+
+def make_task_progress(ctx, name, catalog, queries, files, query_files):
+    # expected rows of a task are taken from reltuples, a slice gets its share of the table
+    progress = Progress(ctx, name)
+    for v in queries:
+        file_name = query_files[hash(v)]
+        file_info = files[file_name]
+        tables = catalog.get_data_tables(catalog.get_table(file_info["schema"], file_info["table"]))
+        parts = file_info["slice"]["parts"] if "slice" in file_info else 1
+        if file_info.get("subset"):
+            rows_expected = ctx.subset.get_rows(tables[0])
+        elif all([t["rows"] is not None for t in tables]):
+            rows_expected = sum([t["rows"] for t in tables]) // parts
+            if "sample" in file_info and file_info["sample"]["percent"] is not None:
+                rows_expected = int(rows_expected * file_info["sample"]["percent"] / 100)
+        else:
+            rows_expected = 0 if all([t["pages"] == 0 for t in tables]) else None
+        progress.add_task(v, file_name, file_info["schema"], file_info["table"], rows_expected, ctx.task_costs[hash(v)])
+    return progress
+
+
+def schedule_dump_queries(ctx, name, queries, files, query_files):
+    # largest tables first to avoid a long tail, by recorded durations of previous runs if there is history
+    durations = predict_durations(ctx, load_history_stats(ctx, str(ctx.args.mode)), {
+        hash(v): (files[query_files[hash(v)]]["schema"], files[query_files[hash(v)]]["table"], ctx.task_costs[hash(v)])
+        for v in queries
+    }, "size")
+    if durations is not None:
+        cost_func, format_cost = lambda v: durations[hash(v)], format_duration
+    else:
+        cost_func, format_cost = lambda v: ctx.task_costs[hash(v)], pretty_size
+    queries, makespan = lpt_schedule(queries, cost_func, ctx.args.threads)
+    log_schedule(ctx, name, queries, cost_func, makespan, lambda v: query_files[hash(v)], format_cost)
+    return queries
+
+
+async def validate_dict_queries(ctx, sn_id, catalog, queries, files):
+    # --validate-dict: every query is planned with EXPLAIN by the snapshot workers, no data is read.
+    # All errors are collected, the report with estimated costs and warnings is written to validate.json
+    query_files = dict(zip([hash(v) for v in queries], files))
+    dictionary_index = DictionaryIndex(ctx.dictionary_obj['dictionary'])
+    report = {}
+
+    async def explain_task(worker_conn, query):
+        file_info = files[query_files[hash(query)]]
+        a_obj = dictionary_index.find_table(catalog, catalog.get_table(file_info["schema"], file_info["table"]))[0]
+        item = {"schema": file_info["schema"], "table": file_info["table"]}
+        try:
+            plan = await explain_query(worker_conn, query)
+            item["cost"], item["rows"] = get_plan_estimate(plan)
+            item["warnings"] = get_plan_warnings(plan, a_obj is not None and "raw_sql" in a_obj)
+        except asyncpg.PostgresError as e:
+            item["error"] = "%s: %s" % (type(e).__name__, str(e))
+        report[query_files[hash(query)]] = item
+
+    start_t = time.time()
+    await run_snapshot_workers(ctx, sn_id, queries, explain_task)
+
+    errors = 0
+    warnings = 0
+    for v in sorted(report.values(), key=lambda v: v.get("cost", 0), reverse=True):
+        table_name = "\"%s\".\"%s\"" % (v["schema"], v["table"])
+        if "error" in v:
+            errors += 1
+            ctx.logger.error("Validation of %s failed: %s" % (table_name, v["error"]))
+            continue
+        ctx.logger.debug("Validated %s: cost %s, ~%s rows" % (table_name, v["cost"], v["rows"]))
+        for w in v["warnings"]:
+            warnings += 1
+            ctx.logger.warning("Validation of %s: %s" % (table_name, w))
+
+    with open(os.path.join(ctx.args.output_dir, "validate.json"), "w") as out_file:
+        out_file.write(json.dumps(report, indent=4))
+
+    ctx.logger.info("Validated %s queries in %.2fs: %s error(s), %s warning(s), total cost %s" % (
+        len(queries), time.time() - start_t, errors, warnings, sum([v.get("cost", 0) for v in report.values()]))
+    )
+    if errors > 0:
+        raise Exception("Dictionary validation failed: %s error(s)" % errors)
+
 
-        for _, f in files.items():
-            if v[0] == f["schema"] and v[1] == f["table"]:
-                seq_res_dict[seq_name] = {"schema": v[3], "seq_name": v[4], "value": seq_val}
+async def make_dump_impl(ctx, db_conn, sn_id):
+    catalog = await Catalog().load(ctx, db_conn)
+    if "subset" in ctx.dictionary_obj:
+        ctx.subset = await Subset(ctx, db_conn, catalog).build()
+    queries, files = await generate_dump_queries(ctx, db_conn, catalog)
+    if not queries:
+        raise Exception("No objects for dump!")
+
+    if ctx.args.validate_dict and not ctx.args.validate_full:
+        await validate_dict_queries(ctx, sn_id, catalog, queries, files)
+        return
+
+    if ctx.args.client_side_dump:
+        if re.sub(r"\b(with|binary|csv|text|format)\b|[()]", "", ctx.args.copy_options, flags=re.IGNORECASE).strip():
+            ctx.logger.warning("Only the data format of --copy-options is used with --client-side-dump")
+        ctx.compress_executor = ThreadPoolExecutor(max_workers=ctx.args.threads)
+
+    query_files = dict(zip([hash(v) for v in queries], files))
+    reused_files = 0
+    if ctx.ledger is not None and ctx.args.resume:
+        queries, reused_files = apply_dump_ledger(ctx, queries, files, query_files)
+    zipped_list = [(hash(v), query_files[hash(v)]) for v in queries]
+
+    queries = schedule_dump_queries(ctx, "Dump", queries, files, query_files)
+
+    async def dump_task(worker_conn, query):
+        file_name = query_files[hash(query)]
+        if ctx.subset is not None:
+            await ctx.subset.prepare_task(worker_conn, files[file_name])
+        await dump_obj_func(ctx, worker_conn, query, file_name, files[file_name])
+        if ctx.ledger is not None:
+            if hash(query) in ctx.task_file_stats:
+                size, checksum = ctx.task_file_stats[hash(query)]
+            else:
+                # a file written by the server is read back to compute its checksum
+                size, checksum = await asyncio.get_event_loop().run_in_executor(
+                    None, get_file_stat, os.path.join(ctx.args.output_dir, file_name), not ctx.args.skip_checksum
+                )
+            ctx.ledger.write(
+                "file",
+                name=file_name,
+                run=len(ctx.ledger.runs),
+                info=dict(files[file_name], rows=ctx.task_results[hash(query)]),
+                size=size,
+                checksum=checksum
+            )
+            ctx.progress.set_output_size(query, size)
+            files[file_name].update({"size": size, "checksum": checksum})
+
+    ctx.progress = make_task_progress(ctx, "dump", catalog, queries, files, query_files)
+    ctx.progress.start()
+    try:
+        await run_snapshot_workers(ctx, sn_id, queries, dump_task)
+    finally:
+        await ctx.progress.stop()
+        if ctx.compress_executor is not None:
+            ctx.compress_executor.shutdown()
+
+    # Generate metadata.json
+    dumped_tables = set([(v["schema"], v["table"]) for v in files.values()])
+    seq_res_dict = get_seq_lastvals(catalog, dumped_tables)
 
     metadata = {}
     metadata["db_size"] = await db_conn.fetchval("""SELECT pg_database_size('""" + ctx.args.db_name + """')""")
     metadata["created"] = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
     metadata["seq_lastvals"] = seq_res_dict
+    metadata["post_data_tables"] = get_post_data_tables(catalog, dumped_tables)
+    metadata["analyze_columns"] = get_analyze_columns(catalog, dumped_tables)
     metadata["pg_version"] = ctx.pg_version
     metadata["pg_dump_version"] = get_pg_util_version(ctx.args.pg_dump)
     metadata["dictionary_content_hash"] = sha256(ctx.dictionary_content.encode('utf-8')).hexdigest()
     metadata["dict_file"] = ctx.args.dict_file
+    metadata["copy_format"] = get_copy_format_options(ctx).get("format", "text")
+    if ctx.subset is not None:
+        metadata["subset"] = ctx.subset.get_info()
 
     for v in zipped_list:
         files[v[1]].update({"rows": ctx.task_results[v[0]]})
 
     metadata["files"] = files
+    samples = get_sample_report(catalog, files)
+    if samples:
+        metadata["samples"] = samples
+
+    if reused_files > 0:
+        metadata["resumed"] = {
+            "runs": [v["time"] for v in ctx.ledger.runs],
+            "reused_files": reused_files,
+            "note": "The dump was resumed with --resume. Tables are exported from different snapshots, "
+                    "each table is consistent, but data of tables exported by different runs is not consistent "
+                    "with each other"
+        }
 
     total_tables_size = 0
     total_rows = 0
     for k, v in files.items():
-        # print("""select pg_total_relation_size('"%s"."%s"')""" % (v['schema'], v['table']))
-        schema = v['schema'].replace("'", "''")
-        table = v['table'].replace("'", "''")
-        total_tables_size += await db_conn.fetchval(
-            """select pg_total_relation_size('"%s"."%s"')""" % (schema, table)
-        )
         total_rows += int(v['rows'])
+    for v in dumped_tables:
+        total_tables_size += sum([t["total_size"] for t in catalog.get_data_tables(catalog.get_table(*v))])
     metadata["total_tables_size"] = total_tables_size
     metadata["total_rows"] = total_rows
 
@@ -340,34 +1031,53 @@ async def make_dump_impl(ctx, db_conn, sn_id):
         out_file.write(json.dumps(metadata, indent=4))
 
 
+def read_dictionary(ctx):
+    dictionary_file = open(os.path.join(ctx.current_dir, 'dict', ctx.args.dict_file), 'r')
+    ctx.dictionary_content = dictionary_file.read()
+    dictionary_file.close()
+    ctx.dictionary_obj = eval(ctx.dictionary_content)
+
+
+def get_dump_output_dir(ctx):
+    if ctx.args.output_dir.find("""/""") != -1 or ctx.args.output_dir.find("""\\""") != -1:
+        output_dir = ctx.args.output_dir
+    if len(ctx.args.output_dir) > 1:
+        output_dir = os.path.join(ctx.current_dir, 'output', ctx.args.output_dir)
+    else:
+        output_dir = os.path.join(ctx.current_dir, 'output', os.path.splitext(ctx.args.dict_file)[0])
+    return output_dir
+
+
 async def make_dump(ctx):
     result = PgAnonResult()
     ctx.logger.info("-------------> Started dump mode")
 
     try:
-        dictionary_file = open(os.path.join(ctx.current_dir, 'dict', ctx.args.dict_file), 'r')
-        ctx.dictionary_content = dictionary_file.read()
-        dictionary_file.close()
-        ctx.dictionary_obj = eval(ctx.dictionary_content)
+        read_dictionary(ctx)
     except:
         ctx.logger.error("<------------- make_dump failed\n" + exception_helper())
         result.result_code = ResultCode.FAIL
         return result
 
     try:
-        if ctx.args.output_dir.find("""/""") != -1 or ctx.args.output_dir.find("""\\""") != -1:
-            output_dir = ctx.args.output_dir
-        if len(ctx.args.output_dir) > 1:
-            output_dir = os.path.join(ctx.current_dir, 'output', ctx.args.output_dir)
-        else:
-            output_dir = os.path.join(ctx.current_dir, 'output', os.path.splitext(ctx.args.dict_file)[0])
-
+        output_dir = get_dump_output_dir(ctx)
         ctx.args.output_dir = output_dir
         dir_exists = os.path.exists(output_dir)
         if not dir_exists:
             os.makedirs(output_dir)
 
+        resuming = False
         if not ctx.args.validate_dict:
+            ctx.ledger = Ledger(os.path.join(output_dir, DUMP_LEDGER_FILE))
+            resuming = ctx.args.resume and ctx.ledger.exists()
+
+        if resuming:
+            resume_dump(ctx)
+        elif dir_exists and ctx.args.mode == AnonMode.SYNC_DATA_DUMP and not ctx.args.validate_dict and \
+                not ctx.args.reset_watermarks:
+            load_prev_watermarks(ctx, output_dir)
+
+        if not ctx.args.validate_dict and not resuming:
             dir_empty = True
             for root, dirs, files in os.walk(output_dir):
                 for _ in files:
@@ -382,8 +1092,8 @@ async def make_dump(ctx):
             if not dir_empty and ctx.args.clear_output_dir:
                 for root, dirs, files in os.walk(output_dir):
                     for file in files:
-                        if file.endswith('.sql') or file.endswith('.gz') or \
-                                file.endswith('.json') or file.endswith('.backup'):
+                        if file.endswith('.sql') or file.endswith(COMPRESSED_FILE_EXTENSIONS) or \
+                                file.endswith('.json') or file.endswith('.backup') or file.endswith('.ledger'):
                             os.remove(os.path.join(root, file))
                         else:
                             msg = "Option --clear-output-dir enabled. Unexpected file extension: %s" % \
@@ -391,11 +1101,21 @@ async def make_dump(ctx):
                             ctx.logger.error(msg)
                             raise Exception(msg)
 
+        if ctx.ledger is not None:
+            ctx.ledger.write(
+                "run",
+                mode=str(ctx.args.mode),
+                dictionary_content_hash=sha256(ctx.dictionary_content.encode('utf-8')).hexdigest(),
+                watermarks=[[k[0], k[1], v] for k, v in ctx.prev_watermarks.items()]
+            )
+
+        sections = []
         if not ctx.args.validate_dict and ctx.args.mode != AnonMode.SYNC_DATA_DUMP:
-            ctx.logger.info("-------------> Started pg_dump")
-            await run_pg_dump(ctx, 'pre-data')
-            await run_pg_dump(ctx, 'post-data')
-            ctx.logger.info("<------------- Finished pg_dump")
+            for section in ['pre-data', 'post-data']:
+                if resuming and section in ctx.ledger.sections:
+                    ctx.logger.info("Section %s is already dumped" % section)
+                else:
+                    sections.append(section)
     except:
         ctx.logger.error("<------------- make_dump failed\n" + exception_helper())
         result.result_code = ResultCode.FAIL
@@ -403,14 +1123,23 @@ async def make_dump(ctx):
 
     result.result_code = ResultCode.DONE
 
-    if ctx.args.mode != AnonMode.SYNC_STRUCT_DUMP:
+    if ctx.args.mode == AnonMode.SYNC_STRUCT_DUMP:
+        try:
+            await wait_all([run_pg_dump(ctx, section) for section in sections])
+        except:
+            ctx.logger.error("<------------- make_dump failed\n" + exception_helper())
+            result.result_code = ResultCode.FAIL
+            return result
+    else:
+        # pg_dump of schema sections runs concurrently with the data export in the same snapshot
         db_conn = await asyncpg.connect(**ctx.conn_params)
-        tr = db_conn.transaction()
+        tr = db_conn.transaction(isolation='repeatable_read')
         await tr.start()
         try:
-            await db_conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ;")
             sn_id = await db_conn.fetchval("select pg_export_snapshot()")
-            await make_dump_impl(ctx, db_conn, sn_id)
+            await wait_all(
+                [run_pg_dump(ctx, section, sn_id) for section in sections] + [make_dump_impl(ctx, db_conn, sn_id)]
+            )
         except:
             ctx.logger.error("<------------- make_dump failed\n" + exception_helper())
             result.result_code = ResultCode.FAIL
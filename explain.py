@@ -0,0 +1,46 @@
+import json
+from common import *
+
+# sequential scans of smaller relations inside joins are not reported
+EXPLAIN_SEQ_SCAN_ROWS = 10000
+
+JOIN_NODES = ("Hash Join", "Merge Join", "Nested Loop")
+
+
+async def explain_query(db_conn, query):
+    # plan of the query without executing it, errors of the query don't abort the transaction of the worker
+    await db_conn.execute("SAVEPOINT pg_anon_explain")
+    try:
+        res = await db_conn.fetchval("EXPLAIN (FORMAT JSON, VERBOSE) %s" % query)
+    except:
+        await db_conn.execute("ROLLBACK TO SAVEPOINT pg_anon_explain")
+        raise
+    await db_conn.execute("RELEASE SAVEPOINT pg_anon_explain")
+    return json.loads(res)[0]["Plan"]
+
+
+def walk_plan(node, parents=()):
+    yield node, parents
+    for v in node.get("Plans", []):
+        yield from walk_plan(v, parents + (node,))
+
+
+def get_plan_warnings(plan, raw_sql):
+    warnings = []
+    for node, parents in walk_plan(plan):
+        if raw_sql and node["Node Type"] == "Seq Scan" and node.get("Plan Rows", 0) >= EXPLAIN_SEQ_SCAN_ROWS:
+            joins = [v["Node Type"] for v in parents if v["Node Type"] in JOIN_NODES]
+            if joins:
+                warnings.append("Seq Scan on \"%s\".\"%s\" (~%s rows) inside %s" % (
+                    node.get("Schema", ""), node["Relation Name"], node["Plan Rows"], joins[-1])
+                )
+        if node.get("Parent Relationship") == "SubPlan":
+            warnings.append("SubPlan \"%s\" is executed for each row" % node.get("Subplan Name", ""))
+    return warnings
+
+
+def get_plan_estimate(plan):
+    # cost and rows of the full query, the LIMIT of validation queries is not taken into account
+    if plan["Node Type"] == "Limit" and plan.get("Plans"):
+        plan = plan["Plans"][0]
+    return plan["Total Cost"], plan["Plan Rows"]
@@ -0,0 +1,144 @@
+import sqlite3
+import time
+from common import *
+
+HISTORY_FILE = "history.sqlite"
+
+
+class RunHistory:
+    # Per-table timings of finished runs in a local SQLite file (log/history.sqlite by default).
+    # Used by --plan and by the schedulers of dump and restore to order tasks by recorded durations
+    # instead of table sizes. "size" of a task is the estimated relation size for dump and pipe,
+    # the data file size for restore; "output_size" is the size of the written data file
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.conn = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        self.conn = sqlite3.connect(self.file_name)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                operation TEXT NOT NULL,
+                db_host TEXT,
+                db_name TEXT,
+                dict_file TEXT,
+                threads INTEGER,
+                started REAL,
+                finished REAL,
+                result_code TEXT
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                run_id INTEGER NOT NULL REFERENCES runs(id),
+                schema_name TEXT,
+                table_name TEXT,
+                file_name TEXT,
+                size INTEGER,
+                rows INTEGER,
+                bytes INTEGER,
+                output_size INTEGER,
+                elapsed REAL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_table_idx ON tasks (schema_name, table_name);
+        """)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.conn.close()
+        self.conn = None
+
+    def add_run(self, ctx, operation, started, result_code, tasks):
+        with self.conn:
+            cur = self.conn.execute("""
+                INSERT INTO runs (operation, db_host, db_name, dict_file, threads, started, finished, result_code)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                operation, ctx.args.db_host, ctx.args.db_name, ctx.args.dict_file, ctx.args.threads,
+                started, time.time(), str(result_code)
+            ))
+            self.conn.executemany("""
+                INSERT INTO tasks (run_id, schema_name, table_name, file_name, size, rows, bytes, output_size, elapsed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                cur.lastrowid, v["schema"], v["table"], v["file"], v["size"], v["rows"], v["bytes"],
+                v["output_size"], v["elapsed"]
+            ) for v in tasks])
+            return cur.lastrowid
+
+    def get_table_stats(self, operation):
+        # totals of each table from the latest successful run which contains the table
+        query_res = self.conn.execute("""
+            SELECT t.schema_name, t.table_name, SUM(t.elapsed), SUM(t.size), SUM(t.rows), SUM(t.output_size)
+            FROM tasks t
+            JOIN (
+                SELECT t.schema_name, t.table_name, MAX(t.run_id) AS run_id
+                FROM tasks t
+                JOIN runs r ON r.id = t.run_id
+                WHERE r.operation = ? AND r.result_code = ?
+                GROUP BY t.schema_name, t.table_name
+            ) l ON l.schema_name = t.schema_name AND l.table_name = t.table_name AND l.run_id = t.run_id
+            GROUP BY t.schema_name, t.table_name
+        """, (operation, str(ResultCode.DONE))).fetchall()
+        return {(v[0], v[1]): {"elapsed": v[2], "size": v[3], "rows": v[4], "output_size": v[5]} for v in query_res}
+
+
+def get_history_file(ctx):
+    if ctx.args.history_file:
+        return ctx.args.history_file
+    return os.path.join(ctx.current_dir, 'log', HISTORY_FILE)
+
+
+def get_rate(stats, unit):
+    # seconds per byte or per row, None without measurable history
+    elapsed = sum([v["elapsed"] or 0 for v in stats])
+    amount = sum([v[unit] or 0 for v in stats])
+    return elapsed / amount if amount > 0 and elapsed > 0 else None
+
+
+def load_history_stats(ctx, operation):
+    # per-table stats of the operation, None if history is disabled or empty
+    if ctx.args.disable_history or not os.path.exists(get_history_file(ctx)):
+        return None
+    try:
+        with RunHistory(get_history_file(ctx)) as history:
+            stats = history.get_table_stats(operation)
+    except sqlite3.Error:
+        ctx.logger.warning("Can't read run history:\n" + exception_helper(show_traceback=False))
+        return None
+    return stats if stats else None
+
+
+def predict_durations(ctx, stats, items, unit):
+    # items: key -> (schema, table, amount of "unit" - "size" or "rows"), returns key -> predicted seconds
+    # or None without usable history. Tables without history use the average rate of the other tables
+    if stats is None:
+        return None
+    avg_rate = get_rate(stats.values(), unit)
+    if avg_rate is None:
+        return None
+
+    durations = {}
+    for k, (schema, table, amount) in items.items():
+        rate = get_rate([stats[(schema, table)]], unit) if (schema, table) in stats else None
+        durations[k] = (amount or 0) * (rate if rate is not None else avg_rate)
+    ctx.logger.info("Durations of %s task(s) are predicted by history of %s table(s)" % (
+        len(items), len(set([(v[0], v[1]) for v in items.values() if (v[0], v[1]) in stats])))
+    )
+    return durations
+
+
+def format_duration(seconds):
+    return "%.1fs" % seconds
+
+
+def record_run_history(ctx, operation, started, result_code, tasks):
+    if ctx.args.disable_history or ctx.args.validate_dict or ctx.args.validate_full:
+        return
+    try:
+        with RunHistory(get_history_file(ctx)) as history:
+            run_id = history.add_run(ctx, operation, started, result_code, tasks)
+        ctx.logger.info("Run %s with %s task(s) saved to history %s" % (run_id, len(tasks), get_history_file(ctx)))
+    except sqlite3.Error:
+        ctx.logger.warning("Can't save run history:\n" + exception_helper(show_traceback=False))
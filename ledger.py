@@ -0,0 +1,84 @@
+import hashlib
+from datetime import datetime
+from common import *
+
+DUMP_LEDGER_FILE = "dump.ledger"
+RESTORE_LEDGER_FILE = "restore_%s.ledger"     # one per target database
+
+
+def get_file_checksum(file_name, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_file_stat(file_name, checksum=True):
+    # [size, sha256] of a file, None if the file is not reachable from here (written by a remote server).
+    # The checksum reads the whole file
+    if not os.path.exists(file_name):
+        return [None, None]
+    if not checksum or not os.access(file_name, os.R_OK):
+        return [os.path.getsize(file_name), None]
+    return [os.path.getsize(file_name), get_file_checksum(file_name)]
+
+
+class Ledger:
+    # Append-only journal of finished work in a dump or restore directory. Each record is a JSON line,
+    # flushed and fsync'ed when written, so after a crash the journal lists everything that was finished.
+    # Record types: "run" (start of a run), "section" (pg_dump/pg_restore section), "file" (data file).
+    # File records of restore have "state": pending, loading, done (with "rows") or failed (with "error"),
+    # the last record of a file is its current state
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.runs = []
+        self.sections = {}
+        self.files = {}
+
+    def exists(self):
+        return os.path.exists(self.file_name)
+
+    def load(self):
+        if not self.exists():
+            return self
+        with open(self.file_name, "r") as f:
+            lines = f.readlines()
+        for num, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if num == len(lines) - 1:
+                    break   # the last line was not fully written
+                raise Exception("Ledger %s is damaged at line %s" % (self.file_name, num + 1))
+            self.apply(record)
+        return self
+
+    def apply(self, record):
+        if record["type"] == "run":
+            self.runs.append(record)
+        elif record["type"] == "section":
+            self.sections[record["name"]] = record
+        elif record["type"] == "file":
+            self.files[record["name"]] = record
+
+    def write(self, record_type, **kwargs):
+        return self.write_many(record_type, [kwargs])[0]
+
+    def write_many(self, record_type, items):
+        # records of the items are written with one fsync
+        now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        records = [dict({"type": record_type, "time": now}, **v) for v in items]
+        with open(self.file_name, "a") as f:
+            f.write("".join([json.dumps(v) + "\n" for v in records]))
+            f.flush()
+            os.fsync(f.fileno())
+        for v in records:
+            self.apply(v)
+        return records
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.file_name)
+        self.runs, self.sections, self.files = [], {}, {}
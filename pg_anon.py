@@ -1,9 +1,14 @@
 import argparse
+import copy
 import logging
 from logging.handlers import RotatingFileHandler
 from dump import *
 from restore import *
 from create_dict import *
+from pipe import *
+from plan import *
+from verify import *
+from profile_dict import *
 
 
 PG_ANON_VERSION = '23.7.28'     # year month day
@@ -19,6 +24,15 @@ class OutputFormat(BasicEnum, Enum):
     TEXT = 'text'
 
 
+class ArgumentParser(argparse.ArgumentParser):
+    # checks of option combinations, so they fail before any work is started
+    def parse_args(self, args=None, namespace=None):
+        args = super().parse_args(args, namespace)
+        if args.client_side_dump and get_client_codec_error(args.compress) is not None:
+            self.error(get_client_codec_error(args.compress))
+        return args
+
+
 class Context:
     @exception_handler
     def __init__(self, args):
@@ -30,8 +44,16 @@ class Context:
         self.dictionary_obj = {}
         self.metadata = None            # for restore process
         self.task_results = {}          # for dump process (key is hash() of SQL query)
+        self.task_file_stats = {}       # for dump process with --client-side-dump, [size, sha256] of the file
+        self.task_costs = {}            # for dump process (key is hash() of SQL query), estimated size in bytes
+        self.compress_executor = None   # for dump process with --client-side-dump
+        self.prev_watermarks = {}       # for sync-data-dump, (schema, table) -> watermark of the previous run
+        self.ledger = None              # journal of dump or restore files for --resume
+        self.subset = None              # for dump/pipe processes with "subset" in the dictionary, see subset.py
+        self.progress = None            # for dump/restore/pipe processes, see progress.py
         self.total_rows = 0
         self.create_dict_matches = {}   # for create-dict mode
+        self.scan_timings = {}          # for create-dict mode, (schema, table) -> seconds of scanning
         self.exclude_schemas = ["anon_funcs", "columnar_internal"]
 
         if args.db_user_password == '' and os.environ.get('PGPASSWORD') is not None:
@@ -59,9 +81,19 @@ class Context:
                 'ssl_ca_file': args.db_ssl_ca_file,
             })
 
+    def get_target_context(self):
+        # context of the target database in pipe mode, connection options which are not set are taken from source
+        args = copy.copy(self.args)
+        for v in ["db_host", "db_port", "db_name", "db_user", "db_user_password"]:
+            if getattr(self.args, "target_" + v) is not None:
+                setattr(args, v, getattr(self.args, "target_" + v))
+        ctx = Context(args)
+        ctx.logger = self.logger
+        return ctx
+
     @staticmethod
     def get_arg_parser():
-        parser = argparse.ArgumentParser()
+        parser = ArgumentParser()
         parser.add_argument(
             "--version",
             help="Show the version number and exit",
@@ -98,6 +130,36 @@ class Context:
             type=str,
             default=''
         )
+        parser.add_argument(
+            "--target-db-host",
+            type=str,
+            default=None,
+            help="""Target database of --mode=pipe (default: --db-host)"""
+        )
+        parser.add_argument(
+            "--target-db-port",
+            type=str,
+            default=None,
+            help="""Target database of --mode=pipe (default: --db-port)"""
+        )
+        parser.add_argument(
+            "--target-db-name",
+            type=str,
+            default=None,
+            help="""Target database of --mode=pipe"""
+        )
+        parser.add_argument(
+            "--target-db-user",
+            type=str,
+            default=None,
+            help="""Target database of --mode=pipe (default: --db-user)"""
+        )
+        parser.add_argument(
+            "--target-db-user-password",
+            type=str,
+            default=None,
+            help="""Target database of --mode=pipe (default: --db-user-password)"""
+        )
         parser.add_argument(
             "--db-passfile",
             type=str,
@@ -188,11 +250,105 @@ class Context:
             default=False,
             help="""Same as "--validate-dict" + data export with limit"""
         )
+        parser.add_argument(
+            "--dump-slice-threshold",
+            type=float,
+            default=0,
+            help="""Tables larger than this size (in MB) are dumped in parallel by ctid ranges, each range to its
+                own file. Requires PostgreSQL 14+. Disabled by default"""
+        )
+        parser.add_argument(
+            "--dump-slices",
+            type=int,
+            default=0,
+            help="""Number of slices for tables above "--dump-slice-threshold" (default: value of "--threads")"""
+        )
+        parser.add_argument(
+            "--client-side-dump",
+            action='store_true',
+            default=False,
+            help="""Stream COPY output to the client and compress it there instead of "COPY ... TO PROGRAM" on the
+                database server. Does not require superuser rights or a directory shared with the server"""
+        )
+        parser.add_argument(
+            "--skip-checksum",
+            action='store_true',
+            default=False,
+            help="""Don't read back the data files written by the database server to compute their sha256
+                (files of --client-side-dump are hashed while they are written). Verify then checks
+                sizes and rows only"""
+        )
+        parser.add_argument(
+            "--compress",
+            type=CompressCodec,
+            choices=list(CompressCodec),
+            default=CompressCodec.GZIP.value,
+            help="""Compression codec for data files, can be overwritten by "compress" in dictionary entries"""
+        )
+        parser.add_argument(
+            "--compress-level",
+            type=int,
+            default=None,
+            help="""Compression level (default: gzip/pigz 6, zstd 3, lz4 1), can be overwritten by
+                "compress_level" in dictionary entries"""
+        )
+        parser.add_argument(
+            "--compress-threads",
+            type=int,
+            default=0,
+            help="""Threads per file for pigz and zstd (default: codec default)"""
+        )
         parser.add_argument(
             "--clear-output-dir",
             action='store_true',
             default=False
         )
+        parser.add_argument(
+            "--resume",
+            help="""Continue an interrupted dump in the output directory: files listed in its ledger are kept,
+                the other tables are exported with a new snapshot. In restore mode continue an interrupted
+                or failed restore: incomplete tables are truncated and loaded again""",
+            action='store_true',
+            default=False
+        )
+        parser.add_argument(
+            "--reset-watermarks",
+            help="""In sync-data-dump mode ignore watermarks of the previous dump and dump tables in full""",
+            action='store_true',
+            default=False
+        )
+        parser.add_argument(
+            "--progress-interval",
+            type=float,
+            default=10,
+            help="""Interval in seconds of progress reports in dump, restore and pipe modes, 0 disables
+                periodic reports (default: %(default)s)"""
+        )
+        parser.add_argument(
+            "--progress-file",
+            type=str,
+            default='',
+            help="""Append progress reports to this file as JSON lines"""
+        )
+        parser.add_argument(
+            "--plan",
+            action='store_true',
+            default=False,
+            help="""Print the predicted schedule, duration and disk usage of dump, restore or pipe based on
+                history of previous runs and current table sizes, without moving data"""
+        )
+        parser.add_argument(
+            "--history-file",
+            type=str,
+            default='',
+            help="""SQLite file with per-table timings of previous runs (default: log/%s)""" % HISTORY_FILE
+        )
+        parser.add_argument(
+            "--disable-history",
+            action='store_true',
+            default=False,
+            help="""Don't save the run to history and don't use history for scheduling"""
+        )
         parser.add_argument(
             "--drop-custom-check-constr",
             action='store_true',
@@ -205,6 +361,35 @@ class Context:
             help="""Initialize sequences based on maximum values. Otherwise, the sequences will be initialized
                 based on the values of the source database."""
         )
+        parser.add_argument(
+            "--fast-load",
+            action='store_true',
+            default=False,
+            help="""In restore mode load each table in one transaction with TRUNCATE and COPY FREEZE, with
+                synchronous_commit=off and session_replication_role=replica (requires superuser). No snapshot
+                is imported by the loading sessions"""
+        )
+        parser.add_argument(
+            "--fast-load-unlogged",
+            action='store_true',
+            default=False,
+            help="""With "--fast-load" switch tables to UNLOGGED during the load and back to LOGGED before
+                post-data"""
+        )
+        parser.add_argument(
+            "--pipeline-post-data",
+            action='store_true',
+            default=False,
+            help="""In restore mode build indexes and constraints of each table as soon as the table is loaded,
+                the rest of post-data is restored after the load"""
+        )
+        parser.add_argument(
+            "--quick-analyze",
+            action='store_true',
+            default=False,
+            help="""In restore mode analyze only columns of indexes and foreign keys right after each table is loaded,
+                the full ANALYZE runs in the background of post-data"""
+        )
         parser.add_argument(
             "--disable-checks",
             action='store_true',
@@ -224,6 +409,12 @@ class Context:
             default=ScanMode.PARTIAL.value,
             help="In '--create-dict' mode defines whether to scan all data or only part of it"
         )
+        parser.add_argument(
+            "--profile-rows",
+            type=int,
+            default=1000,
+            help="In '--mode=profile-dict' number of sampled rows per table (default: %(default)s)"
+        )
         parser.add_argument(
             "--output-dict-file",
             type=str,
@@ -355,6 +546,17 @@ class MainRoutine:
             self.ctx.logger.info(params_info)
 
         result = PgAnonResult()
+        if self.ctx.args.mode == AnonMode.VERIFY:
+            # only files are checked, the database is not used
+            try:
+                result = await verify_dump(self.ctx)
+                self.ctx.logger.info("MainRoutine.run result_code = %s" % result.result_code)
+            except:
+                self.ctx.logger.error(exception_helper(show_traceback=True))
+            finally:
+                self.ctx.logger.info("<============ Finished MainRoutine.run in mode: %s" % self.ctx.args.mode)
+                return result
+
         try:
             db_conn = await asyncpg.connect(**self.ctx.conn_params)
             self.ctx.pg_version = await db_conn.fetchval("select version()")
@@ -370,17 +572,27 @@ class MainRoutine:
             result.result_code = ResultCode.FAIL
             return result
 
+        started = time.time()
         try:
-            if self.ctx.args.mode in (AnonMode.DUMP, AnonMode.SYNC_DATA_DUMP, AnonMode.SYNC_STRUCT_DUMP):
+            if self.ctx.args.plan:
+                result = await make_plan(self.ctx)
+            elif self.ctx.args.mode in (AnonMode.DUMP, AnonMode.SYNC_DATA_DUMP, AnonMode.SYNC_STRUCT_DUMP):
                 result = await make_dump(self.ctx)
             elif self.ctx.args.mode in (AnonMode.RESTORE, AnonMode.SYNC_DATA_RESTORE, AnonMode.SYNC_STRUCT_RESTORE):
                 result = await make_restore(self.ctx)
-                if self.ctx.args.mode != AnonMode.SYNC_STRUCT_RESTORE:
-                    await run_analyze(self.ctx)
+            elif self.ctx.args.mode == AnonMode.PIPE:
+                if self.ctx.args.target_db_name is None:
+                    raise Exception("Option --target-db-name is required in mode %s" % self.ctx.args.mode)
+                target_ctx = self.ctx.get_target_context()
+                result = await make_pipe(self.ctx, target_ctx)
+                if result.result_code == ResultCode.DONE:
+                    await run_analyze(target_ctx)
             elif self.ctx.args.mode == AnonMode.INIT:
                 result = await make_init(self.ctx)
             elif self.ctx.args.mode == AnonMode.CREATE_DICT:
                 result = await create_dict(self.ctx)
+            elif self.ctx.args.mode == AnonMode.PROFILE_DICT:
+                result = await profile_dict(self.ctx)
             else:
                 raise Exception("Unknown mode: " + self.ctx.args.mode)
 
@@ -388,9 +600,26 @@ class MainRoutine:
         except:
             self.ctx.logger.error(exception_helper(show_traceback=True))
         finally:
+            self.save_history(started, result)
             self.ctx.logger.info("<============ Finished MainRoutine.run in mode: %s" % self.ctx.args.mode)
             return result
 
+    def save_history(self, started, result):
+        if self.ctx.args.plan:
+            return
+        if self.ctx.progress is not None:
+            tasks = self.ctx.progress.get_task_records()
+        elif self.ctx.args.mode == AnonMode.CREATE_DICT:
+            tasks = [
+                {
+                    "schema": k[0], "table": k[1], "file": None, "size": None, "rows": None, "bytes": None,
+                    "output_size": None, "elapsed": v
+                } for k, v in self.ctx.scan_timings.items()
+            ]
+        else:
+            return
+        record_run_history(self.ctx, str(self.ctx.args.mode), started, result.result_code, tasks)
+
     async def validate_target_tables(self) -> PgAnonResult:
         result = PgAnonResult()
         try:
@@ -0,0 +1,152 @@
+import tempfile
+from dump import *
+from restore import *
+
+
+async def pipe_obj_func(ctx, source_conn, target_conn, task, file_info):
+    ctx.logger.info('================> Started task %s' % str(task))
+    ctx.progress.start_task(task, source_conn)
+
+    copy_options = get_copy_format_options(ctx)
+    pipe = CopyPipe()
+
+    async def write(data):
+        ctx.progress.add_bytes(task, len(data))
+        await pipe.write(data)
+
+    async def copy_from_source():
+        res = await source_conn.copy_from_query(task, output=write, **copy_options)
+        await pipe.close()
+        return res
+
+    async def copy_to_target():
+        return await target_conn.copy_to_table(
+            file_info["table"],
+            schema_name=file_info["schema"],
+            source=pipe.chunks(),
+            **copy_options
+        )
+
+    try:
+        async with target_conn.transaction():
+            source_res, target_res = await wait_all([copy_from_source(), copy_to_target()])
+        source_rows = re.findall(r"(\d+)", source_res)[0]
+        target_rows = re.findall(r"(\d+)", target_res)[0]
+        if source_rows != target_rows:
+            raise Exception("Copied %s rows of %s rows" % (target_rows, source_rows))
+        ctx.task_results[hash(task)] = source_rows
+        ctx.progress.finish_task(task, source_rows)
+        ctx.logger.debug("COPY %s [rows] Task: %s " % (source_rows, str(task)))
+    except Exception as e:
+        ctx.logger.error("Exception in pipe_obj_func:\n" + exception_helper())
+        raise Exception("Can't execute task: %s" % task)
+
+    ctx.logger.info('<================ Finished task %s' % str(task))
+
+
+async def make_pipe_impl(ctx, target_ctx, db_conn, sn_id):
+    catalog = await Catalog().load(ctx, db_conn)
+    if "subset" in ctx.dictionary_obj:
+        ctx.subset = await Subset(ctx, db_conn, catalog).build()
+    queries, files = await generate_dump_queries(ctx, db_conn, catalog)
+    if not queries:
+        raise Exception("No objects for pipe!")
+
+    query_files = dict(zip([hash(v) for v in queries], files))
+    queries = schedule_dump_queries(ctx, "Pipe", queries, files, query_files)
+
+    target_pool = await asyncpg.create_pool(
+        **target_ctx.conn_params,
+        min_size=ctx.args.threads,
+        max_size=ctx.args.threads
+    )
+
+    async def pipe_task(source_conn, query):
+        if ctx.subset is not None:
+            await ctx.subset.prepare_task(source_conn, files[query_files[hash(query)]])
+        async with target_pool.acquire() as target_conn:
+            await pipe_obj_func(ctx, source_conn, target_conn, query, files[query_files[hash(query)]])
+
+    ctx.progress = make_task_progress(ctx, "pipe", catalog, queries, files, query_files)
+    ctx.progress.start()
+    try:
+        await run_snapshot_workers(ctx, sn_id, queries, pipe_task)
+    finally:
+        await ctx.progress.stop()
+        await target_pool.close()
+
+    for v in queries:
+        files[query_files[hash(v)]]["rows"] = ctx.task_results[hash(v)]
+
+    # the same structure as metadata.json of dump, used by seq_init and run_analyze for the target database
+    target_ctx.metadata = {
+        "files": files,
+        "seq_lastvals": get_seq_lastvals(catalog, set([(v["schema"], v["table"]) for v in files.values()])),
+        "total_rows": sum([int(v["rows"]) for v in files.values()])
+    }
+    target_ctx.total_rows = target_ctx.metadata["total_rows"]
+
+
+async def make_pipe_stages(ctx, target_ctx):
+    read_dictionary(ctx)
+
+    target_conn = await asyncpg.connect(**target_ctx.conn_params)
+    try:
+        target_ctx.pg_version = re.findall(r"(\d+\.\d+)", str(await target_conn.fetchval("select version()")))[0]
+        if not await is_db_empty(target_conn):
+            raise Exception("Target DB is not empty!")
+        if not ctx.args.disable_checks and \
+                get_major_version(target_ctx.pg_version) < get_major_version(ctx.pg_version):
+            raise Exception(
+                "Target PostgreSQL major version %s is below than source %s!" % (target_ctx.pg_version, ctx.pg_version)
+            )
+    finally:
+        await target_conn.close()
+
+    # only pre-data and post-data sections are written to disk
+    with tempfile.TemporaryDirectory(prefix="pg_anon_pipe_") as schema_dir:
+        ctx.args.output_dir = schema_dir
+        target_ctx.args.input_dir = schema_dir
+
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        tr = db_conn.transaction(isolation='repeatable_read')
+        await tr.start()
+        try:
+            sn_id = await db_conn.fetchval("select pg_export_snapshot()")
+            post_data_dump = asyncio.ensure_future(run_pg_dump(ctx, 'post-data', sn_id))
+            try:
+                await run_pg_dump(ctx, 'pre-data', sn_id)
+                await run_pg_restore(target_ctx, 'pre-data')
+                if ctx.args.drop_custom_check_constr:
+                    target_conn = await asyncpg.connect(**target_ctx.conn_params)
+                    try:
+                        await drop_custom_check_constraints(target_ctx, target_conn)
+                    finally:
+                        await target_conn.close()
+            except:
+                post_data_dump.cancel()
+                raise
+            await wait_all([post_data_dump, make_pipe_impl(ctx, target_ctx, db_conn, sn_id)])
+        finally:
+            await tr.rollback()
+            await db_conn.close()
+
+        await run_pg_restore(target_ctx, 'post-data')
+
+    await seq_init(target_ctx)
+
+
+async def make_pipe(ctx, target_ctx):
+    result = PgAnonResult()
+    ctx.logger.info("-------------> Started pipe mode")
+
+    try:
+        await make_pipe_stages(ctx, target_ctx)
+    except:
+        ctx.logger.error("<------------- make_pipe failed\n" + exception_helper())
+        result.result_code = ResultCode.FAIL
+        return result
+
+    result.result_code = ResultCode.DONE
+    ctx.logger.info("<------------- Finished pipe mode")
+    return result
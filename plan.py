@@ -0,0 +1,177 @@
+import heapq
+from dump import *
+from restore import *
+
+
+def simulate_schedule(ordered, cost_func, workers):
+    # the same assignment as lpt_schedule: each next task goes to the least loaded worker
+    loads = [(0, n + 1) for n in range(max(int(workers), 1))]
+    schedule = []
+    for v in ordered:
+        start, worker = heapq.heappop(loads)
+        schedule.append({"task": v, "worker": worker, "start": start, "duration": cost_func(v)})
+        heapq.heappush(loads, (start + cost_func(v), worker))
+    return schedule
+
+
+def get_output_ratio(stats, key):
+    # data file size / relation size of the table, average of all tables, or 1 without history
+    def ratio(values):
+        size = sum([v["size"] or 0 for v in values])
+        output_size = sum([v["output_size"] or 0 for v in values])
+        return output_size / size if size > 0 and output_size > 0 else None
+
+    if stats is None:
+        return 1.0
+    table_ratio = ratio([stats[key]]) if key in stats else None
+    if table_ratio is not None:
+        return table_ratio
+    avg_ratio = ratio(stats.values())
+    return avg_ratio if avg_ratio is not None else 1.0
+
+
+def log_plan(ctx, plan):
+    ctx.logger.info("Plan of %s: %s task(s) on %s worker(s), predicted duration %s, peak disk usage %s (%s)" % (
+            plan["mode"],
+            len(plan["tasks"]),
+            plan["threads"],
+            format_duration(plan["duration"]) if plan["duration"] is not None else "unknown (no history)",
+            pretty_size(plan["disk_usage"]),
+            plan["disk_usage_location"]
+        )
+    )
+    for v in plan["tasks"]:
+        ctx.logger.info("  worker %s: %s -> %s  %s.%s (%s)%s" % (
+                v["worker"],
+                format_duration(v["start"]) if v["start"] is not None else "?",
+                format_duration(v["start"] + v["duration"]) if v["start"] is not None else "?",
+                v["schema"],
+                v["table"],
+                v["file"],
+                "" if v["history"] else " no history"
+            )
+        )
+
+
+async def plan_dump(ctx):
+    read_dictionary(ctx)
+    if ctx.args.mode == AnonMode.SYNC_DATA_DUMP and not ctx.args.reset_watermarks:
+        load_prev_watermarks(ctx, get_dump_output_dir(ctx))
+    db_conn = await asyncpg.connect(**ctx.conn_params)
+    try:
+        catalog = await Catalog().load(ctx, db_conn)
+        queries, files = await generate_dump_queries(ctx, db_conn, catalog)
+    finally:
+        await db_conn.close()
+    if not queries:
+        raise Exception("No objects for dump!")
+
+    query_files = dict(zip([hash(v) for v in queries], files))
+    stats = load_history_stats(ctx, str(ctx.args.mode))
+    durations = predict_durations(ctx, stats, {
+        hash(v): (files[query_files[hash(v)]]["schema"], files[query_files[hash(v)]]["table"], ctx.task_costs[hash(v)])
+        for v in queries
+    }, "size")
+    if durations is not None:
+        cost_func = lambda v: durations[hash(v)]
+    else:
+        cost_func = lambda v: ctx.task_costs[hash(v)]
+    ordered, makespan = lpt_schedule(queries, cost_func, ctx.args.threads)
+
+    tasks = []
+    for v in simulate_schedule(ordered, cost_func, ctx.args.threads):
+        file_info = files[query_files[hash(v["task"])]]
+        key = (file_info["schema"], file_info["table"])
+        tasks.append({
+            "file": query_files[hash(v["task"])],
+            "schema": key[0],
+            "table": key[1],
+            "worker": v["worker"],
+            "start": v["start"] if durations is not None else None,
+            "duration": v["duration"] if durations is not None else None,
+            "size": ctx.task_costs[hash(v["task"])],
+            "output_size": int(ctx.task_costs[hash(v["task"])] * get_output_ratio(stats, key)),
+            "history": stats is not None and key in stats
+        })
+
+    if ctx.args.mode == AnonMode.PIPE:
+        # nothing is written on this side, the target grows by the size of tables with indexes
+        tables = set([(v["schema"], v["table"]) for v in files.values()])
+        disk_usage = sum([t["total_size"] for v in tables for t in catalog.get_data_tables(catalog.get_table(*v))])
+        disk_usage_location = "target database"
+    else:
+        disk_usage = sum([v["output_size"] for v in tasks])
+        disk_usage_location = "output directory"
+
+    return {
+        "mode": str(ctx.args.mode),
+        "threads": ctx.args.threads,
+        "duration": makespan if durations is not None else None,
+        "disk_usage": disk_usage,
+        "disk_usage_location": disk_usage_location,
+        "tasks": tasks
+    }
+
+
+def plan_restore(ctx):
+    if ctx.args.input_dir.find("""/""") == -1 and ctx.args.input_dir.find("""\\""") == -1:
+        ctx.args.input_dir = os.path.join(ctx.current_dir, 'output', ctx.args.input_dir)
+    with open(os.path.join(ctx.args.input_dir, 'metadata.json'), 'r') as f:
+        ctx.metadata = json.loads(f.read())
+
+    stats = load_history_stats(ctx, str(ctx.args.mode))
+    durations = predict_durations(ctx, stats, {
+        file_name: (v["schema"], v["table"], int(v["rows"])) for file_name, v in ctx.metadata['files'].items()
+    }, "rows")
+    if durations is not None:
+        cost_func = lambda v: durations[v]
+    else:
+        cost_func = lambda v: int(ctx.metadata['files'][v]["rows"])
+    ordered, makespan = lpt_schedule(ctx.metadata['files'], cost_func, ctx.args.threads)
+
+    tasks = []
+    for v in simulate_schedule(ordered, cost_func, ctx.args.threads):
+        file_info = ctx.metadata['files'][v["task"]]
+        tasks.append({
+            "file": v["task"],
+            "schema": file_info["schema"],
+            "table": file_info["table"],
+            "worker": v["worker"],
+            "start": v["start"] if durations is not None else None,
+            "duration": v["duration"] if durations is not None else None,
+            "rows": int(file_info["rows"]),
+            "history": stats is not None and (file_info["schema"], file_info["table"]) in stats
+        })
+
+    return {
+        "mode": str(ctx.args.mode),
+        "threads": ctx.args.threads,
+        "duration": makespan if durations is not None else None,
+        "disk_usage": ctx.metadata.get("total_tables_size", 0),
+        "disk_usage_location": "target database",
+        "tasks": tasks
+    }
+
+
+async def make_plan(ctx):
+    # predicted schedule, duration and disk usage of the run, no data is moved
+    result = PgAnonResult()
+    ctx.logger.info("-------------> Started plan of %s mode" % ctx.args.mode)
+
+    try:
+        if ctx.args.mode in (AnonMode.DUMP, AnonMode.SYNC_DATA_DUMP, AnonMode.PIPE):
+            plan = await plan_dump(ctx)
+        elif ctx.args.mode in (AnonMode.RESTORE, AnonMode.SYNC_DATA_RESTORE):
+            plan = plan_restore(ctx)
+        else:
+            raise Exception("Option --plan is not supported in mode %s" % ctx.args.mode)
+        log_plan(ctx, plan)
+    except:
+        ctx.logger.error("<------------- make_plan failed\n" + exception_helper())
+        result.result_code = ResultCode.FAIL
+        return result
+
+    result.result_code = ResultCode.DONE
+    result.result_data = plan
+    ctx.logger.info("<------------- Finished plan")
+    return result
@@ -0,0 +1,170 @@
+import heapq
+import os
+import tempfile
+import time
+import asyncpg
+from common import *
+
+# types of TOC entries which are built as soon as their table is loaded
+POST_DATA_TABLE_TYPES = ("INDEX", "CONSTRAINT")
+
+TOC_LINE_RE = re.compile(r"^(\d+); (\d+) (\d+) (INDEX ATTACH|FK CONSTRAINT|INDEX|CONSTRAINT) ")
+TOC_ENTRY_RE = re.compile(r"^--\n-- TOC entry (\d+) \(class \d+ OID \d+\)\n", re.MULTILINE)
+
+
+class PostDataPipeline:
+    # Indexes and constraints of the post-data section are built as soon as all files of their table are loaded,
+    # instead of one "pg_restore --section post-data" pass after the whole load. TOC entries ("pg_restore -l")
+    # are mapped to tables by catalog ids of the source database recorded by dump in "post_data_tables" of
+    # metadata.json, the SQL of each entry is taken from the script of "pg_restore -v" split by "TOC entry" headers.
+    # Ready entries are built largest table first. Foreign keys, indexes of partitioned tables, triggers and other
+    # entries, and entries which failed here are restored by "pg_restore -L" with the rest of the TOC at the end
+
+    def __init__(self, ctx, unlogged_tables=None):
+        self.ctx = ctx
+        self.unlogged_tables = unlogged_tables or set()    # tables switched to LOGGED before their builds
+        self.work_dir = None
+        self.toc = []           # lines of the TOC list
+        self.entries = {}       # dump id -> {"table", "type", "sql"}
+        self.tables = {}        # (schema, table) -> dump ids of entries in TOC order
+        self.costs = {}         # (schema, table) -> size of the files
+        self.files_left = {}    # (schema, table) -> files not loaded yet
+        self.failed = set()     # tables with failed files, their entries are left to the final pass
+        self.built = set()      # dump ids of built entries
+        self.ready = []         # heap of (-cost, seq, kind, item)
+        self.seq = 0
+        self.preamble = ""
+        self.pool = None
+        self.build_time = 0
+
+    def get_archive(self):
+        return os.path.join(self.ctx.args.input_dir, "post_data.backup")
+
+    async def run_pg_restore_to_file(self, args, file_name, name):
+        command = [self.ctx.args.pg_restore, *args, "-f", file_name, self.get_archive()]
+        returncode, out, err = await run_pg_util(self.ctx, command, name)
+        if returncode != 0:
+            raise Exception("%s has failed: %s" % (name, "\n".join(err)))
+        with open(file_name, "r", encoding="utf-8") as f:
+            return f.read()
+
+    async def load(self, costs):
+        post_data_tables = self.ctx.metadata["post_data_tables"]
+        for file_name, v in self.ctx.metadata["files"].items():
+            key = (v["schema"], v["table"])
+            self.files_left[key] = self.files_left.get(key, 0) + 1
+            self.costs[key] = self.costs.get(key, 0) + costs[file_name]
+
+        self.work_dir = tempfile.TemporaryDirectory(prefix="pg_anon_post_data_")
+        toc_file = os.path.join(self.work_dir.name, "toc.list")
+        self.toc = (await self.run_pg_restore_to_file(["-l"], toc_file, "pg_restore list")).splitlines()
+
+        pipelined = []
+        for line in self.toc:
+            match = TOC_LINE_RE.match(line)
+            if match is None or match.group(4) not in POST_DATA_TABLE_TYPES:
+                continue
+            table = post_data_tables.get("%s %s" % (match.group(2), match.group(3)))
+            if table is None or tuple(table) not in self.files_left:
+                continue
+            dump_id = int(match.group(1))
+            self.entries[dump_id] = {"table": tuple(table), "type": match.group(4), "sql": None}
+            self.tables.setdefault(tuple(table), []).append(dump_id)
+            pipelined.append(line)
+
+        if pipelined:
+            list_file = os.path.join(self.work_dir.name, "pipelined.list")
+            with open(list_file, "w", encoding="utf-8") as f:
+                f.write("\n".join(pipelined) + "\n")
+            script = await self.run_pg_restore_to_file(
+                ["-v", "-L", list_file], os.path.join(self.work_dir.name, "pipelined.sql"), "pg_restore script"
+            )
+            parts = TOC_ENTRY_RE.split(script)
+            self.preamble = parts[0]
+            for dump_id, sql in zip(parts[1::2], parts[2::2]):
+                self.entries[int(dump_id)]["sql"] = sql
+
+        self.pool = await asyncpg.create_pool(
+            **self.ctx.conn_params,
+            min_size=0,
+            max_size=self.ctx.args.threads
+        )
+        self.ctx.logger.info("Post-data: %s of %s TOC entries of %s table(s) are built after the table is loaded" % (
+            len(self.entries), len([v for v in self.toc if v and not v.startswith(";")]), len(self.tables))
+        )
+        return self
+
+    def push(self, key, kind, item):
+        self.seq += 1
+        heapq.heappush(self.ready, (-self.costs[key], self.seq, kind, item))
+
+    def push_entries(self, key):
+        for dump_id in self.tables.get(key, []):
+            if self.entries[dump_id]["sql"] is not None:
+                self.push(key, "entry", dump_id)
+
+    def file_loaded(self, file_name, rows):
+        # rows is None if the file has failed
+        v = self.ctx.metadata["files"][file_name]
+        key = (v["schema"], v["table"])
+        if rows is None:
+            self.failed.add(key)
+        self.files_left[key] -= 1
+        if self.files_left[key] > 0 or key in self.failed or key not in self.tables:
+            return
+        if key in self.unlogged_tables:
+            self.push(key, "logged", key)
+        else:
+            self.push_entries(key)
+
+    def has_ready(self):
+        return len(self.ready) > 0
+
+    def pop_ready(self):
+        _, _, kind, item = heapq.heappop(self.ready)
+        return kind, item
+
+    async def run(self, kind, item, workers):
+        # "workers" is max_parallel_maintenance_workers of the build, idle slots of the restore
+        start_t = time.time()
+        db_conn = await self.pool.acquire()
+        try:
+            if kind == "logged":
+                await db_conn.execute("ALTER TABLE \"%s\".\"%s\" SET LOGGED" % item)
+                self.push_entries(item)
+                return
+            entry = self.entries[item]
+            self.ctx.logger.info("Post-data: building %s %s of \"%s\".\"%s\" with %s parallel worker(s)" % (
+                entry["type"], item, entry["table"][0], entry["table"][1], workers)
+            )
+            await db_conn.execute("SET max_parallel_maintenance_workers = %s" % int(workers))
+            await db_conn.execute(self.preamble + entry["sql"])
+            self.built.add(item)
+        except:
+            # the entry is restored again by the final pass, which reports the error as before
+            self.ctx.logger.error("Post-data: failed %s %s\n%s" % (kind, item, exception_helper()))
+        finally:
+            self.build_time += time.time() - start_t
+            await self.pool.release(db_conn)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def get_rest_list(self):
+        # TOC list with the built entries commented out for "pg_restore -L"
+        list_file = os.path.join(self.work_dir.name, "rest.list")
+        with open(list_file, "w", encoding="utf-8") as f:
+            for line in self.toc:
+                match = TOC_LINE_RE.match(line)
+                f.write((";" + line if match is not None and int(match.group(1)) in self.built else line) + "\n")
+        self.ctx.logger.info("Post-data: %s entries built during the load in %.2fs, the rest is restored by pg_restore" % (
+            len(self.built), self.build_time)
+        )
+        return list_file
+
+    def cleanup(self):
+        if self.work_dir is not None:
+            self.work_dir.cleanup()
+            self.work_dir = None
@@ -0,0 +1,195 @@
+from dump import *
+
+PROFILE_RUNS = 3
+PROFILE_SAMPLE_TABLE = "pg_anon_profile_sample"
+PROFILE_SAMPLE_PAGES = 10
+
+SQL_KEYWORDS = set([
+    "select", "from", "where", "case", "when", "then", "else", "end", "and", "or", "not", "in", "exists",
+    "cast", "coalesce", "nullif", "greatest", "least", "interval", "array", "row", "values"
+])
+
+
+def get_expression_functions(expression):
+    # names of functions called in the expression, schema-qualified names first
+    names = re.findall(r"((?:[A-Za-z_][\w$]*\.)?[A-Za-z_][\w$]*)\s*\(", expression)
+    res = []
+    for v in names:
+        if v.lower() not in SQL_KEYWORDS and v not in res:
+            res.append(v)
+    return sorted(res, key=lambda v: "." not in v)
+
+
+def get_entry_name(a_obj):
+    if "schema" in a_obj:
+        schema = a_obj["schema"]
+    else:
+        schema = "schema_mask=%s" % a_obj["schema_mask"]
+    if "table" in a_obj:
+        table = a_obj["table"]
+    else:
+        table = "table_mask=%s" % a_obj["table_mask"]
+    return "%s.%s" % (schema, table)
+
+
+async def get_execution_time(db_conn, query):
+    # server-side execution time in ms, the best of several runs
+    times = []
+    for _ in range(PROFILE_RUNS):
+        res = await db_conn.fetchval("EXPLAIN (ANALYZE, TIMING OFF, FORMAT JSON) %s" % query)
+        times.append(json.loads(res)[0]["Execution Time"])
+    return min(times)
+
+
+def get_profile_sample(ctx, tbl, rows):
+    # TABLESAMPLE SYSTEM of about twice "--profile-rows" rows and at least PROFILE_SAMPLE_PAGES pages, so the rows
+    # come from the whole table instead of its first pages. Small tables are read in full
+    percent = get_sample_percent({"rows": 2 * ctx.args.profile_rows}, [{"rows": rows}])
+    if percent is not None and tbl["pages"] > 0:
+        percent = max(percent, 100.0 * PROFILE_SAMPLE_PAGES / tbl["pages"])
+    if percent is None or percent >= 100:
+        return None
+    return {"method": "SYSTEM", "percent": round(percent, 4), "seed": None}
+
+
+async def profile_table(ctx, db_conn, tbl, a_obj):
+    # each field expression and the raw column read are evaluated over the same sample of rows
+    table_name = "\"%s\".\"%s\"" % (tbl["schema"], tbl["table"])
+    res = []
+    await db_conn.execute("SAVEPOINT pg_anon_profile")
+    try:
+        rows = tbl["rows"]
+        if rows is None:
+            rows = get_plan_estimate(await explain_query(db_conn, "SELECT * FROM %s" % table_name))[1]
+        sample = get_profile_sample(ctx, tbl, rows)
+        await db_conn.execute("CREATE TEMP TABLE %s AS SELECT * FROM %s%s LIMIT %s" % (
+            PROFILE_SAMPLE_TABLE, table_name, sample_clause(sample), ctx.args.profile_rows)
+        )
+        sample_rows = await db_conn.fetchval("SELECT count(*) FROM %s" % PROFILE_SAMPLE_TABLE)
+
+        for fld_name, fld_val in a_obj["fields"].items():
+            item = {
+                "schema": tbl["schema"],
+                "table": tbl["table"],
+                "field": fld_name,
+                "entry": get_entry_name(a_obj),
+                "expression": fld_val.strip(),
+                "functions": get_expression_functions(fld_val),
+                "sample_rows": sample_rows,
+                "sample_percent": sample["percent"] if sample is not None else None,
+                "rows": rows
+            }
+            res.append(item)
+            if fld_name not in tbl["columns"]:
+                item["error"] = "Column %s not found in %s" % (fld_name, table_name)
+                continue
+            expression = fld_val[4:] if fld_val.find("SQL:") == 0 else fld_val
+            await db_conn.execute("SAVEPOINT pg_anon_profile_field")
+            try:
+                base_time = await get_execution_time(db_conn, "SELECT \"%s\" FROM %s" % (
+                    fld_name, PROFILE_SAMPLE_TABLE)
+                )
+                expr_time = await get_execution_time(db_conn, "SELECT (%s) FROM %s" % (
+                    expression, PROFILE_SAMPLE_TABLE)
+                )
+            except asyncpg.PostgresError as e:
+                await db_conn.execute("ROLLBACK TO SAVEPOINT pg_anon_profile_field")
+                item["error"] = "%s: %s" % (type(e).__name__, str(e))
+                continue
+            await db_conn.execute("RELEASE SAVEPOINT pg_anon_profile_field")
+            overhead = max(expr_time - base_time, 0) / sample_rows if sample_rows > 0 else 0
+            item.update({
+                "base_ms": round(base_time, 3),
+                "expression_ms": round(expr_time, 3),
+                "overhead_us_per_row": round(overhead * 1000, 3),
+                "projected_sec": round(overhead * rows / 1000, 3)
+            })
+    finally:
+        # the sample table is dropped and the subtransaction is closed, so profiled tables don't nest savepoints
+        await db_conn.execute("ROLLBACK TO SAVEPOINT pg_anon_profile")
+        await db_conn.execute("RELEASE SAVEPOINT pg_anon_profile")
+    return res
+
+
+async def make_profile_dict_impl(ctx, db_conn, sn_id):
+    catalog = await Catalog().load(ctx, db_conn)
+    dictionary_index = DictionaryIndex(ctx.dictionary_obj['dictionary'])
+
+    tables = []
+    skipped_raw_sql = []
+    for tbl in catalog.tables.values():
+        a_obj = dictionary_index.find(tbl["schema"], tbl["table"])
+        if a_obj is None:
+            continue
+        if "raw_sql" in a_obj:
+            skipped_raw_sql.append("\"%s\".\"%s\"" % (tbl["schema"], tbl["table"]))
+        elif a_obj.get("fields"):
+            tables.append((tbl, a_obj))
+    if skipped_raw_sql:
+        ctx.logger.info("Tables with raw_sql are not profiled (see --validate-dict for their cost): %s" % (
+            ", ".join(skipped_raw_sql))
+        )
+    if not tables:
+        raise Exception("No dictionary fields to profile!")
+
+    report = []
+
+    async def profile_task(worker_conn, v):
+        report.extend(await profile_table(ctx, worker_conn, v[0], v[1]))
+
+    await run_snapshot_workers(ctx, sn_id, tables, profile_task)
+    return sorted(report, key=lambda v: (v.get("projected_sec", -1), v.get("overhead_us_per_row", -1)), reverse=True)
+
+
+def log_profile(ctx, report):
+    ctx.logger.info("Fields by projected cost of anonymization (overhead against the raw column read):")
+    for v in report:
+        if "error" in v:
+            ctx.logger.error("  %s.%s.%s [%s]: %s" % (v["schema"], v["table"], v["field"], v["entry"], v["error"]))
+            continue
+        ctx.logger.info("  %8.1fs %10.3f us/row  %s.%s.%s [%s] %s" % (
+            v["projected_sec"],
+            v["overhead_us_per_row"],
+            v["schema"],
+            v["table"],
+            v["field"],
+            v["entry"],
+            ", ".join(v["functions"]) if v["functions"] else v["expression"]
+        ))
+
+
+async def profile_dict(ctx):
+    result = PgAnonResult()
+    ctx.logger.info("-------------> Started profile-dict mode")
+
+    try:
+        read_dictionary(ctx)
+        if ctx.args.output_dir.find("""/""") == -1 and ctx.args.output_dir.find("""\\""") == -1:
+            ctx.args.output_dir = os.path.join(
+                ctx.current_dir, 'output',
+                ctx.args.output_dir if ctx.args.output_dir else os.path.splitext(ctx.args.dict_file)[0] + "_profile"
+            )
+        os.makedirs(ctx.args.output_dir, exist_ok=True)
+
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        tr = db_conn.transaction(isolation='repeatable_read')
+        await tr.start()
+        try:
+            sn_id = await db_conn.fetchval("select pg_export_snapshot()")
+            report = await make_profile_dict_impl(ctx, db_conn, sn_id)
+        finally:
+            await tr.rollback()
+            await db_conn.close()
+
+        log_profile(ctx, report)
+        with open(os.path.join(ctx.args.output_dir, "profile.json"), "w") as out_file:
+            out_file.write(json.dumps(report, indent=4))
+    except:
+        ctx.logger.error("<------------- profile_dict failed\n" + exception_helper())
+        result.result_code = ResultCode.FAIL
+        return result
+
+    result.result_code = ResultCode.DONE
+    result.result_data = report
+    ctx.logger.info("<------------- Finished profile-dict mode")
+    return result
@@ -0,0 +1,209 @@
+import time
+import asyncpg
+from datetime import datetime
+from common import *
+
+
+class TaskProgress:
+    def __init__(self, file_name, schema, table, rows_expected, size):
+        self.file_name = file_name
+        self.schema = schema
+        self.table = table
+        self.rows_expected = rows_expected   # reltuples or rows from metadata, None if unknown
+        self.size = size                     # relation size for dump, data file size for restore
+        self.output_size = None              # size of the written data file
+        self.rows = 0
+        self.bytes = 0
+        self.pid = None
+        self.started = None
+        self.finished = None
+        self.changed = None                  # last time rows or bytes grew, to detect stalled tasks
+
+    def update(self, rows=None, bytes_v=None):
+        if rows is not None and rows > self.rows:
+            self.rows = rows
+            self.changed = time.time()
+        if bytes_v is not None and bytes_v > self.bytes:
+            self.bytes = bytes_v
+            self.changed = time.time()
+
+
+class Progress:
+    # Progress of dump/restore/pipe tasks. Rows and bytes of running tasks are polled from pg_stat_progress_copy
+    # (PostgreSQL 14+) by backend pid, client-side COPY streams also count received bytes. Every "--progress-interval"
+    # seconds a summary line is logged and, with "--progress-file", a JSON line is appended to the file.
+    # Tasks are keyed by hash() of SQL query, like ctx.task_results
+
+    def __init__(self, ctx, name):
+        self.ctx = ctx
+        self.name = name
+        self.tasks = {}
+        self.tasks_by_pid = {}
+        self.started = None
+        self.monitor = None
+        self.use_pg_stat = get_major_version(ctx.pg_version) >= get_major_version("14")
+
+    def add_task(self, task, file_name, schema, table, rows_expected, size=None):
+        self.tasks[hash(task)] = TaskProgress(file_name, schema, table, rows_expected, size)
+
+    def start_task(self, task, db_conn):
+        v = self.tasks[hash(task)]
+        v.started = v.changed = time.time()
+        v.pid = db_conn.get_server_pid()
+        self.tasks_by_pid[v.pid] = v
+
+    def add_bytes(self, task, bytes_v):
+        v = self.tasks[hash(task)]
+        v.update(bytes_v=v.bytes + bytes_v)
+
+    def finish_task(self, task, rows):
+        v = self.tasks[hash(task)]
+        v.update(rows=int(rows))
+        v.rows = int(rows)
+        v.finished = time.time()
+        if self.tasks_by_pid.get(v.pid) is v:
+            del self.tasks_by_pid[v.pid]
+
+    def set_output_size(self, task, size):
+        self.tasks[hash(task)].output_size = size
+
+    def get_task_records(self):
+        # finished tasks for the run history
+        return [{
+            "schema": v.schema,
+            "table": v.table,
+            "file": v.file_name,
+            "size": v.size,
+            "rows": v.rows,
+            "bytes": v.bytes,
+            "output_size": v.output_size,
+            "elapsed": v.finished - v.started
+        } for v in self.tasks.values() if v.finished is not None]
+
+    async def poll(self, db_conn):
+        if not self.use_pg_stat or not self.tasks_by_pid:
+            return
+        query_res = await db_conn.fetch("""
+            SELECT pid, tuples_processed, bytes_processed
+            FROM pg_stat_progress_copy
+            WHERE pid = ANY($1::int[])
+        """, list(self.tasks_by_pid.keys()))
+        for v in query_res:
+            task = self.tasks_by_pid.get(v[0])
+            if task is not None:
+                task.update(rows=v[1], bytes_v=v[2])
+
+    def get_state(self):
+        now = time.time()
+        elapsed = now - self.started
+        rows = 0
+        rows_expected = 0
+        bytes_v = 0
+        finished = 0
+        active = []
+        for v in self.tasks.values():
+            rows += v.rows
+            bytes_v += v.bytes
+            if v.finished is not None:
+                finished += 1
+                rows_expected += v.rows
+            else:
+                if rows_expected is not None and v.rows_expected is not None:
+                    rows_expected += max(v.rows_expected, v.rows)
+                else:
+                    rows_expected = None
+                if v.started is not None:
+                    active.append(v)
+
+        rows_per_sec = rows / elapsed if elapsed > 0 else 0
+        eta = None
+        if finished == len(self.tasks):
+            percent = 100.0
+            eta = 0
+        elif rows_expected is not None:
+            percent = 100.0 * rows / rows_expected if rows_expected > 0 else 0.0
+            if rows_per_sec > 0:
+                eta = (rows_expected - rows) / rows_per_sec
+        else:
+            # some tables were never analyzed, only finished tasks can be counted
+            percent = 100.0 * finished / len(self.tasks)
+            if finished > 0:
+                eta = elapsed * (len(self.tasks) - finished) / finished
+
+        return {
+            "time": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+            "mode": self.name,
+            "elapsed": round(elapsed, 2),
+            "tasks": len(self.tasks),
+            "tasks_finished": finished,
+            "tasks_active": len(active),
+            "rows": rows,
+            "rows_expected": rows_expected,
+            "bytes": bytes_v,
+            "percent": round(percent, 2),
+            "rows_per_sec": round(rows_per_sec, 2),
+            "bytes_per_sec": round(bytes_v / elapsed if elapsed > 0 else 0, 2),
+            "eta": round(eta, 2) if eta is not None else None,
+            "active": [
+                {
+                    "file": v.file_name,
+                    "schema": v.schema,
+                    "table": v.table,
+                    "rows": v.rows,
+                    "rows_expected": v.rows_expected,
+                    "bytes": v.bytes,
+                    "elapsed": round(now - v.started, 2),
+                    "idle": round(now - v.changed, 2)
+                } for v in active
+            ]
+        }
+
+    def report(self):
+        state = self.get_state()
+        self.ctx.logger.info(
+            "Progress %s: %s/%s task(s), %s of ~%s rows (%.1f%%), %.0f rows/s, %s/s, ETA %s" % (
+                self.name,
+                state["tasks_finished"],
+                state["tasks"],
+                state["rows"],
+                state["rows_expected"] if state["rows_expected"] is not None else "unknown",
+                state["percent"],
+                state["rows_per_sec"],
+                pretty_size(state["bytes_per_sec"]),
+                "%.0fs" % state["eta"] if state["eta"] is not None else "unknown"
+            )
+        )
+        if self.ctx.args.progress_file:
+            with open(self.ctx.args.progress_file, "a") as f:
+                f.write(json.dumps(state) + "\n")
+
+    async def run_monitor(self):
+        db_conn = await asyncpg.connect(**self.ctx.conn_params) if self.use_pg_stat else None
+        try:
+            while True:
+                await asyncio.sleep(self.ctx.args.progress_interval)
+                try:
+                    if db_conn is not None:
+                        await self.poll(db_conn)
+                except Exception:
+                    # progress is informational, a failed poll must not break the run
+                    self.ctx.logger.warning("Progress poll failed:\n" + exception_helper(show_traceback=False))
+                self.report()
+        finally:
+            if db_conn is not None:
+                await db_conn.close()
+
+    def start(self):
+        self.started = time.time()
+        if self.ctx.args.progress_interval > 0:
+            self.monitor = asyncio.ensure_future(self.run_monitor())
+
+    async def stop(self):
+        if self.monitor is not None:
+            self.monitor.cancel()
+            try:
+                await self.monitor
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.monitor = None
+        self.report()
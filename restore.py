@@ -2,11 +2,18 @@ import os
 import asyncpg
 import asyncio
 from common import *
+from compressors import *
+from progress import *
+from history import *
+from post_data import *
+from ledger import *
 import shutil
+import tempfile
 import json
+import time
 
 
-async def run_pg_restore(ctx, section):
+async def run_pg_restore(ctx, section, list_file=None):
     os.environ["PGPASSWORD"] = ctx.args.db_user_password
     command = [
         ctx.args.pg_restore,
@@ -15,6 +22,7 @@ async def run_pg_restore(ctx, section):
         "-U", ctx.args.db_user,
         "-d", ctx.args.db_name,
         "-j", str(ctx.args.threads),
+        *(["-L", list_file] if list_file is not None else []),
         os.path.join(
             ctx.args.input_dir,
             section.replace("-", "_") + ".backup"
@@ -26,135 +34,378 @@ async def run_pg_restore(ctx, section):
     if not ctx.args.db_user:
         del command[command.index("-U"):command.index("-U") + 2]
 
-    ctx.logger.debug(str(command))
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    err, out = proc.communicate()
-    for v in out.decode("utf-8").split("\n"):
-        ctx.logger.info(v)
+    returncode, out, err = await run_pg_util(ctx, command, "pg_restore %s" % section)
+    if returncode != 0:
+        ctx.logger.warning("pg_restore %s exited with code %s" % (section, returncode))
+    elif ctx.ledger is not None:
+        # a section with errors is not finished, --resume restores it again skipping the existing objects
+        ctx.ledger.write("section", name=section)
+
+
+async def run_seq_init_statements(ctx, pool, statements):
+    # one round trip per worker: the statements are sent as one simple query
+    db_conn = await pool.acquire()
+    try:
+        await db_conn.execute(";\n".join(statements))
+    finally:
+        await pool.release(db_conn)
+
+
+async def seq_init_by_max_value(ctx, db_conn):
+    # sequences owned by integer columns of the restored tables, serial and identity, are set after the max value
+    # of the column. "SELECT max(col)" is answered by a backward scan of an index on the column if post-data has
+    # created one. The statements are split between "--threads" workers, the largest tables first
+    tables = set()
+    for v in ctx.metadata['files'].values():
+        tables.add((v["schema"], v["table"]))
+        if "partition_root" in v:
+            tables.add(tuple(v["partition_root"]))
+    statements = await db_conn.fetch("""
+        SELECT format(
+            'SELECT setval(%L::regclass, max(%I) + 1) FROM %I.%I',
+            format('%I.%I', s_n.nspname, s.relname), a.attname, t_n.nspname, t.relname
+        )
+        FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_namespace s_n ON s_n.oid = s.relnamespace
+        JOIN pg_class t ON t.oid = d.refobjid
+        JOIN pg_namespace t_n ON t_n.oid = t.relnamespace
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = d.refobjsubid
+        JOIN unnest($1::text[], $2::text[]) AS r(schema, table_name)
+            ON r.schema = t_n.nspname AND r.table_name = t.relname
+        WHERE
+            d.classid = 'pg_class'::regclass AND
+            d.refclassid = 'pg_class'::regclass AND
+            d.deptype IN ('a', 'i') AND
+            a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)
+        ORDER BY pg_total_relation_size(t.oid) DESC
+    """, [v[0] for v in tables], [v[1] for v in tables])
+    statements = [v[0] for v in statements]
+    if not statements:
+        return
+
+    threads = min(ctx.args.threads, len(statements))
+    pool = await asyncpg.create_pool(**ctx.conn_params, min_size=threads, max_size=threads)
+    try:
+        await wait_all([run_seq_init_statements(ctx, pool, statements[i::threads]) for i in range(threads)])
+    finally:
+        await pool.close()
+    ctx.logger.info("Initialized %s sequence(s) by max values in %s worker(s)" % (len(statements), threads))
 
 
 async def seq_init(ctx):
     db_conn = await asyncpg.connect(**ctx.conn_params)
-    if ctx.args.seq_init_by_max_value:
-        query = """
-            DO $$
-            DECLARE
-                cmd text;
-                schema text;
-            BEGIN
-                FOR cmd, schema IN (
-                    select
-                       ('SELECT setval(''' || T.seq_name || ''', max("' || T.column_name || '") + 1) FROM "' || T.table_name || '"') as cmd,
-                       T.table_schema as schema
-                    FROM (
-                            select
-                               substring(t.column_default from 10 for length(t.column_default) - 21) as seq_name,
-                               t.table_schema,
-                               t.table_name,
-                               t.column_name
-                               FROM (
-                                   SELECT table_schema, table_name, column_name, column_default
-                                   FROM information_schema.columns
-                                   WHERE column_default LIKE 'nextval%'
-                               ) T
-                    ) T
-                ) LOOP
-                    EXECUTE 'SET search_path = ''' || schema || ''';';
-                    -- EXECUTE cmd;
-                    raise notice '%', cmd;
-                END LOOP;
-                SET search_path = 'public';
-            END$$;"""
-        ctx.logger.debug(query)
-        await db_conn.execute(query)
-    else:
-        for _, v in ctx.metadata['seq_lastvals'].items():
-            query = """
-                SET search_path = '%s';
-                SELECT setval(quote_ident('%s'), %s + 1);
-            """ % (
-                v['schema'].replace("'", "''"),
-                v['seq_name'].replace("'", "''"),
-                v['value']
-            )
-            ctx.logger.info(query)
-            await db_conn.execute(query)
+    try:
+        if ctx.args.seq_init_by_max_value:
+            await seq_init_by_max_value(ctx, db_conn)
+        else:
+            # all recorded values are applied by one statement, sequences not found in the target are reported
+            seqs = list(ctx.metadata['seq_lastvals'].values())
+            not_found = await db_conn.fetch("""
+                SELECT schema, seq_name
+                FROM (
+                    SELECT
+                        v.schema,
+                        v.seq_name,
+                        setval(to_regclass(format('%I.%I', v.schema, v.seq_name)), v.value + 1) AS value
+                    FROM unnest($1::text[], $2::text[], $3::bigint[]) AS v(schema, seq_name, value)
+                ) AS t
+                WHERE value IS NULL
+            """, [v['schema'] for v in seqs], [v['seq_name'] for v in seqs], [int(v['value']) for v in seqs])
+            for v in not_found:
+                ctx.logger.warning("Sequence \"%s\".\"%s\" not found" % (v[0], v[1]))
+            ctx.logger.info("Initialized %s sequence(s) by the source values" % (len(seqs) - len(not_found)))
+    finally:
+        await db_conn.close()
 
-    await db_conn.close()
+
+def get_restore_file_costs(ctx):
+    # byte sizes of the dump files, row counts from metadata if some files are not reachable from here
+    costs = {}
+    for file_name in ctx.metadata['files']:
+        full_path = os.path.join(ctx.current_dir, 'output', ctx.args.input_dir, file_name)
+        if not os.path.exists(full_path):
+            return {file_name: int(v['rows']) for file_name, v in ctx.metadata['files'].items()}, \
+                lambda v: "%s rows" % str(v)
+        costs[file_name] = os.path.getsize(full_path)
+    return costs, pretty_size
+
+
+async def get_fast_load_tables(ctx, db_conn):
+    # plain tables of the dump files with the number of their files, partitioned tables are not frozen or unlogged
+    tables = {}
+    for v in ctx.metadata['files'].values():
+        tables[(v["schema"], v["table"])] = tables.get((v["schema"], v["table"]), 0) + 1
+    res = await db_conn.fetch("""
+        SELECT n.nspname, c.relname
+        FROM unnest($1::text[], $2::text[]) AS t(schema, name)
+        JOIN pg_namespace n ON n.nspname = t.schema
+        JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = t.name
+        WHERE c.relkind = 'r'
+    """, [v[0] for v in tables], [v[1] for v in tables])
+    return {(v[0], v[1]): tables[(v[0], v[1])] for v in res}
+
+
+def get_fast_load_copy_options(ctx):
+    # FREEZE is not a part of the old "COPY ... WITH BINARY" syntax, only the data format is kept
+    return "(FORMAT %s, FREEZE)" % get_copy_format_options(ctx).get(
+        "format", ctx.metadata.get("copy_format", "text")
+    )
 
 
-def generate_restore_queries(ctx):
+async def set_tables_logged(ctx, tables, logged):
+    # ALTER TABLE ... SET LOGGED rewrites the table into WAL, tables are switched in parallel
+    queries = ["ALTER TABLE \"%s\".\"%s\" SET %s" % (v[0], v[1], "LOGGED" if logged else "UNLOGGED") for v in tables]
+    if not queries:
+        return
+    start_t = time.time()
+    await run_parallel_queries(ctx, queries)
+    ctx.logger.info("%s table(s) switched to %s in %.2fs" % (
+        len(queries), "LOGGED" if logged else "UNLOGGED", time.time() - start_t)
+    )
+
+
+def generate_restore_queries(ctx, fast_load_tables=None, files=None):
+    # "files" are names of the files to load, all files of the dump by default
+    files = list(ctx.metadata['files'].keys()) if files is None else files
+    costs, format_cost = get_restore_file_costs(ctx)
+    durations = predict_durations(ctx, load_history_stats(ctx, str(ctx.args.mode)), {
+        file_name: (ctx.metadata['files'][file_name]["schema"], ctx.metadata['files'][file_name]["table"],
+                    int(ctx.metadata['files'][file_name]["rows"]))
+        for file_name in files
+    }, "rows")
+    if durations is not None:
+        costs, format_cost = durations, format_duration
+    ordered, makespan = lpt_schedule(files, lambda v: costs[v], ctx.args.threads)
+    log_schedule(ctx, "Restore", ordered, lambda v: costs[v], makespan, lambda v: v, format_cost)
+
     queries = []
-    for file_name, target in ctx.metadata['files'].items():
+    query_files = {}
+    for file_name in ordered:
+        target = ctx.metadata['files'][file_name]
         full_path = os.path.join(ctx.current_dir, 'output', ctx.args.input_dir, file_name)
         schema = target["schema"]
         table = target["table"]
-        query = "COPY \"%s\".\"%s\" FROM PROGRAM 'gunzip -c %s' %s" % (
-            schema,
-            table,
-            full_path,
-            ctx.args.copy_options
+        program = "%s %s" % (
+            get_decompress_program(CompressCodec(target.get("codec", CompressCodec.GZIP.value))),
+            full_path
         )
+        if "watermark" in target and target["watermark"]["from"] is not None:
+            query = generate_delta_query(ctx, schema, table, target["watermark"], program)
+        elif fast_load_tables is not None and fast_load_tables.get((schema, table)) == 1:
+            # rows of a table truncated in the same transaction are written already frozen, and without WAL
+            # if wal_level is minimal. Slices of a table are loaded in parallel and can't be truncated
+            query = "TRUNCATE ONLY \"%s\".\"%s\"; COPY \"%s\".\"%s\" FROM PROGRAM '%s' %s" % (
+                schema,
+                table,
+                schema,
+                table,
+                program,
+                get_fast_load_copy_options(ctx)
+            )
+        else:
+            query = "COPY \"%s\".\"%s\" FROM PROGRAM '%s' %s" % (
+                schema,
+                table,
+                program,
+                ctx.args.copy_options
+            )
         queries.append(query)
-    return queries
+        query_files[hash(query)] = file_name
+    return queries, query_files
+
+
+def generate_delta_query(ctx, schema, table, watermark, program):
+    # rows of an incremental sync-data-dump replace the rows with the same key, the row count is taken from INSERT
+    if not watermark["key"]:
+        ctx.logger.warning("Table \"%s\".\"%s\" has no unique key, delta rows are appended" % (schema, table))
+        return "COPY \"%s\".\"%s\" FROM PROGRAM '%s' %s" % (schema, table, program, ctx.args.copy_options)
+
+    return """
+        CREATE TEMP TABLE pg_anon_delta (LIKE "%s"."%s") ON COMMIT DROP;
+        COPY pg_anon_delta FROM PROGRAM '%s' %s;
+        DELETE FROM "%s"."%s" t USING pg_anon_delta d WHERE %s;
+        INSERT INTO "%s"."%s" SELECT * FROM pg_anon_delta;
+    """ % (
+        schema, table,
+        program, ctx.args.copy_options,
+        schema, table, " AND ".join(["t.\"%s\" = d.\"%s\"" % (v, v) for v in watermark["key"]]),
+        schema, table
+    )
 
 
 def generate_analyze_queries(ctx):
-    analyze_queries = []
+    costs, format_cost = get_restore_file_costs(ctx)
+    analyze_costs = {}
     for file_name, target in ctx.metadata['files'].items():
-        schema = target["schema"]
-        table = target["table"]
+        # ANALYZE of a partitioned table samples its partitions too and is the only way to get statistics
+        # of the whole hierarchy, so partitions are analyzed once through the root table
+        schema, table = target["partition_root"] if "partition_root" in target else (target["schema"], target["table"])
         analyze_query = "analyze \"%s\".\"%s\"" % (
             schema,
             table
         )
-        analyze_queries.append(analyze_query)
+        # sliced tables and partitions have several files
+        analyze_costs[analyze_query] = analyze_costs.get(analyze_query, 0) + costs[file_name]
+
+    analyze_queries, makespan = lpt_schedule(analyze_costs, lambda v: analyze_costs[v], ctx.args.threads)
+    log_schedule(ctx, "Analyze", analyze_queries, lambda v: analyze_costs[v], makespan, lambda v: v, format_cost)
     return analyze_queries
 
 
-async def restore_obj_func(ctx, pool, task, sn_id):
+def get_analyze_tables(ctx, files):
+    # table or partition root -> files left to load, cost and columns of the ANALYZE run by the worker which
+    # loads the last file. With --quick-analyze only columns of indexes and foreign keys are analyzed
+    # at once, the full ANALYZE is deferred
+    costs, _ = get_restore_file_costs(ctx)
+    analyze_columns = {}
+    if ctx.args.quick_analyze:
+        analyze_columns = {(v[0], v[1]): v[2] for v in ctx.metadata["analyze_columns"]}
+    res = {}
+    for file_name in files:
+        target = ctx.metadata['files'][file_name]
+        key = tuple(target["partition_root"]) if "partition_root" in target else (target["schema"], target["table"])
+        if key not in res:
+            res[key] = {"files": 0, "cost": 0, "columns": analyze_columns.get(key), "failed": False}
+        res[key]["files"] += 1
+        res[key]["cost"] += costs[file_name]
+    return res
+
+
+def get_analyze_query(key, columns=None):
+    return "analyze \"%s\".\"%s\"%s" % (
+        key[0], key[1], " (%s)" % ", ".join(["\"%s\"" % v for v in columns]) if columns else ""
+    )
+
+
+async def run_deferred_analyze(ctx, queries):
+    # full ANALYZE after --quick-analyze, one query at a time in the background of post-data
+    ctx.logger.info("-------------> Started deferred analyze of %s table(s)" % len(queries))
+    db_conn = await asyncpg.connect(**ctx.conn_params)
+    try:
+        for v in queries:
+            ctx.logger.info('================> Started query %s' % v)
+            await db_conn.execute(v)
+            ctx.logger.info('<================ Finished query %s' % v)
+    finally:
+        await db_conn.close()
+    ctx.logger.info("<------------- Finished deferred analyze")
+
+
+async def restore_obj_func(ctx, pool, task, sn_id, file_name=None):
     ctx.logger.info('================> Started task %s' % str(task))
 
     db_conn = await pool.acquire()
     try:
-        await db_conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ;")
-        await db_conn.execute("SET TRANSACTION SNAPSHOT '%s';" % sn_id)
+        if ctx.ledger is not None:
+            ctx.ledger.write("file", name=file_name, state="loading")
+        if sn_id is not None:
+            await db_conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ;")
+            await db_conn.execute("SET TRANSACTION SNAPSHOT '%s';" % sn_id)
+        else:
+            await db_conn.execute("BEGIN;")
+        ctx.progress.start_task(task, db_conn)
         res = await db_conn.execute(task)
-        ctx.total_rows += int(re.findall(r"(\d+)", res)[0])
+        count_rows = int(re.findall(r"(\d+)", res)[-1])
+        ctx.total_rows += count_rows
         await db_conn.execute("COMMIT;")
+        ctx.progress.finish_task(task, count_rows)
         ctx.logger.debug("COPY %s [rows] Task: %s " % (ctx.total_rows, str(task)))
+        if ctx.ledger is not None:
+            ctx.ledger.write("file", name=file_name, state="done", rows=count_rows)
     except Exception as e:
         ctx.logger.error("Exception in restore_obj_func:\n" + exception_helper())
+        if ctx.ledger is not None:
+            ctx.ledger.write("file", name=file_name, state="failed", error=str(e))
         # raise Exception("Can't execute task: %s" % task)
+        return None
     finally:
         await pool.release(db_conn)
 
     ctx.logger.info('================> Finished task %s' % str(task))
+    return count_rows
 
 
-async def make_restore_impl(ctx, sn_id):
-    pool = await asyncpg.create_pool(
+async def setup_fast_load_conn(db_conn):
+    # commits don't wait for WAL flush, triggers and foreign key checks are not fired. Settings are made on each
+    # acquire, the pool resets them by "RESET ALL" on release
+    await db_conn.execute("SET synchronous_commit = off; SET session_replication_role = replica;")
+
+
+async def create_restore_pool(ctx, fast_load):
+    return await asyncpg.create_pool(
         **ctx.conn_params,
         min_size=ctx.args.threads,
-        max_size=ctx.args.threads
+        max_size=ctx.args.threads,
+        setup=setup_fast_load_conn if fast_load else None
     )
 
-    queries = generate_restore_queries(ctx)
-    loop = asyncio.get_event_loop()
-    tasks = set()
+
+async def make_restore_impl(ctx, sn_id, fast_load_tables=None, pipeline=None, files=None):
+    pool = await create_restore_pool(ctx, fast_load_tables is not None)
+
+    queries, query_files = generate_restore_queries(ctx, fast_load_tables, files)
+    ctx.progress = Progress(ctx, "restore")
     for v in queries:
-        if len(tasks) >= ctx.args.threads:
-            # Wait for some restore to finish before adding a new one
-            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-            exception = done.pop().exception()
-            if exception is not None:
-                await pool.close()
-                raise exception
-        tasks.add(loop.create_task(restore_obj_func(ctx, pool, v, sn_id)))
+        file_name = query_files[hash(v)]
+        target = ctx.metadata['files'][file_name]
+        full_path = os.path.join(ctx.args.input_dir, file_name)
+        ctx.progress.add_task(
+            v, file_name, target["schema"], target["table"], int(target["rows"]),
+            os.path.getsize(full_path) if os.path.exists(full_path) else None
+        )
+    ctx.progress.start()
+
+    # each table is analyzed by the worker which has loaded its last file, while other tables are loading,
+    # so post-data builds of the table start after its ANALYZE and don't wait for its lock
+    analyze_tables = get_analyze_tables(ctx, query_files.values())
+    deferred_analyze = []
+
+    async def load_and_analyze(query):
+        count_rows = await restore_obj_func(ctx, pool, query, sn_id, query_files[hash(query)])
+        target = ctx.metadata['files'][query_files[hash(query)]]
+        key = tuple(target["partition_root"]) if "partition_root" in target else (target["schema"], target["table"])
+        table = analyze_tables[key]
+        table["files"] -= 1
+        table["failed"] = table["failed"] or count_rows is None
+        if table["files"] == 0 and not table["failed"]:
+            if ctx.args.quick_analyze:
+                deferred_analyze.append((table["cost"], get_analyze_query(key)))
+            if not ctx.args.quick_analyze or table["columns"]:
+                await run_custom_query(ctx, pool, get_analyze_query(key, table["columns"]))
+        return count_rows
+
+    # "--threads" slots are shared by loads and post-data builds of the pipeline, ready builds go first. Builds
+    # started after the last load get idle slots as parallel maintenance workers
+    loop = asyncio.get_event_loop()
+    queries = list(queries)
+    tasks = {}  # task -> query of the load, None for a build
+    try:
+        while queries or tasks or (pipeline is not None and pipeline.has_ready()):
+            while len(tasks) < ctx.args.threads:
+                if pipeline is not None and pipeline.has_ready():
+                    workers = 0 if queries else ctx.args.threads - len(tasks) - 1
+                    tasks[loop.create_task(pipeline.run(*pipeline.pop_ready(), workers))] = None
+                elif queries:
+                    v = queries.pop(0)
+                    tasks[loop.create_task(load_and_analyze(v))] = v
+                else:
+                    break
+            done, _ = await asyncio.wait(tasks.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                query = tasks.pop(task)
+                if task.exception() is not None:
+                    raise task.exception()
+                if query is not None and pipeline is not None:
+                    pipeline.file_loaded(query_files[hash(query)], task.result())
+    finally:
+        if tasks:
+            await asyncio.wait(tasks.keys())
+        await ctx.progress.stop()
+        await pool.close()
 
-    # Wait for the remaining restores to finish
-    await asyncio.wait(tasks)
-    await pool.close()
+    # the largest tables first
+    return [v[1] for v in sorted(deferred_analyze, key=lambda v: -v[0])]
 
 
 async def check_free_disk_space(ctx, db_conn):
@@ -177,6 +428,175 @@ async def check_free_disk_space(ctx, db_conn):
         )
 
 
+async def is_db_empty(db_conn):
+    return await db_conn.fetchval("""
+        SELECT NOT EXISTS(
+            SELECT table_schema, table_name
+            FROM information_schema.tables
+            WHERE table_schema not in (
+                    'pg_catalog',
+                    'information_schema',
+                    'anon_funcs'
+                ) AND table_type = 'BASE TABLE'
+        )""")
+
+
+async def drop_custom_check_constraints(ctx, db_conn):
+    # drop all CHECK constrains containing user-defined procedures to avoid
+    # performance degradation at the data loading stage
+    check_constraints = await db_conn.fetch("""
+        SELECT nsp.nspname,  cl.relname, pc.conname, pg_get_constraintdef(pc.oid)
+        -- pc.consrc removed in 12 version
+        FROM (
+            SELECT substring(T.v FROM position(' ' in T.v) + 1 for length(T.v) )::bigint as func_oid, t.conoid
+            from (
+                SELECT T.v as v, t.conoid
+                FROM (
+                        SELECT ((SELECT regexp_matches(t.v, '(:funcid\s\d+)', 'g'))::text[])[1] as v, t.conoid
+                        FROM (
+                            SELECT conbin::text as v, oid as conoid
+                            FROM pg_constraint
+                            WHERE contype = 'c'
+                        ) T
+                ) T WHERE length(T.v) > 0
+            ) T
+        ) T
+        INNER JOIN pg_constraint pc on T.conoid = pc.oid
+        INNER JOIN pg_class cl on cl.oid = pc.conrelid
+        INNER JOIN pg_namespace nsp on cl.relnamespace = nsp.oid
+        WHERE T.func_oid in (
+            SELECT  p.oid
+            FROM    pg_namespace n
+            INNER JOIN pg_proc p ON p.pronamespace = n.oid
+            WHERE   n.nspname not in ( 'pg_catalog', 'information_schema' )
+        )
+    """)
+
+    if check_constraints is not None:
+        for conn in check_constraints:
+            ctx.logger.info("Removing constraints: " + conn[2])
+            query = 'ALTER TABLE "{0}"."{1}" DROP CONSTRAINT IF EXISTS "{2}" CASCADE'.format(conn[0], conn[1], conn[2])
+            await db_conn.execute(query)
+
+
+def get_restore_ledger(ctx):
+    return Ledger(os.path.join(
+        ctx.args.input_dir, RESTORE_LEDGER_FILE % re.sub(r"[^\w.-]", "_", ctx.args.db_name)
+    ))
+
+
+def get_resume_files(ctx):
+    # tables with a file which is not done by the previous runs are truncated and all their files are loaded again,
+    # returns the tables to truncate and the files to load
+    tables = set()
+    for file_name, v in ctx.metadata['files'].items():
+        record = ctx.ledger.files.get(file_name)
+        if record is None or record.get("state") != "done":
+            tables.add((v["schema"], v["table"]))
+    files = [file_name for file_name, v in ctx.metadata['files'].items() if (v["schema"], v["table"]) in tables]
+
+    # a partitioned table with all partitions incomplete is truncated as a whole, this is allowed with foreign keys
+    # referencing it if the referencing tables are truncated too
+    roots_with_done_files = set([
+        tuple(v["partition_root"]) for file_name, v in ctx.metadata['files'].items()
+        if "partition_root" in v and (v["schema"], v["table"]) not in tables
+    ])
+    truncate = set()
+    for file_name in files:
+        v = ctx.metadata['files'][file_name]
+        if "partition_root" in v and tuple(v["partition_root"]) not in roots_with_done_files:
+            truncate.add(tuple(v["partition_root"]))
+        else:
+            truncate.add((v["schema"], v["table"]))
+    return truncate, files
+
+
+async def truncate_tables(ctx, db_conn, tables):
+    # partitioned tables are truncated with their partitions, other tables without inheritance children
+    if not tables:
+        return
+    partitioned = set([(v[0], v[1]) for v in await db_conn.fetch("""
+        SELECT n.nspname, c.relname
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN unnest($1::text[], $2::text[]) AS t(schema, table_name)
+            ON t.schema = n.nspname AND t.table_name = c.relname
+        WHERE c.relkind = 'p'
+    """, [v[0] for v in tables], [v[1] for v in tables])])
+    query = "TRUNCATE %s" % ", ".join([
+        "%s\"%s\".\"%s\"" % ("" if v in partitioned else "ONLY ", v[0], v[1]) for v in sorted(tables)
+    ])
+    ctx.logger.info(query)
+    await db_conn.execute(query)
+
+
+async def get_resume_list(ctx, section, list_dir):
+    # TOC list of the section without schemas, relations, constraints and triggers which already exist in the
+    # target database. Other entries are restored again, pg_restore reports and skips those which exist
+    archive = os.path.join(ctx.args.input_dir, section.replace("-", "_") + ".backup")
+    toc_file = os.path.join(list_dir, "%s.toc.list" % section)
+    returncode, _, err = await run_pg_util(ctx, [ctx.args.pg_restore, "-l", "-f", toc_file, archive], "pg_restore list")
+    if returncode != 0:
+        raise Exception("pg_restore list has failed: %s" % "\n".join(err))
+
+    db_conn = await asyncpg.connect(**ctx.conn_params)
+    try:
+        existing = await db_conn.fetch("""
+            SELECT 'SCHEMA - ' || n.nspname
+            FROM pg_namespace n
+            UNION ALL
+            SELECT
+                CASE c.relkind
+                    WHEN 'S' THEN 'SEQUENCE'
+                    WHEN 'v' THEN 'VIEW'
+                    WHEN 'm' THEN 'MATERIALIZED VIEW'
+                    WHEN 'f' THEN 'FOREIGN TABLE'
+                    WHEN 'i' THEN 'INDEX'
+                    WHEN 'I' THEN 'INDEX'
+                    ELSE 'TABLE'
+                END || ' ' || n.nspname || ' ' || c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p', 'S', 'v', 'm', 'f', 'i', 'I')
+            UNION ALL
+            SELECT CASE WHEN c.relkind IN ('i', 'I') THEN 'INDEX ATTACH ' ELSE 'TABLE ATTACH ' END ||
+                n.nspname || ' ' || c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relispartition
+            UNION ALL
+            SELECT
+                CASE WHEN con.contype = 'f' THEN 'FK CONSTRAINT' ELSE 'CONSTRAINT' END || ' ' ||
+                n.nspname || ' ' || c.relname || ' ' || con.conname
+            FROM pg_constraint con
+            JOIN pg_class c ON c.oid = con.conrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE con.contype IN ('p', 'u', 'x', 'f')
+            UNION ALL
+            SELECT 'TRIGGER ' || n.nspname || ' ' || c.relname || ' ' || t.tgname
+            FROM pg_trigger t
+            JOIN pg_class c ON c.oid = t.tgrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE NOT t.tgisinternal
+        """)
+    finally:
+        await db_conn.close()
+    existing = set([v[0] for v in existing])
+
+    # "dumpId; classid oid TYPE schema name owner", the owner is the last word
+    list_file = os.path.join(list_dir, "%s.list" % section)
+    skipped = 0
+    with open(toc_file, "r", encoding="utf-8") as f_in, open(list_file, "w", encoding="utf-8") as f_out:
+        for line in f_in.read().splitlines():
+            match = re.match(r"^\d+; \d+ \d+ (.*) \S*$", line)
+            if match is not None and match.group(1) in existing:
+                line = ";" + line
+                skipped += 1
+            f_out.write(line + "\n")
+    ctx.logger.info("Resume: %s entries of %s already exist and are skipped" % (skipped, section))
+    return list_file
+
+
 async def make_restore(ctx):
     result = PgAnonResult()
     ctx.logger.info("-------------> Started restore")
@@ -189,25 +609,27 @@ async def make_restore(ctx):
         ctx.logger.error(msg)
         raise RuntimeError(msg)
 
+    # the ledger of files is kept in mode restore only, sync-data-restore merges into existing tables
+    ctx.ledger = None
+    resuming = False
+    if ctx.args.mode == AnonMode.RESTORE and not os.access(ctx.args.input_dir, os.W_OK):
+        ctx.logger.warning("Input directory %s is read-only, restore ledger is not kept" % ctx.args.input_dir)
+    elif ctx.args.mode == AnonMode.RESTORE:
+        ctx.ledger = get_restore_ledger(ctx)
+        resuming = ctx.args.resume and ctx.ledger.exists()
+        if ctx.args.resume and not resuming:
+            ctx.logger.warning("No ledger of a previous restore into %s, --resume ignored" % ctx.args.db_name)
+
     db_conn = await asyncpg.connect(**ctx.conn_params)
-    db_is_empty = await db_conn.fetchval("""
-        SELECT NOT EXISTS(
-            SELECT table_schema, table_name
-            FROM information_schema.tables
-            WHERE table_schema not in (
-                    'pg_catalog',
-                    'information_schema',
-                    'anon_funcs'
-                ) AND table_type = 'BASE TABLE'
-        )""")
+    db_is_empty = await is_db_empty(db_conn)
 
-    if not db_is_empty and ctx.args.mode != AnonMode.SYNC_DATA_RESTORE:
+    if not db_is_empty and ctx.args.mode != AnonMode.SYNC_DATA_RESTORE and not resuming:
         raise Exception("Target DB is not empty!")
 
     metadata_file = open(os.path.join(ctx.current_dir, 'dict', ctx.args.input_dir, 'metadata.json'), 'r')
     metadata_content = metadata_file.read()
     metadata_file.close()
-    ctx.metadata = eval(metadata_content)
+    ctx.metadata = json.loads(metadata_content)
 
     if not ctx.args.disable_checks:
         if get_major_version(ctx.pg_version) < get_major_version(ctx.metadata['pg_version']):
@@ -228,6 +650,19 @@ async def make_restore(ctx):
             )
         await check_free_disk_space(ctx, db_conn)
 
+    if resuming:
+        ctx.ledger.load()
+        if ctx.ledger.runs and ctx.ledger.runs[0]["created"] != ctx.metadata["created"]:
+            await db_conn.close()
+            raise Exception("Ledger %s belongs to another dump, --resume is not possible" % ctx.ledger.file_name)
+        ctx.logger.info("Resuming restore after %s run(s): finished sections %s" % (
+            len(ctx.ledger.runs), list(ctx.ledger.sections.keys()))
+        )
+    elif ctx.ledger is not None:
+        ctx.ledger.remove()
+    if ctx.ledger is not None:
+        ctx.ledger.write("run", created=ctx.metadata["created"], db_name=ctx.args.db_name)
+
     if ctx.args.mode == AnonMode.SYNC_STRUCT_RESTORE:
         for v in ctx.metadata['schemas']:
             query = "CREATE SCHEMA IF NOT EXISTS \"%s\"" % v
@@ -235,60 +670,97 @@ async def make_restore(ctx):
             await db_conn.execute(query)
 
     if ctx.args.mode != AnonMode.SYNC_DATA_DUMP:
-        await run_pg_restore(ctx, 'pre-data')
+        if resuming and "pre-data" in ctx.ledger.sections:
+            ctx.logger.info("Section pre-data is already restored")
+        elif resuming:
+            with tempfile.TemporaryDirectory(prefix="pg_anon_resume_") as list_dir:
+                await run_pg_restore(ctx, 'pre-data', await get_resume_list(ctx, 'pre-data', list_dir))
+        else:
+            await run_pg_restore(ctx, 'pre-data')
 
     if ctx.args.drop_custom_check_constr:
-        # drop all CHECK constrains containing user-defined procedures to avoid
-        # performance degradation at the data loading stage
-        check_constraints = await db_conn.fetch("""
-            SELECT nsp.nspname,  cl.relname, pc.conname, pg_get_constraintdef(pc.oid)
-            -- pc.consrc removed in 12 version
-            FROM (
-                SELECT substring(T.v FROM position(' ' in T.v) + 1 for length(T.v) )::bigint as func_oid, t.conoid
-                from (
-                    SELECT T.v as v, t.conoid
-                    FROM (
-                            SELECT ((SELECT regexp_matches(t.v, '(:funcid\s\d+)', 'g'))::text[])[1] as v, t.conoid
-                            FROM (
-                                SELECT conbin::text as v, oid as conoid
-                                FROM pg_constraint
-                                WHERE contype = 'c'
-                            ) T
-                    ) T WHERE length(T.v) > 0
-                ) T
-            ) T
-            INNER JOIN pg_constraint pc on T.conoid = pc.oid
-            INNER JOIN pg_class cl on cl.oid = pc.conrelid
-            INNER JOIN pg_namespace nsp on cl.relnamespace = nsp.oid
-            WHERE T.func_oid in (
-                SELECT  p.oid
-                FROM    pg_namespace n
-                INNER JOIN pg_proc p ON p.pronamespace = n.oid
-                WHERE   n.nspname not in ( 'pg_catalog', 'information_schema' )
-            )
-        """)
+        await drop_custom_check_constraints(ctx, db_conn)
 
-        if check_constraints is not None:
-            for conn in check_constraints:
-                ctx.logger.info("Removing constraints: " + conn[2])
-                query = 'ALTER TABLE "{0}"."{1}" DROP CONSTRAINT IF EXISTS "{2}" CASCADE'.format(conn[0], conn[1], conn[2])
-                await db_conn.execute(query)
+    fast_load_tables = None
+    if ctx.args.fast_load and ctx.args.mode != AnonMode.RESTORE:
+        ctx.logger.warning("Option --fast-load ignored: tables are truncated, only mode %s is supported" % (
+            AnonMode.RESTORE)
+        )
+    elif ctx.args.fast_load:
+        fast_load_tables = await get_fast_load_tables(ctx, db_conn)
+        if re.sub(r"\b(with|binary|csv|text|format)\b|[()]", "", ctx.args.copy_options, flags=re.IGNORECASE).strip():
+            ctx.logger.warning("Only the data format of --copy-options is used with --fast-load")
+
+    # files of incomplete tables are loaded again, rows of the other files are counted from the ledger
+    files = None
+    if resuming:
+        tables, files = get_resume_files(ctx)
+        await truncate_tables(ctx, db_conn, tables)
+        ctx.total_rows = sum([
+            int(v["rows"]) for file_name, v in ctx.ledger.files.items()
+            if file_name in ctx.metadata['files'] and file_name not in files
+        ])
+        ctx.logger.info("Resume: %s file(s) of %s table(s) are loaded again, %s file(s) are done" % (
+            len(files), len(tables), len(ctx.metadata['files']) - len(files))
+        )
+    if ctx.ledger is not None:
+        ctx.ledger.write_many("file", [
+            {"name": v, "state": "pending"} for v in (ctx.metadata['files'].keys() if files is None else files)
+        ])
+
+    pipeline = None
+    if ctx.args.pipeline_post_data and ctx.args.mode != AnonMode.RESTORE:
+        ctx.logger.warning("Option --pipeline-post-data ignored: only mode %s is supported" % AnonMode.RESTORE)
+    elif ctx.args.pipeline_post_data and resuming:
+        ctx.logger.warning("Option --pipeline-post-data ignored with --resume")
+    elif ctx.args.pipeline_post_data and "post_data_tables" not in ctx.metadata:
+        ctx.logger.warning("Option --pipeline-post-data ignored: metadata.json has no \"post_data_tables\"")
+    elif ctx.args.pipeline_post_data:
+        unlogged_tables = set(fast_load_tables.keys()) \
+            if fast_load_tables is not None and ctx.args.fast_load_unlogged else None
+        pipeline = await PostDataPipeline(ctx, unlogged_tables).load(get_restore_file_costs(ctx)[0])
+
+    if ctx.args.quick_analyze and "analyze_columns" not in ctx.metadata:
+        ctx.logger.warning("Option --quick-analyze ignored: metadata.json has no \"analyze_columns\"")
+        ctx.args.quick_analyze = False
 
     result.result_code = ResultCode.DONE
+    deferred_analyze = []
     if ctx.args.mode != AnonMode.SYNC_STRUCT_RESTORE:
-        tr = db_conn.transaction()
-        await tr.start()
-        try:
-            await db_conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ;")
-            await db_conn.execute("SET CONSTRAINTS ALL DEFERRED;")
-            sn_id = await db_conn.fetchval("select pg_export_snapshot()")
-            await make_restore_impl(ctx, sn_id)
-        except:
-            ctx.logger.error("<------------- make_restore failed\n" + exception_helper())
-            result.result_code = "fail"
-        finally:
-            await tr.commit()
-            await db_conn.close()
+        if fast_load_tables is not None:
+            # a load into an empty database needs no snapshot, unlogged tables are switched back before
+            # post-data, so indexes and foreign keys are created on logged tables
+            try:
+                if ctx.args.fast_load_unlogged:
+                    await set_tables_logged(ctx, fast_load_tables.keys(), False)
+                deferred_analyze = await make_restore_impl(ctx, None, fast_load_tables, pipeline, files)
+            except:
+                ctx.logger.error("<------------- make_restore failed\n" + exception_helper())
+                result.result_code = ResultCode.FAIL
+            finally:
+                try:
+                    if ctx.args.fast_load_unlogged:
+                        await set_tables_logged(ctx, fast_load_tables.keys(), True)
+                except:
+                    # tables left UNLOGGED are emptied by a crash and not replicated, the restore is failed
+                    ctx.logger.error("<------------- make_restore failed\n" + exception_helper())
+                    result.result_code = ResultCode.FAIL
+                finally:
+                    await db_conn.close()
+        else:
+            tr = db_conn.transaction()
+            await tr.start()
+            try:
+                await db_conn.execute("BEGIN ISOLATION LEVEL REPEATABLE READ;")
+                await db_conn.execute("SET CONSTRAINTS ALL DEFERRED;")
+                sn_id = await db_conn.fetchval("select pg_export_snapshot()")
+                deferred_analyze = await make_restore_impl(ctx, sn_id, pipeline=pipeline, files=files)
+            except:
+                ctx.logger.error("<------------- make_restore failed\n" + exception_helper())
+                result.result_code = "fail"
+            finally:
+                await tr.commit()
+                await db_conn.close()
 
         if ctx.total_rows != int(ctx.metadata["total_rows"]):
             ctx.logger.error("The number of restored rows (%s) is different from the metadata (%s)" % (
@@ -298,11 +770,43 @@ async def make_restore(ctx):
             )
             result.result_code = ResultCode.FAIL
 
-    if ctx.args.mode != AnonMode.SYNC_DATA_RESTORE:
-        await run_pg_restore(ctx, 'post-data')
+    # ANALYZE takes a SHARE UPDATE EXCLUSIVE lock, CREATE INDEX (SHARE) and ADD FOREIGN KEY (SHARE ROW EXCLUSIVE)
+    # of post-data wait for the ANALYZE of their table and the other way around
+    analyze_task = None
+    if deferred_analyze:
+        analyze_task = asyncio.get_event_loop().create_task(run_deferred_analyze(ctx, deferred_analyze))
 
-    if ctx.args.mode != AnonMode.SYNC_STRUCT_RESTORE:
-        await seq_init(ctx)
+    # with the ledger, post-data of an incomplete load is left to --resume, so tables can be truncated
+    # without foreign keys
+    incomplete = [] if ctx.ledger is None else [v for v in ctx.ledger.files.values() if v["state"] != "done"]
+    try:
+        if incomplete:
+            ctx.logger.error("%s file(s) are not loaded, post-data is not restored, repeat the restore with --resume" % (
+                len(incomplete))
+            )
+            result.result_code = ResultCode.FAIL
+            if pipeline is not None:
+                await pipeline.close()
+                pipeline.cleanup()
+        elif pipeline is not None:
+            try:
+                await pipeline.close()
+                await run_pg_restore(ctx, 'post-data', pipeline.get_rest_list())
+            finally:
+                pipeline.cleanup()
+        elif resuming and "post-data" in ctx.ledger.sections:
+            ctx.logger.info("Section post-data is already restored")
+        elif resuming:
+            with tempfile.TemporaryDirectory(prefix="pg_anon_resume_") as list_dir:
+                await run_pg_restore(ctx, 'post-data', await get_resume_list(ctx, 'post-data', list_dir))
+        elif ctx.args.mode != AnonMode.SYNC_DATA_RESTORE:
+            await run_pg_restore(ctx, 'post-data')
+
+        if ctx.args.mode != AnonMode.SYNC_STRUCT_RESTORE and not incomplete:
+            await seq_init(ctx)
+    finally:
+        if analyze_task is not None:
+            await analyze_task
 
     await db_conn.close()
     ctx.logger.info("<------------- Finished restore")
@@ -320,35 +824,45 @@ async def run_custom_query(ctx, pool, query):
         ctx.logger.error("Exception in dump_obj_func:\n" + exception_helper())
         raise Exception("Can't execute query: %s" % query)
     finally:
-        await db_conn.close()
+        # the connection is kept in the pool for the next query
         await pool.release(db_conn)
 
     ctx.logger.info('<================ Finished query %s' % str(query))
 
 
-async def run_analyze(ctx):
-    ctx.logger.info("-------------> Started analyze")
+async def run_parallel_queries(ctx, queries):
     pool = await asyncpg.create_pool(
         **ctx.conn_params,
         min_size=ctx.args.threads,
         max_size=ctx.args.threads
     )
 
-    queries = generate_analyze_queries(ctx)
     loop = asyncio.get_event_loop()
     tasks = set()
-    for v in queries:
-        if len(tasks) >= ctx.args.threads:
-            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-            exception = done.pop().exception()
-            if exception is not None:
-                await pool.close()
-                raise exception
-        tasks.add(loop.create_task(run_custom_query(ctx, pool, v)))
-
-    # Wait for the remaining queries to finish
-    await asyncio.wait(tasks)
-    await pool.close()
+    try:
+        for v in queries:
+            if len(tasks) >= ctx.args.threads:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        raise task.exception()
+            tasks.add(loop.create_task(run_custom_query(ctx, pool, v)))
+
+        # Wait for the remaining queries to finish, their errors are raised too
+        if tasks:
+            done, tasks = await asyncio.wait(tasks)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+    finally:
+        if tasks:
+            await asyncio.wait(tasks)
+        await pool.close()
+
+
+async def run_analyze(ctx):
+    ctx.logger.info("-------------> Started analyze")
+    await run_parallel_queries(ctx, generate_analyze_queries(ctx))
     ctx.logger.info("<------------- Finished analyze")
 
 
@@ -0,0 +1,236 @@
+import time
+from common import *
+from catalog import *
+from explain import *
+
+SUBSET_TABLE_PREFIX = "pg_anon_subset_"
+
+
+class Subset:
+    # Referentially closed subset defined by "subset" of the dictionary. Rows of the root tables are selected by
+    # "where" and "percent", then rows referencing included rows are added along foreign keys (down) and after that
+    # rows referenced by included rows (up), so every foreign key of the subset is satisfied.
+    # Row ids are collected in temp tables of the snapshot transaction, one table per table or partition root,
+    # with "gen" of the round in which rows were added: each round follows foreign keys only from new rows.
+    # Tables connected to the root tables by foreign keys are dumped restricted to the subset, other tables in full
+
+    def __init__(self, ctx, db_conn, catalog):
+        self.ctx = ctx
+        self.db_conn = db_conn
+        self.catalog = catalog
+        self.lock = asyncio.Lock()  # the snapshot connection sends row ids to one worker at a time
+        self.nodes = {}             # (schema, table) of a table or partition root -> table info
+        self.foreign_keys = []      # foreign keys between the nodes
+        self.rows = {}              # oid of a table or partition -> rows in the subset
+        self.gen = 0
+
+    def get_node(self, tbl):
+        ancestors = self.catalog.get_ancestors(tbl)
+        return ancestors[-1] if ancestors else tbl
+
+    @staticmethod
+    def get_temp_table(node):
+        return "%s%s" % (SUBSET_TABLE_PREFIX, node["oid"])
+
+    def get_root_query(self, root):
+        table_name = "\"%s\".\"%s\"" % (root["schema"], root["table"])
+        query = "SELECT tableoid, ctid FROM %s" % table_name
+        if "percent" in root:
+            query += " TABLESAMPLE BERNOULLI (%s)" % float(root["percent"])
+            if "seed" in root:
+                query += " REPEATABLE (%s)" % int(root["seed"])
+        if "where" in root:
+            query += " WHERE (%s)" % root["where"]
+        return query
+
+    def get_edge_query(self, fk, down):
+        # rows of the target table which are joined by the foreign key to rows of the source table added
+        # between generations $1 and $2. Row ids of the source are found with "TID Scan" on each partition
+        table = self.catalog.get_table(fk["schema"], fk["table"])
+        ref_table = self.catalog.get_table(fk["ref_schema"], fk["ref_table"])
+        if down:
+            src, src_columns, dst, dst_columns = ref_table, fk["ref_columns"], table, fk["columns"]
+        else:
+            src, src_columns, dst, dst_columns = table, fk["columns"], ref_table, fk["ref_columns"]
+        src_tmp = "pg_temp.%s" % self.get_temp_table(self.get_node(src))
+        dst_tmp = "pg_temp.%s" % self.get_temp_table(self.get_node(dst))
+        return """
+            INSERT INTO %s (rel, row_id, gen)
+            SELECT rel, row_id, $2::integer FROM (
+                SELECT d.tableoid, d.ctid
+                FROM "%s"."%s" d
+                WHERE (%s) IN (
+                    SELECT %s
+                    FROM "%s"."%s" s
+                    WHERE
+                        s.ctid = ANY(ARRAY(SELECT row_id FROM %s WHERE gen >= $1::integer AND gen < $2::integer)) AND
+                        (s.tableoid, s.ctid) IN (
+                            SELECT rel, row_id FROM %s WHERE gen >= $1::integer AND gen < $2::integer
+                        )
+                )
+                EXCEPT
+                SELECT rel, row_id FROM %s
+            ) AS t(rel, row_id)
+        """ % (
+            dst_tmp,
+            dst["schema"], dst["table"],
+            ", ".join(["d.\"%s\"" % v for v in dst_columns]),
+            ", ".join(["s.\"%s\"" % v for v in src_columns]),
+            src["schema"], src["table"],
+            src_tmp,
+            src_tmp,
+            dst_tmp
+        )
+
+    def find_nodes(self, roots):
+        # tables connected to the root tables by foreign keys in any direction
+        edges = {}
+        for fk in self.catalog.foreign_keys:
+            a = self.get_node(self.catalog.get_table(fk["schema"], fk["table"]))
+            b = self.get_node(self.catalog.get_table(fk["ref_schema"], fk["ref_table"]))
+            edges.setdefault((a["schema"], a["table"]), []).append(b)
+            edges.setdefault((b["schema"], b["table"]), []).append(a)
+
+        stack = [self.get_node(v) for v in roots]
+        while stack:
+            node = stack.pop()
+            key = (node["schema"], node["table"])
+            if key not in self.nodes:
+                self.nodes[key] = node
+                stack.extend(edges.get(key, []))
+
+        for fk in self.catalog.foreign_keys:
+            node = self.get_node(self.catalog.get_table(fk["schema"], fk["table"]))
+            if (node["schema"], node["table"]) in self.nodes:
+                self.foreign_keys.append(fk)
+
+    async def expand(self, down):
+        # semi-naive evaluation: rounds until no rows are added, the first round starts from all rows
+        rounds = 0
+        prev_gen = 0
+        while True:
+            self.gen += 1
+            rounds += 1
+            changed = set()
+            for fk in self.foreign_keys:
+                res = await self.db_conn.execute(self.get_edge_query(fk, down), prev_gen, self.gen)
+                if int(re.findall(r"(\d+)", res)[-1]) > 0:
+                    changed.add((fk["schema"], fk["table"]) if down else (fk["ref_schema"], fk["ref_table"]))
+            if not changed:
+                return rounds
+            for v in set([self.get_temp_table(self.get_node(self.catalog.get_table(*v))) for v in changed]):
+                await self.db_conn.execute("ANALYZE pg_temp.%s" % v)
+            prev_gen = self.gen
+
+    async def build(self):
+        roots = []
+        for v in self.ctx.dictionary_obj["subset"]:
+            tbl = self.catalog.get_table(v["schema"], v["table"])
+            if tbl is None:
+                raise Exception("Subset root table \"%s\".\"%s\" not found" % (v["schema"], v["table"]))
+            if "where" not in v and "percent" not in v:
+                raise Exception("Subset root table \"%s\".\"%s\" requires \"where\" or \"percent\"" % (
+                    v["schema"], v["table"])
+                )
+            roots.append(tbl)
+
+        if self.ctx.args.validate_dict:
+            # only the root queries are planned, tables are validated without the subset
+            for v in self.ctx.dictionary_obj["subset"]:
+                await explain_query(self.db_conn, self.get_root_query(v))
+            return self
+
+        start_t = time.time()
+        self.find_nodes(roots)
+        for node in self.nodes.values():
+            await self.db_conn.execute(
+                "CREATE TEMP TABLE %s (rel oid, row_id tid, gen integer)" % self.get_temp_table(node)
+            )
+
+        for v, tbl in zip(self.ctx.dictionary_obj["subset"], roots):
+            tmp = "pg_temp.%s" % self.get_temp_table(self.get_node(tbl))
+            await self.db_conn.execute("""
+                INSERT INTO %s (rel, row_id, gen)
+                SELECT rel, row_id, 0 FROM (%s EXCEPT SELECT rel, row_id FROM %s) AS t(rel, row_id)
+            """ % (tmp, self.get_root_query(v), tmp))
+        for node in self.nodes.values():
+            await self.db_conn.execute("ANALYZE pg_temp.%s" % self.get_temp_table(node))
+
+        down_rounds = await self.expand(True)
+        up_rounds = await self.expand(False)
+
+        for node in self.nodes.values():
+            for v in await self.db_conn.fetch(
+                "SELECT rel, count(*) FROM pg_temp.%s GROUP BY rel" % self.get_temp_table(node)
+            ):
+                self.rows[v[0]] = v[1]
+
+        self.ctx.logger.info(
+            "Subset: %s root table(s), %s table(s) connected by %s foreign key(s), %s row(s), "
+            "%s round(s) down, %s round(s) up in %.2fs" % (
+                len(roots), len(self.nodes), len(self.foreign_keys), sum(self.rows.values()),
+                down_rounds, up_rounds, time.time() - start_t
+            )
+        )
+        for node in self.nodes.values():
+            self.ctx.logger.debug("Subset of \"%s\".\"%s\": %s of ~%s row(s)" % (
+                node["schema"], node["table"],
+                sum([self.rows.get(v["oid"], 0) for v in self.catalog.get_data_tables(node)]),
+                sum([v["rows"] or 0 for v in self.catalog.get_data_tables(node)]))
+            )
+        return self
+
+    def contains(self, tbl):
+        node = self.get_node(tbl)
+        return (node["schema"], node["table"]) in self.nodes
+
+    def get_condition(self, tbl):
+        # condition of the COPY query of a table or partition, None if the table is dumped in full
+        if not self.contains(tbl):
+            return None
+        return "ctid = ANY(ARRAY(SELECT row_id FROM pg_temp.%s WHERE rel = %s))" % (
+            self.get_temp_table(self.get_node(tbl)), tbl["oid"]
+        )
+
+    def get_rows(self, tbl):
+        return sum([self.rows.get(v["oid"], 0) for v in self.catalog.get_data_tables(tbl)])
+
+    def get_size(self, tbl, size):
+        # estimated size of the table in the subset
+        rows = sum([v["rows"] or 0 for v in self.catalog.get_data_tables(tbl)])
+        return size * min(self.get_rows(tbl) / rows, 1) if rows > 0 else size
+
+    async def prepare_task(self, worker_conn, file_info):
+        # row ids of the table are copied from the snapshot connection into a temp table of the worker
+        if not file_info.get("subset"):
+            return
+        tbl = self.catalog.get_table(file_info["schema"], file_info["table"])
+        name = self.get_temp_table(self.get_node(tbl))
+        await worker_conn.execute("CREATE TEMP TABLE IF NOT EXISTS %s (rel oid, row_id tid, gen integer)" % name)
+
+        pipe = CopyPipe()
+
+        async def copy_from_snapshot():
+            res = await self.db_conn.copy_from_query(
+                "SELECT rel, row_id, gen FROM pg_temp.%s WHERE rel = $1" % name,
+                tbl["oid"],
+                output=pipe.write,
+                format="binary"
+            )
+            await pipe.close()
+            return res
+
+        async with self.lock:
+            await wait_all([
+                copy_from_snapshot(),
+                worker_conn.copy_to_table(name, schema_name="pg_temp", source=pipe.chunks(), format="binary")
+            ])
+        await worker_conn.execute("ANALYZE pg_temp.%s" % name)
+
+    def get_info(self):
+        return {
+            "roots": self.ctx.dictionary_obj["subset"],
+            "tables": ["%s.%s" % (v["schema"], v["table"]) for v in self.nodes.values()],
+            "foreign_keys": len(self.foreign_keys),
+            "rows": sum(self.rows.values())
+        }
@@ -2,9 +2,14 @@ import copy
 import unittest
 import sys
 import os
+import random
+import shutil
+import tempfile
+import time
 from decimal import Decimal
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from pg_anon import *
+import compressors
 
 
 input_args = None
@@ -132,6 +137,10 @@ class BasicUnitTest:
         await DBOperations.init_db(db_conn, params.test_target_db + "_4")
         await DBOperations.init_db(db_conn, params.test_target_db + "_5")
         await DBOperations.init_db(db_conn, params.test_target_db + "_6")
+        await DBOperations.init_db(db_conn, params.test_target_db + "_7")
+        await DBOperations.init_db(db_conn, params.test_target_db + "_8")
+        await DBOperations.init_db(db_conn, params.test_target_db + "_9")
+        await DBOperations.init_db(db_conn, params.test_target_db + "_10")
         await db_conn.close()
 
         sourse_db_params = ctx.conn_params.copy()
@@ -451,6 +460,36 @@ class PGAnonUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
             passed_stages.append("test_02_dump")
         self.assertTrue(res.result_code == ResultCode.DONE)
 
+        # sequence values and sizes are taken from the bulk-loaded catalog
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        self.assertTrue(len(metadata["seq_lastvals"]) > 0)
+        self.assertTrue(metadata["total_tables_size"] > 0)
+        db_conn = await asyncpg.connect(**Context(args).conn_params)
+        for v in metadata["seq_lastvals"].values():
+            value = await db_conn.fetchval('SELECT last_value FROM "%s"."%s"' % (v["schema"], v["seq_name"]))
+            self.assertEqual(value, v["value"])
+
+        # only tables the user can read are loaded, an analyzed empty table has 0 rows
+        ctx = Context(args)
+        ctx.logger = logging.getLogger("test_02_dump")
+        tr = db_conn.transaction()
+        await tr.start()
+        try:
+            await db_conn.execute("""
+                CREATE ROLE anon_test_catalog_reader NOLOGIN;
+                CREATE TABLE public.catalog_empty_tbl (id int);
+                ANALYZE public.catalog_empty_tbl;
+                GRANT SELECT ON public.catalog_empty_tbl TO anon_test_catalog_reader;
+                SET LOCAL ROLE anon_test_catalog_reader;
+            """)
+            catalog = await Catalog().load(ctx, db_conn)
+        finally:
+            await tr.rollback()
+        await db_conn.close()
+        self.assertEqual(list(catalog.tables.keys()), [("public", "catalog_empty_tbl")])
+        self.assertEqual(catalog.tables[("public", "catalog_empty_tbl")]["rows"], 0)
+
     async def test_03_restore(self):
         if "test_02_dump" not in passed_stages:
             self.assertTrue(False)
@@ -706,9 +745,8 @@ class PGAnonUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
             passed_stages.append("test_08_sync_data")
 
 
-class PGAnonValidateUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
-    async def test_01_validate(self):
-        if "test_06_sync_struct" not in passed_stages:
+    async def test_09_dump_slices(self):
+        if "init_env" not in passed_stages:
             self.assertTrue(False)
 
         parser = Context.get_arg_parser()
@@ -721,22 +759,61 @@ class PGAnonValidateUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
             '--mode=dump',
             '--dict-file=test.py',
             '--threads=%s' % params.test_threads,
+            '--dump-slice-threshold=0.5',
+            '--dump-slices=3',
+            '--output-dir=test_slices',
             '--clear-output-dir',
             '--verbose=debug',
-            '--debug',
-            '--validate-dict',
-            '--output-dir=test_01_validate'
+            '--debug'
         ])
 
         res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        with open(os.path.join(args.output_dir, 'metadata.json'), 'r') as f:
+            metadata = json.load(f)
+        sliced_files = [v for v in metadata["files"].values() if "slice" in v]
+        self.assertTrue(len(sliced_files) > 0)
+        for v in sliced_files:
+            self.assertTrue(v["slice"]["parts"] == 3)
+
         if res.result_code == ResultCode.DONE:
-            passed_stages.append("test_01_validate")
+            passed_stages.append("test_09_dump_slices")
+
+    async def test_10_restore_slices(self):
+        if "test_09_dump_slices" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_target_db + "_6",
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_slices',
+            '--drop-custom-check-constr',
+            '--verbose=debug',
+            '--debug'
+        ])
+
+        res = await MainRoutine(args).run()
         self.assertTrue(res.result_code == ResultCode.DONE)
 
-    async def test_02_validate_full(self):
-        if "test_01_validate" not in passed_stages:
+        objs = [
+            ["schm_mask_ext_exclude_2", "card_numbers", rows_in_init_env * int(params.test_scale) * 3]   # see init_env.sql
+        ]
+        self.assertTrue(await self.check_rows_count(args, objs))
+
+
+    async def test_11_client_side_dump(self):
+        if "init_env" not in passed_stages:
             self.assertTrue(False)
 
+        progress_file = os.path.join(tempfile.mkdtemp(), "progress.json")
+
         parser = Context.get_arg_parser()
         args = parser.parse_args([
             '--db-host=%s' % params.test_db_host,
@@ -747,194 +824,1595 @@ class PGAnonValidateUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
             '--mode=dump',
             '--dict-file=test.py',
             '--threads=%s' % params.test_threads,
+            '--client-side-dump',
+            '--output-dir=test_client_side',
             '--clear-output-dir',
+            '--progress-interval=0.1',
+            '--progress-file=%s' % progress_file,
             '--verbose=debug',
-            '--debug',
-            '--validate-full',
-            '--output-dir=test_02_validate_full'
+            '--debug'
         ])
 
         res = await MainRoutine(args).run()
         if res.result_code == ResultCode.DONE:
-            passed_stages.append("test_02_validate_full")
+            passed_stages.append("test_11_client_side_dump")
         self.assertTrue(res.result_code == ResultCode.DONE)
 
+        # the last progress record is written when all tasks are finished
+        with open(progress_file, "r") as f:
+            records = [json.loads(v) for v in f.readlines()]
+        shutil.rmtree(os.path.dirname(progress_file))
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        self.assertEqual(records[-1]["mode"], "dump")
+        self.assertEqual(records[-1]["percent"], 100.0)
+        self.assertEqual(records[-1]["tasks_finished"], len(metadata["files"]))
+        self.assertEqual(records[-1]["rows"], metadata["total_rows"])
+        self.assertTrue(records[-1]["bytes"] > 0)
+        self.assertEqual(records[-1]["active"], [])
+
+    async def test_12_client_side_restore(self):
+        if "test_11_client_side_dump" not in passed_stages:
+            self.assertTrue(False)
 
-class PGAnonDictGenUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
-    target_dict = 'test_meta_dict_result.py'
-    args = {}
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_target_db + "_7",
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_client_side',
+            '--drop-custom-check-constr',
+            '--verbose=debug',
+            '--debug'
+        ])
 
-    async def test_01_init(self):
-        res = await self.init_env()
+        res = await MainRoutine(args).run()
         self.assertTrue(res.result_code == ResultCode.DONE)
 
-    async def test_02_create_dict(self):
+        objs = [
+            ["schm_mask_ext_exclude_2", "card_numbers", rows_in_init_env * int(params.test_scale) * 3]   # see init_env.sql
+        ]
+        self.assertTrue(await self.check_rows_count(args, objs))
+
+        rows = [
+            [3, 'text const'],
+            [4, 'text const']
+        ]
+        self.assertTrue(await self.check_rows(args, "schm_mask_include_1", "tbl_123", None, rows))
+
+
+    @unittest.skipIf(shutil.which("zstd") is None, "zstd is not installed")
+    async def test_13_zstd_dump(self):
         if "init_env" not in passed_stages:
             self.assertTrue(False)
 
         parser = Context.get_arg_parser()
-        self.args_create_dict = parser.parse_args([
+        args = parser.parse_args([
             '--db-host=%s' % params.test_db_host,
             '--db-name=%s' % params.test_source_db,
             '--db-user=%s' % params.test_db_user,
             '--db-port=%s' % params.test_db_port,
             '--db-user-password=%s' % params.test_db_user_password,
-            '--mode=create-dict',
-            '--scan-mode=full',
-            '--dict-file=test_meta_dict.py',
-            '--output-dict-file=%s' % self.target_dict,
+            '--mode=dump',
+            '--dict-file=test.py',
             '--threads=%s' % params.test_threads,
-            # '--threads=8',
-            '--scan-partial-rows=10000',
+            '--compress=zstd',
+            '--compress-level=5',
+            '--output-dir=test_zstd',
+            '--clear-output-dir',
             '--verbose=debug',
             '--debug'
         ])
 
-        res = await MainRoutine(self.args_create_dict).run()
-        parent_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
-        with open(os.path.join(parent_dir, 'dict', 'test_meta_dict_result.py'), 'r', encoding='utf-8') as file1, \
-                open(os.path.join(parent_dir, 'dict', 'test_meta_dict_result_expected.py'), 'r',
-                     encoding='utf-8') as file2:
-            d1 = json.load(file1)['dictionary']
-            d2 = json.load(file2)['dictionary']
+        res = await MainRoutine(args).run()
+        if res.result_code == ResultCode.DONE:
+            passed_stages.append("test_13_zstd_dump")
+        self.assertTrue(res.result_code == ResultCode.DONE)
 
-            def iterate_dict_level_2(data):
-                for k, v in data.items():
-                    yield {k: v}
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        for file_name, v in metadata["files"].items():
+            self.assertTrue(file_name.endswith(".dat.zst"))
+            self.assertTrue(v["codec"] == "zstd" and v["compress_level"] == 5)
 
-            def iterate_dict_level_1(data):
-                for item in data:
-                    if 'fields' in item:
-                        yield from iterate_dict_level_2(item['fields'])
-                    else:
-                        yield from iterate_dict_level_2(item)
+        # without the Python modules a client-side dump fails at argument parsing or query generation
+        saved_modules = (compressors.zstandard, compressors.lz4)
+        compressors.zstandard, compressors.lz4 = None, None
+        try:
+            with self.assertRaises(SystemExit):
+                parser.parse_args(['--mode=dump', '--client-side-dump', '--compress=zstd'])
+            ctx = Context(parser.parse_args(['--mode=dump', '--client-side-dump']))
+            self.assertEqual(get_table_codec(ctx, {"compress": "gzip"})[0], CompressCodec.GZIP)
+            with self.assertRaises(Exception):
+                get_table_codec(ctx, {"compress": "lz4"})
+        finally:
+            compressors.zstandard, compressors.lz4 = saved_modules
+
+    async def test_14_zstd_restore(self):
+        if "test_13_zstd_dump" not in passed_stages:
+            self.skipTest("test_13_zstd_dump is not passed")
 
-            flag_of_identity = True  # comparing elements of two dictionaries
-            expected_result_list_of_iterate_dict = []
-            result_list_of_iterate_dict = []
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_target_db + "_8",
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_zstd',
+            '--drop-custom-check-constr',
+            '--verbose=debug',
+            '--debug'
+        ])
 
-            print("============> Started comparison of test_meta_dict_result.py and test_meta_dict_result_expected.py")
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
 
-            for line in iterate_dict_level_1(d2):
-                expected_result_list_of_iterate_dict.append(line)
+        objs = [
+            ["schm_mask_ext_exclude_2", "card_numbers", rows_in_init_env * int(params.test_scale) * 3]   # see init_env.sql
+        ]
+        self.assertTrue(await self.check_rows_count(args, objs))
 
-            for line in iterate_dict_level_1(d1):
-                result_list_of_iterate_dict.append(line)
-                if line not in expected_result_list_of_iterate_dict:
-                    flag_of_identity = False
-                    print("check_comparison: row %s not found in test_meta_dict_result.py" % str(line))
+    async def test_15_sync_data_watermark(self):
+        # sync-data-dump with "watermark" in dictionary ---> sync-data-restore applies only new rows
+        if "init_env" not in passed_stages:
+            self.assertTrue(False)
 
-            if flag_of_identity:
-                for line in iterate_dict_level_1(d2):
-                    if line not in result_list_of_iterate_dict:
-                        flag_of_identity = False
-                        print("check_comparison: row %s not found in test_meta_dict_result_expected.py" % str(line))
+        parser = Context.get_arg_parser()
+        conn_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--threads=%s' % params.test_threads,
+            '--verbose=debug',
+            '--debug'
+        ]
+        source_args = ['--db-name=%s' % params.test_source_db] + conn_args
+        target_args = ['--db-name=%s' % params.test_target_db + "_9"] + conn_args
+        dump_args = parser.parse_args(source_args + [
+            '--mode=sync-data-dump',
+            '--dict-file=test_sync_data_watermark.py',
+            '--clear-output-dir'
+        ])
+        restore_args = parser.parse_args(target_args + [
+            '--mode=sync-data-restore',
+            '--input-dir=test_sync_data_watermark'
+        ])
 
-            print("<============ Finished comparison of test_meta_dict_result.py and test_meta_dict_result_expected.py")
+        res = await MainRoutine(parser.parse_args(source_args + [
+            '--mode=sync-struct-dump',
+            '--dict-file=test_sync_data_watermark.py',
+            '--output-dir=test_sync_struct_watermark',
+            '--clear-output-dir'
+        ])).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        res = await MainRoutine(parser.parse_args(target_args + [
+            '--mode=sync-struct-restore',
+            '--input-dir=test_sync_struct_watermark'
+        ])).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
 
-        self.assertTrue(flag_of_identity)
+        # first run ignores the previous watermark, the table is copied in full
+        res = await MainRoutine(parser.parse_args(source_args + [
+            '--mode=sync-data-dump',
+            '--dict-file=test_sync_data_watermark.py',
+            '--clear-output-dir',
+            '--reset-watermarks'
+        ])).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        res = await MainRoutine(copy.deepcopy(restore_args)).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        rows_count = rows_in_init_env * int(params.test_scale)
+        objs = [["schm_mask_include_1", "tbl_123", rows_count]]
+        self.assertTrue(await self.check_rows_count(restore_args, objs))
 
-        if res.result_code == ResultCode.DONE:
-            passed_stages.append("test_02_create_dict")
+        source_conn = await asyncpg.connect(**Context(dump_args).conn_params)
+        try:
+            await source_conn.execute("""
+                INSERT INTO schm_mask_include_1.tbl_123 (id, val)
+                SELECT %s + v, 'text_val_' || (%s + v) FROM generate_series(1, 2) AS v
+            """ % (rows_count, rows_count))
+
+            res = await MainRoutine(dump_args).run()
+            self.assertTrue(res.result_code == ResultCode.DONE)
+            with open(os.path.join(dump_args.output_dir, "metadata.json"), "r") as f:
+                metadata = json.loads(f.read())
+            self.assertEqual(metadata["total_rows"], 2)
+            for v in metadata["files"].values():
+                self.assertEqual(v["watermark"]["from"], str(rows_count))
+                self.assertEqual(v["watermark"]["to"], str(rows_count + 2))
+                self.assertEqual(v["watermark"]["key"], ["id"])
+        finally:
+            await source_conn.execute("DELETE FROM schm_mask_include_1.tbl_123 WHERE id > %s" % rows_count)
+            await source_conn.close()
+
+        res = await MainRoutine(copy.deepcopy(restore_args)).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        objs = [["schm_mask_include_1", "tbl_123", rows_count + 2]]
+        self.assertTrue(await self.check_rows_count(restore_args, objs))
 
-    async def test_03_dump(self):
-        if "test_02_create_dict" not in passed_stages:
+        target_conn = await asyncpg.connect(**Context(restore_args).conn_params)
+        db_rows = await target_conn.fetch(
+            "SELECT id, val FROM schm_mask_include_1.tbl_123 WHERE id > %s ORDER BY id" % rows_count
+        )
+        await target_conn.close()
+        self.assertEqual([list(v) for v in db_rows], [
+            [rows_count + 1, 't***%s' % str(rows_count + 1)[-3:]],
+            [rows_count + 2, 't***%s' % str(rows_count + 2)[-3:]]
+        ])
+
+        # an updated row raises the watermark and replaces the target row with the same "watermark_key"
+        key_dump_args = parser.parse_args(source_args + [
+            '--mode=sync-data-dump',
+            '--dict-file=test_sync_data_watermark_key.py',
+            '--clear-output-dir'
+        ])
+        key_restore_args = parser.parse_args(target_args + [
+            '--mode=sync-data-restore',
+            '--input-dir=test_sync_data_watermark_key'
+        ])
+        ddl = """
+            CREATE SCHEMA schm_watermark;
+            CREATE TABLE schm_watermark.tbl_upd (code text NOT NULL, val text, updated_at integer);
+        """
+        source_conn = await asyncpg.connect(**Context(dump_args).conn_params)
+        target_conn = await asyncpg.connect(**Context(restore_args).conn_params)
+        try:
+            await source_conn.execute(ddl + """
+                INSERT INTO schm_watermark.tbl_upd VALUES ('a', 'val_a', 1), ('b', 'val_b', 2), ('c', 'val_c', 3);
+                ANALYZE schm_watermark.tbl_upd;
+            """)
+            await target_conn.execute(ddl)
+            res = await MainRoutine(parser.parse_args(source_args + [
+                '--mode=sync-data-dump',
+                '--dict-file=test_sync_data_watermark_key.py',
+                '--clear-output-dir',
+                '--reset-watermarks'
+            ])).run()
+            self.assertTrue(res.result_code == ResultCode.DONE)
+            res = await MainRoutine(copy.deepcopy(key_restore_args)).run()
+            self.assertTrue(res.result_code == ResultCode.DONE)
+
+            await source_conn.execute("""
+                UPDATE schm_watermark.tbl_upd SET val = 'new_b', updated_at = 4 WHERE code = 'b';
+                INSERT INTO schm_watermark.tbl_upd VALUES ('d', 'val_d', 5);
+                ANALYZE schm_watermark.tbl_upd;
+            """)
+
+            # --plan doesn't scan the table for max(), the delta is 1 of 4 rows by reltuples
+            seq_scan_query = "SELECT seq_scan FROM pg_stat_user_tables WHERE relid = 'schm_watermark.tbl_upd'::regclass"
+            seq_scan = await source_conn.fetchval(seq_scan_query)
+            res = await MainRoutine(parser.parse_args(source_args + [
+                '--mode=sync-data-dump',
+                '--dict-file=test_sync_data_watermark_key.py',
+                '--output-dir=test_sync_data_watermark_key',
+                '--plan'
+            ])).run()
+            self.assertTrue(res.result_code == ResultCode.DONE)
+            self.assertEqual(len(res.result_data["tasks"]), 1)
+            table_size = await source_conn.fetchval("SELECT pg_relation_size('schm_watermark.tbl_upd')")
+            self.assertEqual(res.result_data["tasks"][0]["size"], table_size / 4)
+            await asyncio.sleep(1)
+            self.assertEqual(await source_conn.fetchval(seq_scan_query), seq_scan)
+
+            res = await MainRoutine(key_dump_args).run()
+            self.assertTrue(res.result_code == ResultCode.DONE)
+            with open(os.path.join(key_dump_args.output_dir, "metadata.json"), "r") as f:
+                metadata = json.loads(f.read())
+            self.assertEqual(metadata["total_rows"], 2)
+            for v in metadata["files"].values():
+                self.assertEqual(v["watermark"]["key"], ["code"])
+                self.assertEqual([v["watermark"]["from"], v["watermark"]["to"]], ["3", "5"])
+            res = await MainRoutine(copy.deepcopy(key_restore_args)).run()
+            self.assertTrue(res.result_code == ResultCode.DONE)
+
+            db_rows = await target_conn.fetch("SELECT code, val, updated_at FROM schm_watermark.tbl_upd ORDER BY code")
+            self.assertEqual([list(v) for v in db_rows], [
+                ["a", "VAL_A", 1], ["b", "NEW_B", 4], ["c", "VAL_C", 3], ["d", "VAL_D", 5]
+            ])
+        finally:
+            await source_conn.execute("DROP SCHEMA IF EXISTS schm_watermark CASCADE")
+            await target_conn.execute("DROP SCHEMA IF EXISTS schm_watermark CASCADE")
+            await source_conn.close()
+            await target_conn.close()
+
+        # an anonymized key would match no rows on restore
+        ctx = Context(key_dump_args)
+        tbl = {"schema": "schm_watermark", "table": "tbl_upd", "columns": ["code", "val", "updated_at"], "key": []}
+        with self.assertRaises(Exception):
+            await get_table_watermark(ctx, None, tbl, {
+                "watermark": "updated_at", "watermark_key": ["code"], "fields": {"code": "md5(code)"}
+            })
+
+    async def test_16_resume_dump(self):
+        if "init_env" not in passed_stages:
             self.assertTrue(False)
 
         parser = Context.get_arg_parser()
-        args = copy.deepcopy(parser.parse_args([
+        dump_args = [
             '--db-host=%s' % params.test_db_host,
             '--db-name=%s' % params.test_source_db,
             '--db-user=%s' % params.test_db_user,
             '--db-port=%s' % params.test_db_port,
             '--db-user-password=%s' % params.test_db_user_password,
             '--mode=dump',
-            '--dict-file=%s' % self.target_dict,
+            '--dict-file=test.py',
             '--threads=%s' % params.test_threads,
-            '--clear-output-dir',
+            '--dump-slice-threshold=0.5',
+            '--dump-slices=3',
+            '--output-dir=test_resume',
             '--verbose=debug',
             '--debug'
-        ]))
-        self.args["dump"] = copy.deepcopy(args)
+        ]
+        args = parser.parse_args(dump_args + ['--clear-output-dir'])
         res = await MainRoutine(args).run()
-        if res.result_code == ResultCode.DONE:
-            passed_stages.append("test_03_dump")
         self.assertTrue(res.result_code == ResultCode.DONE)
 
-    async def test_04_restore(self):
-        if "test_03_dump" not in passed_stages:
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+
+        # simulate a dump interrupted before the second slice of card_numbers and contracts were finished
+        lost_tables = [["schm_mask_ext_exclude_2", "card_numbers"], ["public", "contracts"]]
+        lost_files = []
+        with open(os.path.join(args.output_dir, DUMP_LEDGER_FILE), "r") as f:
+            records = [json.loads(v) for v in f.readlines()]
+        with open(os.path.join(args.output_dir, DUMP_LEDGER_FILE), "w") as f:
+            for v in records:
+                if v["type"] == "file" and [v["info"]["schema"], v["info"]["table"]] in lost_tables and \
+                        v["info"].get("slice", {}).get("part", 2) == 2:
+                    lost_files.append(v["name"])
+                    os.remove(os.path.join(args.output_dir, v["name"]))
+                    continue
+                f.write(json.dumps(v) + "\n")
+            f.write('{"type": "file", "na')    # record of the crash moment
+        os.remove(os.path.join(args.output_dir, "metadata.json"))
+        self.assertEqual(len(lost_files), 2)
+
+        args = parser.parse_args(dump_args + ['--resume'])
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            resumed_metadata = json.loads(f.read())
+        self.assertEqual(resumed_metadata["total_rows"], metadata["total_rows"])
+        self.assertEqual(set(resumed_metadata["files"].keys()), set(metadata["files"].keys()))
+        # all files of the tables with a lost file are exported again
+        lost_tables_files = [v for v in metadata["files"].values() if [v["schema"], v["table"]] in lost_tables]
+        self.assertEqual(
+            resumed_metadata["resumed"]["reused_files"],
+            len(metadata["files"]) - len(lost_tables_files)
+        )
+        for file_name in metadata["files"]:
+            self.assertTrue(os.path.exists(os.path.join(args.output_dir, file_name)))
+
+    async def test_17_pipe(self):
+        if "init_env" not in passed_stages:
             self.assertTrue(False)
 
         parser = Context.get_arg_parser()
         args = parser.parse_args([
             '--db-host=%s' % params.test_db_host,
-            '--db-name=%s' % params.test_target_db + "_4",
+            '--db-name=%s' % params.test_source_db,
             '--db-user=%s' % params.test_db_user,
             '--db-port=%s' % params.test_db_port,
             '--db-user-password=%s' % params.test_db_user_password,
+            '--target-db-name=%s' % params.test_target_db + "_10",
+            '--mode=pipe',
+            '--dict-file=test.py',
             '--threads=%s' % params.test_threads,
-            '--mode=restore',
-            '--input-dir=%s' % self.target_dict.split('.')[0],
             '--drop-custom-check-constr',
             '--verbose=debug',
             '--debug'
         ])
-        self.args["restore"] = copy.deepcopy(args)
+
         res = await MainRoutine(args).run()
         self.assertTrue(res.result_code == ResultCode.DONE)
 
-        rows = [
-            [1, 'ccd778e5850ddf15d7e9a7ad11a8bbd8', 'invalid_val_1', '*', round(Decimal(0.1), 2),
-                '8cbd2171ab4a14fc243421cde93a71c2', 'f0b314b0620d1ad1a8af2f56cbdd22ac'],
-            [2, '555da16355e56e162c12c95403419eea', 'invalid_val_2', '*', round(Decimal(0.2), 2),
-                '8cbd2171ab4a14fc243421cde93a71c2', '5385212a24152afd7599bdb3577c7f47']
-        ]
-        self.assertTrue(await self.check_rows(args, "schm_mask_ext_exclude_2", "card_numbers", None, rows))
-
+        target_args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_target_db + "_10",
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ])
         objs = [
             ["schm_mask_ext_exclude_2", "card_numbers", rows_in_init_env * int(params.test_scale) * 3]   # see init_env.sql
         ]
-        self.assertTrue(await self.check_rows_count(args, objs))
-
-        not_found_in_target = await self.check_list_tables_and_fields(self.args["dump"], self.args["restore"])
-        self.assertTrue(len(not_found_in_target) == 3)
-        self.assertTrue(not_found_in_target == [
-             ['columnar_internal', 'tbl_200', 'id'],
-             ['columnar_internal', 'tbl_200', 'val'],
-             ['columnar_internal', 'tbl_200', 'val_skip']
-        ])
-
-        if res.result_code == ResultCode.DONE:
-            passed_stages.append("test_04_restore")
+        self.assertTrue(await self.check_rows_count(target_args, objs))
 
+        rows = [
+            [3, 'text const'],
+            [4, 'text const']
+        ]
+        self.assertTrue(await self.check_rows(target_args, "schm_mask_include_1", "tbl_123", None, rows))
 
-class PGAnonDictGenStressUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
-    target_dict = 'test_create_dict_result.py'
-    args = {}
-
-    async def test_01_stress_init(self):
-        res = await self.init_stress_env()
-        self.assertTrue(res.result_code == ResultCode.DONE)
-
-    async def test_02_create_dict(self):
-        if "init_stress_env" not in passed_stages:
+    async def test_18_plan(self):
+        if "init_env" not in passed_stages:
             self.assertTrue(False)
 
+        history_dir = tempfile.mkdtemp()
         parser = Context.get_arg_parser()
-        self.args_create_dict = parser.parse_args([
+        dump_args = [
             '--db-host=%s' % params.test_db_host,
-            '--db-name=%s' % params.test_source_db + "_stress",
+            '--db-name=%s' % params.test_source_db,
             '--db-user=%s' % params.test_db_user,
             '--db-port=%s' % params.test_db_port,
             '--db-user-password=%s' % params.test_db_user_password,
-            '--mode=create-dict',
-            '--scan-mode=partial',
-            '--dict-file=test_meta_dict.py',
-            '--output-dict-file=stress_%s' % self.target_dict,
-            # '--threads=%s' % params.test_threads,
-            '--threads=6',
-            '--scan-partial-rows=10000' #,
-            # '--verbose=debug',
+            '--mode=dump',
+            '--dict-file=test.py',
+            '--threads=%s' % params.test_threads,
+            '--output-dir=test_plan',
+            '--history-file=%s' % os.path.join(history_dir, "history.sqlite"),
+            '--verbose=debug',
+            '--debug'
+        ]
+
+        try:
+            # without history only the order of tasks is known
+            res = await MainRoutine(parser.parse_args(dump_args + ['--plan'])).run()
+            self.assertTrue(res.result_code == ResultCode.DONE)
+            self.assertIsNone(res.result_data["duration"])
+            self.assertFalse(os.path.exists(os.path.join(history_dir, "history.sqlite")))
+
+            args = parser.parse_args(dump_args + ['--clear-output-dir'])
+            res = await MainRoutine(args).run()
+            self.assertTrue(res.result_code == ResultCode.DONE)
+            with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+                metadata = json.loads(f.read())
+
+            res = await MainRoutine(parser.parse_args(dump_args + ['--plan'])).run()
+            self.assertTrue(res.result_code == ResultCode.DONE)
+            plan = res.result_data
+            self.assertTrue(plan["duration"] > 0)
+            self.assertEqual(set([v["file"] for v in plan["tasks"]]), set(metadata["files"].keys()))
+            self.assertTrue(all([v["history"] for v in plan["tasks"]]))
+            # the peak disk usage is predicted from the sizes of the previous data files
+            files_size = sum([
+                os.path.getsize(os.path.join(args.output_dir, v)) for v in metadata["files"]
+            ])
+            self.assertTrue(0 < plan["disk_usage"] < files_size * 2)
+        finally:
+            shutil.rmtree(history_dir)
+
+    async def test_19_verify(self):
+        if "test_11_client_side_dump" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        verify_args = [
+            '--threads=%s' % params.test_threads,
+            '--mode=verify',
+            '--verbose=debug',
+            '--debug'
+        ]
+        res = await MainRoutine(parser.parse_args(verify_args + ['--input-dir=test_client_side'])).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        self.assertEqual(res.result_data["damaged"], {})
+
+        # binary COPY format
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=dump',
+            '--dict-file=test.py',
+            '--threads=%s' % params.test_threads,
+            '--client-side-dump',
+            '--copy-options=with (format binary)',
+            '--output-dir=test_verify_binary',
+            '--clear-output-dir',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        res = await MainRoutine(parser.parse_args(verify_args + ['--input-dir=%s' % args.output_dir])).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        self.assertEqual(metadata["copy_format"], "binary")
+        self.assertEqual(res.result_data["total_rows"], metadata["total_rows"])
+
+        # a truncated file and a file with a changed byte
+        files = sorted(metadata["files"], key=lambda v: metadata["files"][v]["size"], reverse=True)
+        with open(os.path.join(args.output_dir, files[0]), "r+b") as f:
+            f.truncate(metadata["files"][files[0]]["size"] // 2)
+        with open(os.path.join(args.output_dir, files[1]), "r+b") as f:
+            f.seek(metadata["files"][files[1]]["size"] - 1)
+            last_byte = f.read(1)
+            f.seek(metadata["files"][files[1]]["size"] - 1)
+            f.write(bytes([last_byte[0] ^ 0xff]))
+        res = await MainRoutine(parser.parse_args(verify_args + ['--input-dir=%s' % args.output_dir])).run()
+        self.assertTrue(res.result_code == ResultCode.FAIL)
+        self.assertEqual(set(res.result_data["damaged"].keys()), set(files[:2]))
+
+        # checksums of the client-side dump are computed while the files are written
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output', 'test_client_side',
+                               'metadata.json'), "r") as f:
+            metadata = json.loads(f.read())
+        for file_name, v in metadata["files"].items():
+            self.assertEqual(v["checksum"], get_file_checksum(
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output', 'test_client_side', file_name)
+            ))
+
+        # files written by the server are not read back with --skip-checksum
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=dump',
+            '--dict-file=test.py',
+            '--threads=%s' % params.test_threads,
+            '--skip-checksum',
+            '--output-dir=test_verify_skip_checksum',
+            '--clear-output-dir',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        self.assertTrue(all([v["checksum"] is None and v["size"] > 0 for v in metadata["files"].values()]))
+        res = await MainRoutine(parser.parse_args(verify_args + ['--input-dir=%s' % args.output_dir])).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+    async def test_20_partitions(self):
+        parser = Context.get_arg_parser()
+        db_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ]
+        ctx = Context(parser.parse_args(db_args + ['--db-name=postgres']))
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await DBOperations.init_db(db_conn, params.test_source_db + "_part")
+        await DBOperations.init_db(db_conn, params.test_target_db + "_part")
+        await db_conn.close()
+
+        source_args = parser.parse_args(db_args + ['--db-name=%s' % params.test_source_db + "_part", '--mode=init'])
+        db_conn = await asyncpg.connect(**Context(source_args).conn_params)
+        await DBOperations.init_env(db_conn, 'init_partitions_env.sql')
+        await db_conn.close()
+        res = await MainRoutine(source_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_source_db + "_part",
+            '--mode=dump',
+            '--dict-file=test_partitions.py',
+            '--threads=%s' % params.test_threads,
+            '--output-dir=test_partitions',
+            '--clear-output-dir',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        # partitions are dumped separately, the partitioned table only by its raw_sql
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        files = {v["table"]: v for v in metadata["files"].values()}
+        self.assertEqual(set(files.keys()), set(["events_2023", "events_2024_0", "events_2024_1", "messages"]))
+        self.assertEqual(files["events_2024_1"]["partition_root"], ["schm_part", "events"])
+        self.assertNotIn("partition_root", files["messages"])
+        self.assertEqual(sum([int(files[v]["rows"]) for v in files if v.startswith("events")]), rows_in_init_env)
+        self.assertIn("schm_part.events_id_seq", metadata["seq_lastvals"])
+
+        target_args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_target_db + "_part",
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_partitions',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(target_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        # rows are restored into the same partitions
+        db_conn = await asyncpg.connect(**Context(source_args).conn_params)
+        objs = [["schm_part", v, await db_conn.fetchval("select count(1) from schm_part.%s" % v)] for v in [
+            "events", "events_2023", "events_2024_0", "events_2024_1", "messages", "messages_info", "messages_error"
+        ]]
+        await db_conn.close()
+        self.assertEqual(objs[0][2], rows_in_init_env)
+        self.assertTrue(await self.check_rows_count(target_args, objs))
+
+        db_conn = await asyncpg.connect(**Context(target_args).conn_params)
+        not_masked = await db_conn.fetchval(
+            "select count(1) from schm_part.events where email like 'user%@example.com'"
+        )
+        not_replaced = await db_conn.fetchval("select count(1) from schm_part.messages where msg <> 'text const'")
+        await db_conn.close()
+        self.assertEqual(not_masked, 0)
+        self.assertEqual(not_replaced, 0)
+        passed_stages.append("test_20_partitions")
+
+    async def test_21_subset(self):
+        parser = Context.get_arg_parser()
+        db_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ]
+        ctx = Context(parser.parse_args(db_args + ['--db-name=postgres']))
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await DBOperations.init_db(db_conn, params.test_source_db + "_subset")
+        await DBOperations.init_db(db_conn, params.test_target_db + "_subset")
+        await db_conn.close()
+
+        source_args = parser.parse_args(db_args + ['--db-name=%s' % params.test_source_db + "_subset", '--mode=init'])
+        db_conn = await asyncpg.connect(**Context(source_args).conn_params)
+        await DBOperations.init_env(db_conn, 'init_subset_env.sql')
+        await db_conn.close()
+        res = await MainRoutine(source_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_source_db + "_subset",
+            '--mode=dump',
+            '--dict-file=test_subset.py',
+            '--threads=%s' % params.test_threads,
+            '--output-dir=test_subset',
+            '--clear-output-dir',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        files = {v["table"]: v for v in metadata["files"].values()}
+        self.assertTrue(files["payments_2024"]["subset"])
+        self.assertNotIn("subset", files["settings"])
+        self.assertEqual(len(metadata["subset"]["tables"]), 5)
+
+        # root customers, customers referred by them, rows referencing them and rows referenced by all of these
+        db_conn = await asyncpg.connect(**Context(source_args).conn_params)
+        objs = [["schm_subset", v[0], await db_conn.fetchval(v[1])] for v in [
+            ["customers", """
+                select count(1) from schm_subset.customers
+                where id % 100 = 0 or id in (select referrer_id from schm_subset.customers where id % 100 = 0)
+            """],
+            ["orders", "select count(1) from schm_subset.orders where customer_id % 100 = 0"],
+            ["payments", """
+                select count(1) from schm_subset.payments p
+                join schm_subset.orders o on o.id = p.order_id
+                where o.customer_id % 100 = 0
+            """],
+            ["products", "select count(distinct product_id) from schm_subset.orders where customer_id % 100 = 0"],
+            ["suppliers", """
+                select count(distinct p.supplier_id) from schm_subset.orders o
+                join schm_subset.products p on p.id = o.product_id
+                where o.customer_id % 100 = 0
+            """],
+            ["settings", "select count(1) from schm_subset.settings"]
+        ]]
+        await db_conn.close()
+        self.assertEqual(objs[0][2], 20)
+        self.assertEqual(objs[1][2], 30)
+        self.assertEqual(metadata["total_rows"], sum([v[2] for v in objs]))
+
+        # foreign keys are created by post-data section of the restore, so the subset is closed
+        target_args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_target_db + "_subset",
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_subset',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(target_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        self.assertTrue(await self.check_rows_count(target_args, objs))
+
+        db_conn = await asyncpg.connect(**Context(target_args).conn_params)
+        not_masked = await db_conn.fetchval(
+            "select count(1) from schm_subset.customers where email like 'customer%@example.com'"
+        )
+        await db_conn.close()
+        self.assertEqual(not_masked, 0)
+        passed_stages.append("test_21_subset")
+
+    async def test_22_sample(self):
+        if "test_21_subset" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db + "_subset",
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=dump',
+            '--dict-file=test_sample.py',
+            '--threads=%s' % params.test_threads,
+            '--output-dir=test_sample',
+            '--clear-output-dir',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        # budgets of tables and the global budget of the other tables are reported with achieved rows
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        samples = metadata["samples"]
+        self.assertEqual(set(samples.keys()), set(["schm_subset.customers", "schm_subset.payments", "*"]))
+        self.assertEqual(samples["schm_subset.customers"]["requested"], {"rows": 100})
+        self.assertTrue(50 <= samples["schm_subset.customers"]["rows"] <= 150)
+        self.assertEqual(samples["schm_subset.payments"]["tables"], 2)
+        self.assertTrue(0 < samples["schm_subset.payments"]["rows"] < 3000)
+        self.assertEqual(samples["*"]["tables"], 4)
+        self.assertTrue(0 < samples["*"]["rows"] < 3130)
+        self.assertEqual(metadata["total_rows"], sum([v["rows"] for v in samples.values()]))
+        passed_stages.append("test_22_sample")
+
+    async def test_23_fast_load(self):
+        if "test_20_partitions" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        db_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ]
+        ctx = Context(parser.parse_args(db_args + ['--db-name=postgres']))
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await DBOperations.init_db(db_conn, params.test_target_db + "_fast")
+        await db_conn.close()
+
+        target_args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_target_db + "_fast",
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_partitions',
+            '--fast-load',
+            '--fast-load-unlogged',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(target_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        source_args = parser.parse_args(db_args + ['--db-name=%s' % params.test_source_db + "_part"])
+        db_conn = await asyncpg.connect(**Context(source_args).conn_params)
+        objs = [["schm_part", v, await db_conn.fetchval("select count(1) from schm_part.%s" % v)] for v in [
+            "events_2023", "events_2024_0", "events_2024_1", "messages"
+        ]]
+        await db_conn.close()
+        self.assertTrue(await self.check_rows_count(target_args, objs))
+
+        # tables are switched back to LOGGED before post-data
+        db_conn = await asyncpg.connect(**Context(target_args).conn_params)
+        unlogged = await db_conn.fetchval("""
+            select count(1) from pg_class c join pg_namespace n on n.oid = c.relnamespace
+            where n.nspname = 'schm_part' and c.relpersistence <> 'p'
+        """)
+        await db_conn.close()
+        self.assertEqual(unlogged, 0)
+
+        # a failed switch is raised even if there are fewer queries than threads
+        ctx = Context(target_args)
+        ctx.logger = logging.getLogger("test_23_fast_load")
+        with self.assertRaises(Exception):
+            await set_tables_logged(ctx, [("schm_part", "no_such_table")], True)
+
+        # the settings are made on every acquire from the pool, not only on the first connection
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await db_conn.execute("""
+            CREATE TABLE IF NOT EXISTS public.fast_load_check (v int);
+            CREATE OR REPLACE FUNCTION public.fast_load_check_trg() RETURNS trigger AS $$
+            BEGIN RAISE EXCEPTION 'trigger fired'; END $$ LANGUAGE plpgsql;
+            CREATE OR REPLACE TRIGGER fast_load_check_trg BEFORE INSERT ON public.fast_load_check
+            FOR EACH ROW EXECUTE FUNCTION public.fast_load_check_trg();
+        """)
+        await db_conn.close()
+        ctx.args.threads = 1
+        pool = await create_restore_pool(ctx, True)
+        try:
+            for _ in range(3):
+                async with pool.acquire() as conn:
+                    self.assertEqual(await conn.fetchval("SHOW synchronous_commit"), "off")
+                    self.assertEqual(await conn.fetchval("SHOW session_replication_role"), "replica")
+                    await conn.execute("BEGIN; INSERT INTO public.fast_load_check VALUES (1); COMMIT;")
+        finally:
+            await pool.close()
+
+        # without --fast-load-unlogged the rows stay frozen: COPY FREEZE sets the pages all-visible, which
+        # ANALYZE after the load counts in relallvisible ("SET LOGGED" rewrites the table without it)
+        ctx = Context(parser.parse_args(db_args + ['--db-name=postgres']))
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await DBOperations.init_db(db_conn, params.test_target_db + "_fast_frozen")
+        await db_conn.close()
+        target_args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_target_db + "_fast_frozen",
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_partitions',
+            '--fast-load',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(target_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        self.assertTrue(await self.check_rows_count(target_args, objs))
+        db_conn = await asyncpg.connect(**Context(target_args).conn_params)
+        frozen = await db_conn.fetch("""
+            select c.relname, c.relallvisible from pg_class c join pg_namespace n on n.oid = c.relnamespace
+            where n.nspname = 'schm_part' and c.relname in ('events_2023', 'events_2024_0', 'events_2024_1')
+        """)
+        await db_conn.close()
+        self.assertEqual(len(frozen), 3)
+        for v in frozen:
+            self.assertTrue(v[1] > 0, v[0])
+
+    async def test_24_pipeline_post_data(self):
+        if "test_21_subset" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        db_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ]
+        ctx = Context(parser.parse_args(db_args + ['--db-name=postgres']))
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await DBOperations.init_db(db_conn, params.test_target_db + "_pipeline")
+        await db_conn.close()
+
+        target_args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_target_db + "_pipeline",
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_subset',
+            '--pipeline-post-data',
+            '--fast-load',
+            '--fast-load-unlogged',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(target_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        # indexes and constraints built during the load and by the final pass are the same as in the source
+        query = """
+            select
+                (select count(1) from pg_index i join pg_class c on c.oid = i.indrelid
+                 join pg_namespace n on n.oid = c.relnamespace where n.nspname = 'schm_subset' and i.indisvalid),
+                (select count(1) from pg_constraint c join pg_namespace n on n.oid = c.connamespace
+                 where n.nspname = 'schm_subset'),
+                (select count(1) from pg_class c join pg_namespace n on n.oid = c.relnamespace
+                 where n.nspname = 'schm_subset' and c.relpersistence <> 'p')
+        """
+        db_conn = await asyncpg.connect(**Context(target_args).conn_params)
+        target = await db_conn.fetchrow(query)
+        await db_conn.close()
+        db_conn = await asyncpg.connect(**ctx.conn_params | {"database": params.test_source_db + "_subset"})
+        source = await db_conn.fetchrow(query)
+        await db_conn.close()
+        self.assertEqual(list(target), list(source))
+        self.assertEqual(target[2], 0)
+
+        with open(os.path.join(ctx.current_dir, "output", "test_subset", "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        objs = [[v["schema"], v["table"], int(v["rows"])] for v in metadata["files"].values()]
+        self.assertTrue(await self.check_rows_count(target_args, objs))
+
+    async def test_25_quick_analyze(self):
+        if "test_21_subset" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        db_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ]
+        ctx = Context(parser.parse_args(db_args + ['--db-name=postgres']))
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await DBOperations.init_db(db_conn, params.test_target_db + "_analyze")
+        await db_conn.close()
+
+        target_args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_target_db + "_analyze",
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_subset',
+            '--quick-analyze',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(target_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        with open(os.path.join(ctx.current_dir, "output", "test_subset", "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        self.assertIn(["schm_subset", "customers", ["id", "referrer_id"]], metadata["analyze_columns"])
+
+        # the deferred full ANALYZE has collected statistics of all columns of the loaded tables
+        db_conn = await asyncpg.connect(**Context(target_args).conn_params)
+        columns = await db_conn.fetch("""
+            select c.relname, a.attname
+            from pg_class c
+            join pg_namespace n on n.oid = c.relnamespace
+            join pg_attribute a on a.attrelid = c.oid and a.attnum > 0 and not a.attisdropped
+            where n.nspname = 'schm_subset' and c.relkind = 'r'
+        """)
+        stats = await db_conn.fetch("""
+            select tablename, attname from pg_stats where schemaname = 'schm_subset' and not inherited
+        """)
+        empty = [v[0] for v in await db_conn.fetch("""
+            select c.relname from pg_class c join pg_namespace n on n.oid = c.relnamespace
+            where n.nspname = 'schm_subset' and c.relkind = 'r' and c.reltuples = 0
+        """)]
+        await db_conn.close()
+        self.assertEqual(
+            set([(v[0], v[1]) for v in columns if v[0] not in empty]),
+            set([(v[0], v[1]) for v in stats])
+        )
+
+        # ANALYZE after each table runs on a pooled connection, which is not reconnected
+        ctx = Context(target_args)
+        ctx.logger = logging.getLogger("test_25_quick_analyze")
+        ctx.args.threads = 1
+        pool = await create_restore_pool(ctx, False)
+        try:
+            async with pool.acquire() as conn:
+                pid = await conn.fetchval("select pg_backend_pid()")
+            for v in ["customers", "payments"]:
+                await run_custom_query(ctx, pool, get_analyze_query(("schm_subset", v)))
+            async with pool.acquire() as conn:
+                self.assertEqual(await conn.fetchval("select pg_backend_pid()"), pid)
+        finally:
+            await pool.close()
+
+
+    async def test_26_seq_init(self):
+        if "test_21_subset" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        db_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ]
+        ctx = Context(parser.parse_args(db_args + ['--db-name=postgres']))
+        with open(os.path.join(ctx.current_dir, "output", "test_subset", "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        self.assertEqual(metadata["seq_lastvals"]["schm_subset.settings_id_seq"]["value"], 10)
+
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await DBOperations.init_db(db_conn, params.test_target_db + "_seq")
+        await db_conn.close()
+
+        target_args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_target_db + "_seq",
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_subset',
+            '--seq-init-by-max-value',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(target_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        # the identity sequence is set after the recorded value by test_21_subset and after max(id) here
+        query = "select last_value from schm_subset.settings_id_seq"
+        for db_name in [params.test_target_db + "_subset", params.test_target_db + "_seq"]:
+            db_conn = await asyncpg.connect(**ctx.conn_params | {"database": db_name})
+            self.assertEqual(await db_conn.fetchval(query), 11)
+            await db_conn.close()
+
+
+    async def test_27_resume_restore(self):
+        if "test_21_subset" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        db_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ]
+        ctx = Context(parser.parse_args(db_args + ['--db-name=postgres']))
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await DBOperations.init_db(db_conn, params.test_target_db + "_resume")
+        await db_conn.close()
+
+        # the data file of "settings" is missing in the first run
+        input_dir = os.path.join(ctx.current_dir, "output", "test_subset")
+        with open(os.path.join(input_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        settings_file = [k for k, v in metadata["files"].items() if v["table"] == "settings"][0]
+        os.rename(os.path.join(input_dir, settings_file), os.path.join(input_dir, settings_file + ".tmp"))
+
+        target_args = db_args + [
+            '--db-name=%s' % params.test_target_db + "_resume",
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_subset',
+            '--verbose=debug',
+            '--debug'
+        ]
+        res = await MainRoutine(parser.parse_args(target_args)).run()
+        self.assertTrue(res.result_code == ResultCode.FAIL)
+
+        ledger_file = os.path.join(input_dir, "restore_%s.ledger" % (params.test_target_db + "_resume"))
+        ledger = Ledger(ledger_file).load()
+        self.assertEqual(ledger.files[settings_file]["state"], "failed")
+        self.assertTrue(all([v["state"] == "done" for k, v in ledger.files.items() if k != settings_file]))
+        self.assertEqual(list(ledger.sections.keys()), ["pre-data"])
+
+        # only the failed table is loaded again, it fails again and post-data is still not restored
+        res = await MainRoutine(parser.parse_args(target_args + ['--resume'])).run()
+        self.assertTrue(res.result_code == ResultCode.FAIL)
+        with open(ledger_file, "r") as f:
+            records = [json.loads(v) for v in f.readlines()]
+        second_run = [i for i, v in enumerate(records) if v["type"] == "run"][1]
+        self.assertEqual(
+            [v["name"] for v in records[second_run:] if v["type"] == "file" and v["state"] == "pending"],
+            [settings_file]
+        )
+
+        # the ledger of a run interrupted in pre-data: existing objects are skipped, all tables are loaded again,
+        # then post-data and sequences are restored
+        os.rename(os.path.join(input_dir, settings_file + ".tmp"), os.path.join(input_dir, settings_file))
+        with open(ledger_file, "w") as f:
+            f.write(json.dumps(records[0]) + "\n")
+        res = await MainRoutine(parser.parse_args(target_args + ['--resume'])).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        ledger = Ledger(ledger_file).load()
+        self.assertEqual(list(ledger.sections.keys()), ["pre-data", "post-data"])
+        self.assertTrue(all([v["state"] == "done" for v in ledger.files.values()]))
+
+        query = """
+            select
+                (select count(1) from pg_index i join pg_class c on c.oid = i.indrelid
+                 join pg_namespace n on n.oid = c.relnamespace where n.nspname = 'schm_subset'),
+                (select count(1) from pg_constraint c join pg_namespace n on n.oid = c.connamespace
+                 where n.nspname = 'schm_subset')
+        """
+        db_conn = await asyncpg.connect(**ctx.conn_params | {"database": params.test_target_db + "_resume"})
+        target = await db_conn.fetchrow(query)
+        await db_conn.close()
+        db_conn = await asyncpg.connect(**ctx.conn_params | {"database": params.test_source_db + "_subset"})
+        source = await db_conn.fetchrow(query)
+        await db_conn.close()
+        self.assertEqual(list(target), list(source))
+
+        objs = [[v["schema"], v["table"], int(v["rows"])] for v in metadata["files"].values()]
+        self.assertTrue(await self.check_rows_count(parser.parse_args(target_args), objs))
+
+    async def test_28_schedule(self):
+        if "init_env" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        db_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ]
+
+        # the most expensive tasks go first, each next one to the least loaded worker
+        ctx = Context(parser.parse_args(db_args + ['--db-name=postgres', '--threads=2', '--debug']))
+        ctx.logger = logging.getLogger("test_28_schedule")
+        costs = {"a": 5, "b": 3, "c": 4, "d": 3, "e": 3}
+        with self.assertLogs(ctx.logger, level="DEBUG") as logs:
+            ordered, makespan = lpt_schedule(costs.keys(), lambda v: costs[v], ctx.args.threads)
+            log_schedule(ctx, "Test", ordered, lambda v: costs[v], makespan, lambda v: v, str)
+        self.assertEqual(ordered, ["a", "c", "b", "d", "e"])
+        self.assertEqual(makespan, 10)
+        self.assertEqual([v.getMessage() for v in logs.records], [
+            "Test schedule: 5 task(s), total cost 18, predicted makespan 10 on 2 worker(s)",
+            "Test order:\n5: a\n4: c\n3: b\n3: d\n3: e"
+        ])
+
+        # the dump logs its own schedule: one line per file, by size without history
+        args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_source_db,
+            '--mode=dump',
+            '--dict-file=test.py',
+            '--output-dir=test_schedule',
+            '--threads=%s' % params.test_threads,
+            '--clear-output-dir',
+            '--disable-history',
+            '--verbose=debug',
+            '--debug'
+        ])
+        with self.assertLogs("pg_anon.py", level="DEBUG") as logs:
+            res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+
+        units = {"bytes": 1, "byte": 1, "KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+        summary = [v.getMessage() for v in logs.records if v.getMessage().startswith("Dump schedule:")]
+        self.assertEqual(len(summary), 1)
+        found = re.match(
+            r"Dump schedule: (\d+) task\(s\), total cost (\d+) (\w+), predicted makespan (\d+) (\w+) on (\d+) worker",
+            summary[0]
+        )
+        self.assertEqual(int(found.group(1)), len(metadata["files"]))
+        self.assertEqual(int(found.group(6)), int(params.test_threads))
+        total = int(found.group(2)) * units[found.group(3)]
+        makespan = int(found.group(4)) * units[found.group(5)]
+        # sizes are logged rounded down to the unit
+        makespan_max = (int(found.group(4)) + 1) * units[found.group(5)]
+
+        order = [v.getMessage() for v in logs.records if v.getMessage().startswith("Dump order:")]
+        self.assertEqual(len(order), 1)
+        lines = order[0].split("\n")[1:]
+        self.assertEqual(sorted([v.split(": ")[1] for v in lines]), sorted(metadata["files"].keys()))
+        order_costs = [int(v.split(" ")[0]) * units[v.split(": ")[0].split(" ")[1]] for v in lines]
+        self.assertEqual(order_costs, sorted(order_costs, reverse=True))
+        self.assertTrue(makespan >= order_costs[0])
+        self.assertTrue(makespan_max * int(params.test_threads) >= total)
+
+    async def test_29_snapshot_workers(self):
+        if "init_env" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        ctx = Context(parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--threads=%s' % params.test_threads
+        ]))
+        ctx.logger = logging.getLogger("test_29_snapshot_workers")
+
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        await db_conn.execute("""
+            CREATE TABLE public.snapshot_workers_check (id int);
+            INSERT INTO public.snapshot_workers_check VALUES (1);
+        """)
+        tr = db_conn.transaction(isolation='repeatable_read')
+        await tr.start()
+        sn_id = await db_conn.fetchval("select pg_export_snapshot()")
+        # the row inserted after the export is not visible to the workers
+        other_conn = await asyncpg.connect(**ctx.conn_params)
+        await other_conn.execute("INSERT INTO public.snapshot_workers_check VALUES (2)")
+        await other_conn.close()
+
+        done = []
+
+        async def handler(conn, task):
+            await asyncio.sleep(0.05)
+            done.append((task, conn.get_server_pid(), await conn.fetchval(
+                "select count(1) from public.snapshot_workers_check"
+            )))
+
+        try:
+            with self.assertLogs(ctx.logger, level="INFO") as logs:
+                await run_snapshot_workers(ctx, sn_id, range(20), handler)
+        finally:
+            await tr.rollback()
+            await db_conn.execute("DROP TABLE public.snapshot_workers_check")
+            await db_conn.close()
+
+        # every task runs once, on one of "threads" connections which are reused
+        self.assertEqual(sorted([v[0] for v in done]), list(range(20)))
+        self.assertEqual(len(set([v[1] for v in done])), int(params.test_threads))
+        self.assertTrue(all([v[2] == 1 for v in done]))
+
+        messages = [v.getMessage() for v in logs.records]
+        stats = [re.match(r"Worker (\d+): (\d+) task\(s\), busy ([\d.]+)s, idle ([\d.]+)s", v) for v in messages]
+        stats = [v for v in stats if v is not None]
+        self.assertEqual([int(v.group(1)) for v in stats], list(range(1, int(params.test_threads) + 1)))
+        self.assertEqual(sum([int(v.group(2)) for v in stats]), 20)
+        self.assertTrue(all([float(v.group(3)) >= 0.05 * int(v.group(2)) for v in stats]))
+        self.assertEqual(len([v for v in messages if v.startswith("Workers utilization: ")]), 1)
+
+    async def test_30_snapshot_sections(self):
+        if "init_env" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        db_args = [
+            '--db-host=%s' % params.test_db_host,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password
+        ]
+
+        # pre-data and post-data are dumped by pg_dump --snapshot concurrently with the data
+        dump_args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_source_db,
+            '--mode=dump',
+            '--dict-file=test.py',
+            '--output-dir=test_sections',
+            '--threads=%s' % params.test_threads,
+            '--clear-output-dir',
+            '--verbose=debug',
+            '--debug'
+        ])
+        with self.assertLogs("pg_anon.py", level="DEBUG") as logs:
+            res = await MainRoutine(dump_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        commands = [v.getMessage() for v in logs.records if v.getMessage().startswith("[")]
+        commands = [v for v in commands if "'--section'" in v]
+        self.assertEqual(len(commands), 2)
+        self.assertTrue(all(["'--snapshot'" in v for v in commands]))
+
+        # the same sections dumped one after another without a snapshot have the same table of contents
+        ctx = Context(parser.parse_args(db_args + ['--db-name=%s' % params.test_source_db, '--mode=dump']))
+        ctx.logger = logging.getLogger("test_30_snapshot_sections")
+        sequential_dir = tempfile.mkdtemp()
+        try:
+            ctx.args.output_dir = sequential_dir
+            for section in ['pre-data', 'post-data']:
+                await run_pg_dump(ctx, section)
+            for section in ['pre_data', 'post_data']:
+                toc = []
+                for path in [dump_args.output_dir, sequential_dir]:
+                    returncode, out, err = await run_pg_util(
+                        ctx, [ctx.args.pg_restore, "-l", os.path.join(path, section + ".backup")], "pg_restore -l"
+                    )
+                    self.assertEqual(returncode, 0)
+                    toc.append([v for v in out if not v.startswith(";")])
+                self.assertTrue(len(toc[0]) > 0)
+                self.assertEqual(toc[0], toc[1])
+        finally:
+            shutil.rmtree(sequential_dir)
+
+        # the dump is restorable
+        db_conn = await asyncpg.connect(**ctx.conn_params | {"database": "postgres"})
+        await DBOperations.init_db(db_conn, params.test_target_db + "_sections")
+        await db_conn.close()
+        restore_args = parser.parse_args(db_args + [
+            '--db-name=%s' % params.test_target_db + "_sections",
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=test_sections',
+            '--drop-custom-check-constr',
+            '--verbose=debug',
+            '--debug'
+        ])
+        res = await MainRoutine(restore_args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+        with open(os.path.join(dump_args.output_dir, "metadata.json"), "r") as f:
+            metadata = json.loads(f.read())
+        objs = [[v["schema"], v["table"], int(v["rows"])] for v in metadata["files"].values()]
+        self.assertTrue(await self.check_rows_count(restore_args, objs))
+
+
+class PGAnonValidateUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
+    async def test_01_validate(self):
+        if "test_06_sync_struct" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=dump',
+            '--dict-file=test.py',
+            '--threads=%s' % params.test_threads,
+            '--clear-output-dir',
+            '--verbose=debug',
+            '--debug',
+            '--validate-dict',
+            '--output-dir=test_01_validate'
+        ])
+
+        res = await MainRoutine(args).run()
+        if res.result_code == ResultCode.DONE:
+            passed_stages.append("test_01_validate")
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        # queries are only planned, each of them has an estimated cost
+        with open(os.path.join(args.output_dir, "validate.json"), "r") as f:
+            report = json.loads(f.read())
+        self.assertTrue(len(report) > 0)
+        self.assertTrue(all(["error" not in v and v["cost"] > 0 for v in report.values()]))
+
+    async def test_02_validate_full(self):
+        if "test_01_validate" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=dump',
+            '--dict-file=test.py',
+            '--threads=%s' % params.test_threads,
+            '--clear-output-dir',
+            '--verbose=debug',
+            '--debug',
+            '--validate-full',
+            '--output-dir=test_02_validate_full'
+        ])
+
+        res = await MainRoutine(args).run()
+        if res.result_code == ResultCode.DONE:
+            passed_stages.append("test_02_validate_full")
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+
+    async def test_03_validate_errors(self):
+        if "init_env" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=dump',
+            '--dict-file=test_validate.py',
+            '--threads=%s' % params.test_threads,
+            '--verbose=debug',
+            '--debug',
+            '--validate-dict',
+            '--output-dir=test_03_validate_errors'
+        ])
+
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.FAIL)
+
+        with open(os.path.join(args.output_dir, "validate.json"), "r") as f:
+            report = {(v["schema"], v["table"]): v for v in json.loads(f.read()).values()}
+        self.assertEqual(len(report), 3)
+        # all errors are reported, not only the first one
+        self.assertTrue("no_such_func" in report[("schm_other_1", "some_tbl")]["error"])
+        self.assertTrue("error" not in report[("schm_other_2", "some_tbl")])
+        self.assertTrue(any([
+            "Seq Scan" in v for v in report[("schm_mask_ext_exclude_2", "card_numbers")]["warnings"]
+        ]))
+
+    async def test_04_profile_dict(self):
+        if "init_env" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=profile-dict',
+            '--dict-file=test.py',
+            '--threads=%s' % params.test_threads,
+            '--profile-rows=200',
+            '--verbose=debug',
+            '--debug'
+        ])
+
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        with open(os.path.join(args.output_dir, "profile.json"), "r") as f:
+            report = json.loads(f.read())
+        self.assertEqual(report, res.result_data)
+        fields = {(v["schema"], v["table"], v["field"]): v for v in report}
+        noise = fields[("schm_other_2", "tbl_test_anon_functions", "fld_1_int")]
+        self.assertTrue("error" not in noise)
+        self.assertEqual(noise["functions"][0], "anon_funcs.noise")
+        self.assertEqual(noise["entry"], "schm_other_2.tbl_test_anon_functions")
+        self.assertTrue(0 < noise["sample_rows"] <= 200)
+        # 15120 rows in 402 pages: the sample is taken from about 10 pages all over the table
+        self.assertTrue(0 < noise["sample_percent"] < 10)
+        # ranked by projected cost
+        projected = [v["projected_sec"] for v in report if "error" not in v]
+        self.assertEqual(projected, sorted(projected, reverse=True))
+
+class PGAnonDictGenUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
+    target_dict = 'test_meta_dict_result.py'
+    args = {}
+
+    async def test_01_init(self):
+        res = await self.init_env()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+    async def test_02_create_dict(self):
+        if "init_env" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        self.args_create_dict = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=create-dict',
+            '--scan-mode=full',
+            '--dict-file=test_meta_dict.py',
+            '--output-dict-file=%s' % self.target_dict,
+            '--threads=%s' % params.test_threads,
+            # '--threads=8',
+            '--scan-partial-rows=10000',
+            '--verbose=debug',
+            '--debug'
+        ])
+
+        res = await MainRoutine(self.args_create_dict).run()
+        parent_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        with open(os.path.join(parent_dir, 'dict', 'test_meta_dict_result.py'), 'r', encoding='utf-8') as file1, \
+                open(os.path.join(parent_dir, 'dict', 'test_meta_dict_result_expected.py'), 'r',
+                     encoding='utf-8') as file2:
+            d1 = json.load(file1)['dictionary']
+            d2 = json.load(file2)['dictionary']
+
+            def iterate_dict_level_2(data):
+                for k, v in data.items():
+                    yield {k: v}
+
+            def iterate_dict_level_1(data):
+                for item in data:
+                    if 'fields' in item:
+                        yield from iterate_dict_level_2(item['fields'])
+                    else:
+                        yield from iterate_dict_level_2(item)
+
+            flag_of_identity = True  # comparing elements of two dictionaries
+            expected_result_list_of_iterate_dict = []
+            result_list_of_iterate_dict = []
+
+            print("============> Started comparison of test_meta_dict_result.py and test_meta_dict_result_expected.py")
+
+            for line in iterate_dict_level_1(d2):
+                expected_result_list_of_iterate_dict.append(line)
+
+            for line in iterate_dict_level_1(d1):
+                result_list_of_iterate_dict.append(line)
+                if line not in expected_result_list_of_iterate_dict:
+                    flag_of_identity = False
+                    print("check_comparison: row %s not found in test_meta_dict_result.py" % str(line))
+
+            if flag_of_identity:
+                for line in iterate_dict_level_1(d2):
+                    if line not in result_list_of_iterate_dict:
+                        flag_of_identity = False
+                        print("check_comparison: row %s not found in test_meta_dict_result_expected.py" % str(line))
+
+            print("<============ Finished comparison of test_meta_dict_result.py and test_meta_dict_result_expected.py")
+
+        self.assertTrue(flag_of_identity)
+
+        if res.result_code == ResultCode.DONE:
+            passed_stages.append("test_02_create_dict")
+
+    async def test_03_dump(self):
+        if "test_02_create_dict" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        args = copy.deepcopy(parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=dump',
+            '--dict-file=%s' % self.target_dict,
+            '--threads=%s' % params.test_threads,
+            '--clear-output-dir',
+            '--verbose=debug',
+            '--debug'
+        ]))
+        self.args["dump"] = copy.deepcopy(args)
+        res = await MainRoutine(args).run()
+        if res.result_code == ResultCode.DONE:
+            passed_stages.append("test_03_dump")
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+    async def test_04_restore(self):
+        if "test_03_dump" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_target_db + "_4",
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--threads=%s' % params.test_threads,
+            '--mode=restore',
+            '--input-dir=%s' % self.target_dict.split('.')[0],
+            '--drop-custom-check-constr',
+            '--verbose=debug',
+            '--debug'
+        ])
+        self.args["restore"] = copy.deepcopy(args)
+        res = await MainRoutine(args).run()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+        rows = [
+            [1, 'ccd778e5850ddf15d7e9a7ad11a8bbd8', 'invalid_val_1', '*', round(Decimal(0.1), 2),
+                '8cbd2171ab4a14fc243421cde93a71c2', 'f0b314b0620d1ad1a8af2f56cbdd22ac'],
+            [2, '555da16355e56e162c12c95403419eea', 'invalid_val_2', '*', round(Decimal(0.2), 2),
+                '8cbd2171ab4a14fc243421cde93a71c2', '5385212a24152afd7599bdb3577c7f47']
+        ]
+        self.assertTrue(await self.check_rows(args, "schm_mask_ext_exclude_2", "card_numbers", None, rows))
+
+        objs = [
+            ["schm_mask_ext_exclude_2", "card_numbers", rows_in_init_env * int(params.test_scale) * 3]   # see init_env.sql
+        ]
+        self.assertTrue(await self.check_rows_count(args, objs))
+
+        not_found_in_target = await self.check_list_tables_and_fields(self.args["dump"], self.args["restore"])
+        self.assertTrue(len(not_found_in_target) == 3)
+        self.assertTrue(not_found_in_target == [
+             ['columnar_internal', 'tbl_200', 'id'],
+             ['columnar_internal', 'tbl_200', 'val'],
+             ['columnar_internal', 'tbl_200', 'val_skip']
+        ])
+
+        if res.result_code == ResultCode.DONE:
+            passed_stages.append("test_04_restore")
+
+
+class PGAnonDictGenStressUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
+    target_dict = 'test_create_dict_result.py'
+    args = {}
+
+    async def test_01_stress_init(self):
+        res = await self.init_stress_env()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+    async def test_02_create_dict(self):
+        if "init_stress_env" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        self.args_create_dict = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db + "_stress",
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=create-dict',
+            '--scan-mode=partial',
+            '--dict-file=test_meta_dict.py',
+            '--output-dict-file=stress_%s' % self.target_dict,
+            # '--threads=%s' % params.test_threads,
+            '--threads=6',
+            '--scan-partial-rows=10000' #,
+            # '--verbose=debug',
             # '--debug'
         ])
 
@@ -943,6 +2421,171 @@ class PGAnonDictGenStressUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTes
             passed_stages.append("test_02_create_dict")
 
 
+class PGAnonCompressBenchmarkUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
+    # Compares dump time and compression ratio of codecs on the stress dataset
+
+    async def test_01_stress_init(self):
+        res = await self.init_stress_env()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+    async def test_02_benchmark(self):
+        if "init_stress_env" not in passed_stages:
+            self.assertTrue(False)
+
+        parser = Context.get_arg_parser()
+        results = []
+        for codec in list(CompressCodec):
+            if shutil.which(str(codec)) is None:
+                print("Codec %s is skipped: binary not found" % codec)
+                continue
+            args = parser.parse_args([
+                '--db-host=%s' % params.test_db_host,
+                '--db-name=%s' % params.test_source_db + "_stress",
+                '--db-user=%s' % params.test_db_user,
+                '--db-port=%s' % params.test_db_port,
+                '--db-user-password=%s' % params.test_db_user_password,
+                '--mode=dump',
+                '--dict-file=test_stress.py',
+                '--threads=%s' % params.test_threads,
+                '--compress=%s' % codec,
+                '--output-dir=stress_bench_%s' % codec,
+                '--clear-output-dir'
+            ])
+            start_t = time.time()
+            res = await MainRoutine(args).run()
+            elapsed = time.time() - start_t
+            self.assertTrue(res.result_code == ResultCode.DONE)
+
+            with open(os.path.join(args.output_dir, "metadata.json"), "r") as f:
+                metadata = json.loads(f.read())
+            files_size = sum([
+                os.path.getsize(os.path.join(args.output_dir, file_name)) for file_name in metadata["files"]
+            ])
+            results.append([
+                str(codec),
+                round(elapsed, 2),
+                round(metadata["total_tables_size"] / 1024 / 1024 / elapsed, 2),
+                round(metadata["total_tables_size"] / files_size, 2)
+            ])
+
+        print("codec | seconds | MB/s | ratio")
+        for v in results:
+            print(" | ".join([str(x) for x in v]))
+
+
+class PGAnonDictIndexUnitTest(unittest.TestCase):
+    # DictionaryIndex must return the same entries as find_obj_in_dict
+
+    schemas = ["public", "schm_1", "schm_mask_incl_1", "schm_mask_incl_22", "aa", "_SCHM.$complex#имя;@&* a'"]
+    tables = ["tbl_1", "tbl_1_2", "some_tbl", "tbl_123", "aa", "T", "_TBL.$complex#имя;@&* a'2"]
+    masks = ["*", "^schm", "_1$", r"\d+", r"\w+\_\d+\_\d+", "(a)\\1", "^(?:some|tbl)_", "T", "x", "(?i)^t"]
+
+    def assert_same_results(self, dictionary_obj):
+        index = DictionaryIndex(dictionary_obj)
+        for schema in self.schemas:
+            for table in self.tables:
+                self.assertIs(index.find(schema, table), find_obj_in_dict(dictionary_obj, schema, table))
+
+    def test_01_dictionaries(self):
+        for file_name in os.listdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dict')):
+            if not file_name.endswith('.py'):
+                continue
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dict', file_name), 'r') as f:
+                dictionary_obj = eval(f.read())
+            for key in ["dictionary", "dictionary_exclude"]:
+                if key in dictionary_obj:
+                    self.assert_same_results(dictionary_obj[key])
+
+    def test_02_random_dictionaries(self):
+        rnd = random.Random(42)
+        for _ in range(300):
+            dictionary_obj = []
+            for _ in range(rnd.randint(0, 12)):
+                v = {}
+                if rnd.random() < 0.6:
+                    v["schema"] = rnd.choice(self.schemas)
+                if rnd.random() < 0.5:
+                    v["schema_mask"] = rnd.choice(self.masks)
+                if rnd.random() < 0.6:
+                    v["table"] = rnd.choice(self.tables)
+                if rnd.random() < 0.5:
+                    v["table_mask"] = rnd.choice(self.masks)
+                dictionary_obj.append(v)
+            self.assert_same_results(dictionary_obj)
+
+
+class PGAnonFuncsBenchmarkUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
+    # Compares rows/s of anon_funcs with their previous definitions (test/anon_funcs_baseline.sql)
+
+    bench_rows = 1000000
+    expressions = [
+        ["noise", "noise(fld_int, 0.5)"],
+        ["dnoise", "dnoise(fld_ts, interval '1 month')"],
+        ["random_string", "random_string(10)"],
+        ["random_string(40)", "random_string(40)"],
+        ["random_zip", "random_zip()"],
+        ["random_inn", "random_inn()"],
+        ["random_in", "random_in(array['a', 'b', 'c'])"],
+        ["random_hash", "random_hash(fld_hex, 'md5')"],
+        ["hex_to_int", "hex_to_int(fld_hex)"]
+    ]
+
+    async def test_01_init(self):
+        res = await self.init_env()
+        self.assertTrue(res.result_code == ResultCode.DONE)
+
+    async def test_02_benchmark(self):
+        if "init_env" not in passed_stages:
+            self.assertTrue(False)
+
+        current_dir = os.path.dirname(os.path.realpath(__file__))
+        with open(os.path.join(current_dir, "anon_funcs_baseline.sql"), "r", encoding="utf-8") as f:
+            baseline_sql = f.read()
+
+        parser = Context.get_arg_parser()
+        args = parser.parse_args([
+            '--db-host=%s' % params.test_db_host,
+            '--db-name=%s' % params.test_source_db,
+            '--db-user=%s' % params.test_db_user,
+            '--db-port=%s' % params.test_db_port,
+            '--db-user-password=%s' % params.test_db_user_password,
+            '--mode=init'
+        ])
+        ctx = Context(args)
+        db_conn = await asyncpg.connect(**ctx.conn_params)
+        results = []
+        try:
+            await db_conn.execute(baseline_sql)
+            await db_conn.execute("""
+                CREATE TEMP TABLE anon_funcs_bench AS
+                SELECT
+                    (random() * 1000000)::integer AS fld_int,
+                    now() - id * interval '1 minute' AS fld_ts,
+                    to_hex(id) AS fld_hex
+                FROM generate_series(1, %s) id
+            """ % self.bench_rows)
+            await db_conn.execute("ANALYZE anon_funcs_bench")
+
+            for name, expression in self.expressions:
+                rows_per_sec = []
+                for schema in ["anon_funcs_baseline", "anon_funcs"]:
+                    start_t = time.time()
+                    cnt = await db_conn.fetchval(
+                        "SELECT count(%s.%s) FROM anon_funcs_bench" % (schema, expression)
+                    )
+                    elapsed = time.time() - start_t
+                    self.assertEqual(cnt, self.bench_rows)
+                    rows_per_sec.append(round(self.bench_rows / elapsed))
+                results.append([name] + rows_per_sec + [round(rows_per_sec[1] / rows_per_sec[0], 2)])
+        finally:
+            await db_conn.execute("DROP SCHEMA IF EXISTS anon_funcs_baseline CASCADE")
+            await db_conn.close()
+
+        print("function | old rows/s | new rows/s | speedup")
+        for v in results:
+            print(" | ".join([str(x) for x in v]))
+
+
 class PGAnonMaskUnitTest(unittest.IsolatedAsyncioTestCase, BasicUnitTest):
     args = {}
 
@@ -0,0 +1,43 @@
+-- Partitioned tables for test_20_partitions, the source database is test_source_db_part
+
+DROP SCHEMA IF EXISTS schm_part CASCADE;
+CREATE SCHEMA schm_part;
+
+-- two levels: range partitions by year, the second year is split by hash
+CREATE TABLE schm_part.events
+(
+    id serial,
+    created date NOT NULL,
+    email text,
+    CONSTRAINT events_pkey PRIMARY KEY (id, created)
+) PARTITION BY RANGE (created);
+
+CREATE TABLE schm_part.events_2023 PARTITION OF schm_part.events
+    FOR VALUES FROM ('2023-01-01') TO ('2024-01-01');
+
+CREATE TABLE schm_part.events_2024 PARTITION OF schm_part.events
+    FOR VALUES FROM ('2024-01-01') TO ('2025-01-01') PARTITION BY HASH (id);
+
+CREATE TABLE schm_part.events_2024_0 PARTITION OF schm_part.events_2024 FOR VALUES WITH (MODULUS 2, REMAINDER 0);
+CREATE TABLE schm_part.events_2024_1 PARTITION OF schm_part.events_2024 FOR VALUES WITH (MODULUS 2, REMAINDER 1);
+
+INSERT INTO schm_part.events (created, email)
+SELECT '2023-01-01'::date + (n % 731), 'user' || n || '@example.com'
+FROM generate_series(1, 1512) n;
+
+-- dumped by "raw_sql" of the partitioned table
+CREATE TABLE schm_part.messages
+(
+    id integer NOT NULL,
+    kind text NOT NULL,
+    msg text
+) PARTITION BY LIST (kind);
+
+CREATE TABLE schm_part.messages_info PARTITION OF schm_part.messages FOR VALUES IN ('info');
+CREATE TABLE schm_part.messages_error PARTITION OF schm_part.messages FOR VALUES IN ('error');
+
+INSERT INTO schm_part.messages
+SELECT n, CASE WHEN n % 3 = 0 THEN 'error' ELSE 'info' END, 'message ' || n
+FROM generate_series(1, 300) n;
+
+ANALYZE;
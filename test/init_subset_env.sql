@@ -0,0 +1,74 @@
+-- Tables linked by foreign keys for test_21_subset, the source database is test_source_db_subset
+
+DROP SCHEMA IF EXISTS schm_subset CASCADE;
+CREATE SCHEMA schm_subset;
+
+CREATE TABLE schm_subset.suppliers
+(
+    id integer PRIMARY KEY,
+    name text
+);
+
+CREATE TABLE schm_subset.products
+(
+    id integer PRIMARY KEY,
+    supplier_id integer REFERENCES schm_subset.suppliers (id),
+    name text
+);
+
+-- customers referred by another customer are added to the subset by the self-reference
+CREATE TABLE schm_subset.customers
+(
+    id integer PRIMARY KEY,
+    referrer_id integer REFERENCES schm_subset.customers (id),
+    email text
+);
+
+CREATE TABLE schm_subset.orders
+(
+    id integer PRIMARY KEY,
+    customer_id integer NOT NULL REFERENCES schm_subset.customers (id),
+    product_id integer REFERENCES schm_subset.products (id)
+);
+
+CREATE TABLE schm_subset.payments
+(
+    id integer NOT NULL,
+    order_id integer NOT NULL REFERENCES schm_subset.orders (id),
+    paid date NOT NULL,
+    amount numeric
+) PARTITION BY RANGE (paid);
+
+CREATE TABLE schm_subset.payments_2023 PARTITION OF schm_subset.payments
+    FOR VALUES FROM ('2023-01-01') TO ('2024-01-01');
+CREATE TABLE schm_subset.payments_2024 PARTITION OF schm_subset.payments
+    FOR VALUES FROM ('2024-01-01') TO ('2025-01-01');
+
+-- not linked to the subset, dumped in full. The identity sequence is restored by seq_init
+CREATE TABLE schm_subset.settings
+(
+    name text PRIMARY KEY,
+    value text,
+    id integer GENERATED BY DEFAULT AS IDENTITY
+);
+
+INSERT INTO schm_subset.suppliers
+SELECT n, 'supplier ' || n FROM generate_series(1, 20) n;
+
+INSERT INTO schm_subset.products
+SELECT n, n % 20 + 1, 'product ' || n FROM generate_series(1, 100) n;
+
+INSERT INTO schm_subset.customers
+SELECT n, CASE WHEN n % 50 = 0 THEN n - 7 END, 'customer' || n || '@example.com'
+FROM generate_series(1, 1000) n;
+
+INSERT INTO schm_subset.orders
+SELECT n, n % 1000 + 1, n % 97 + 1 FROM generate_series(1, 3000) n;
+
+INSERT INTO schm_subset.payments
+SELECT n, n, '2023-01-01'::date + (n % 731), n * 10 FROM generate_series(1, 3000) n;
+
+INSERT INTO schm_subset.settings
+SELECT 'setting ' || n, n::text FROM generate_series(1, 10) n;
+
+ANALYZE;
@@ -0,0 +1,241 @@
+import hashlib
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from common import *
+from compressors import *
+
+VERIFY_READ_SIZE = 4 * 1024 * 1024
+COPY_BINARY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+
+class CopyRowCounter:
+    # Counts rows of COPY output fed in chunks. Text rows end with a newline (newlines in values are escaped),
+    # CSV values may contain quoted newlines, binary tuples are walked by field lengths up to the trailer
+    def __init__(self, copy_format):
+        self.copy_format = copy_format
+        self.rows = 0
+        self.in_quotes = False
+        self.buffer = bytearray()
+        self.pos = 0
+        self.header_done = False
+        self.trailer_found = False
+
+    def feed(self, data):
+        if self.copy_format == "text":
+            self.rows += data.count(b"\n")
+        elif self.copy_format == "csv":
+            parts = data.split(b'"')
+            for n, part in enumerate(parts):
+                if not self.in_quotes:
+                    self.rows += part.count(b"\n")
+                if n < len(parts) - 1:
+                    self.in_quotes = not self.in_quotes
+        else:
+            self.buffer += data
+            self.parse_binary()
+
+    def parse_binary(self):
+        buf = self.buffer
+        pos = self.pos
+        if not self.header_done:
+            if len(buf) < 19:
+                return
+            if bytes(buf[:11]) != COPY_BINARY_SIGNATURE:
+                raise Exception("Invalid COPY binary signature")
+            ext_len = struct.unpack_from("!i", buf, 15)[0]
+            if len(buf) < 19 + ext_len:
+                return
+            pos = 19 + ext_len
+            self.header_done = True
+
+        while not self.trailer_found:
+            if len(buf) - pos < 2:
+                break
+            fields = struct.unpack_from("!h", buf, pos)[0]
+            if fields == -1:
+                self.trailer_found = True
+                pos += 2
+                break
+            # the tuple is counted only when all its fields are in the buffer
+            end = pos + 2
+            complete = True
+            for _ in range(fields):
+                if len(buf) - end < 4:
+                    complete = False
+                    break
+                length = struct.unpack_from("!i", buf, end)[0]
+                end += 4 + (length if length > 0 else 0)
+                if end > len(buf):
+                    complete = False
+                    break
+            if not complete:
+                break
+            self.rows += 1
+            pos = end
+
+        # drop parsed bytes from time to time, slicing a bytearray on every tuple is expensive
+        if pos > VERIFY_READ_SIZE:
+            del buf[:pos]
+            pos = 0
+        self.pos = pos
+
+    def finish(self):
+        if self.copy_format == "binary":
+            if not self.trailer_found:
+                raise Exception("COPY binary trailer not found, the file is truncated")
+            if len(self.buffer) > self.pos:
+                raise Exception("Unexpected data after COPY binary trailer")
+        elif self.copy_format == "csv" and self.in_quotes:
+            raise Exception("Unterminated quoted CSV value, the file is truncated")
+        return self.rows
+
+
+def get_decompressor(codec):
+    # object with decompress(data) -> bytes and flush() -> bytes
+    if codec in (CompressCodec.GZIP, CompressCodec.PIGZ):
+        return GzipStreamDecompressor()
+    if codec == CompressCodec.ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj(read_across_frames=True)
+    if codec == CompressCodec.LZ4 and lz4 is not None:
+        return lz4.frame.LZ4FrameDecompressor()
+    return None
+
+
+class GzipStreamDecompressor:
+    # gzip files may consist of several members (concatenated gzip output)
+    def __init__(self):
+        self.obj = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def decompress(self, data):
+        out = []
+        while data:
+            out.append(self.obj.decompress(data))
+            data = self.obj.unused_data
+            if data:
+                self.obj = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        return b"".join(out)
+
+    def flush(self):
+        if not self.obj.eof:
+            raise Exception("Compressed stream is truncated")
+        return self.obj.flush()
+
+
+def verify_file(full_path, codec, copy_format):
+    # runs in a worker process: size, sha256 of the compressed file and rows of the decompressed data in one read
+    codec = CompressCodec(codec)
+    counter = CopyRowCounter(copy_format)
+    sha = hashlib.sha256()
+    size = 0
+    decompressor = get_decompressor(codec)
+
+    if decompressor is not None:
+        with open(full_path, "rb", buffering=0) as f:
+            for chunk in iter(lambda: f.read(VERIFY_READ_SIZE), b""):
+                size += len(chunk)
+                sha.update(chunk)
+                counter.feed(decompressor.decompress(chunk))
+        if codec == CompressCodec.LZ4:
+            if not decompressor.eof:
+                raise Exception("Compressed stream is truncated")
+        else:
+            counter.feed(decompressor.flush())
+    else:
+        # the Python module of the codec is not installed, the command line decompressor is used
+        with open(full_path, "rb", buffering=0) as f:
+            for chunk in iter(lambda: f.read(VERIFY_READ_SIZE), b""):
+                size += len(chunk)
+                sha.update(chunk)
+        command = get_decompress_program(codec).split() + [full_path]
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        for chunk in iter(lambda: proc.stdout.read(VERIFY_READ_SIZE), b""):
+            counter.feed(chunk)
+        err = proc.stderr.read()
+        if proc.wait() != 0:
+            raise Exception("%s failed: %s" % (" ".join(command), err.decode("utf-8", "replace").strip()))
+
+    return {"size": size, "checksum": sha.hexdigest(), "rows": counter.finish()}
+
+
+def check_file_result(file_name, info, res):
+    errors = []
+    if info.get("size") is not None and res["size"] != info["size"]:
+        errors.append("size %s, expected %s" % (res["size"], info["size"]))
+    if info.get("checksum") is not None and res["checksum"] != info["checksum"]:
+        errors.append("checksum %s, expected %s" % (res["checksum"], info["checksum"]))
+    if "rows" in info and res["rows"] != int(info["rows"]):
+        errors.append("rows %s, expected %s" % (res["rows"], info["rows"]))
+    return errors
+
+
+async def verify_dump(ctx):
+    # checks the files of a dump directory against metadata.json in --threads processes, without a database
+    result = PgAnonResult()
+    ctx.logger.info("-------------> Started verify")
+
+    if ctx.args.input_dir.find("""/""") == -1 and ctx.args.input_dir.find("""\\""") == -1:
+        ctx.args.input_dir = os.path.join(ctx.current_dir, 'output', ctx.args.input_dir)
+
+    try:
+        with open(os.path.join(ctx.args.input_dir, 'metadata.json'), 'r') as f:
+            metadata = json.loads(f.read())
+    except:
+        ctx.logger.error("<------------- verify failed\n" + exception_helper())
+        result.result_code = ResultCode.FAIL
+        return result
+
+    copy_format = metadata.get("copy_format", "text")
+    files = metadata.get("files", {})
+    # the largest files first, so that the processes finish at about the same time
+    ordered = sorted(
+        files,
+        key=lambda v: files[v].get("size") or int(files[v].get("rows", 0)),
+        reverse=True
+    )
+
+    loop = asyncio.get_event_loop()
+    start_t = time.time()
+    failed = {}
+    with ProcessPoolExecutor(max_workers=ctx.args.threads) as executor:
+        futures = [
+            loop.run_in_executor(
+                executor,
+                verify_file,
+                os.path.join(ctx.args.input_dir, file_name),
+                files[file_name].get("codec", CompressCodec.GZIP.value),
+                copy_format
+            ) for file_name in ordered
+        ]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+    total_size = 0
+    total_rows = 0
+    for file_name, res in zip(ordered, results):
+        if isinstance(res, BaseException):
+            failed[file_name] = [str(res)]
+            continue
+        total_size += res["size"]
+        total_rows += res["rows"]
+        errors = check_file_result(file_name, files[file_name], res)
+        if errors:
+            failed[file_name] = errors
+        ctx.logger.debug("Verified %s: %s rows, %s%s" % (
+            file_name, res["rows"], pretty_size(res["size"]), (", " + "; ".join(errors)) if errors else "")
+        )
+
+    for file_name, errors in failed.items():
+        ctx.logger.error("File %s (%s.%s) is damaged: %s" % (
+            file_name, files[file_name]["schema"], files[file_name]["table"], "; ".join(errors))
+        )
+
+    elapsed = time.time() - start_t
+    ctx.logger.info("Verified %s file(s), %s, %s rows in %.2fs: %s damaged" % (
+        len(files), pretty_size(total_size), total_rows, elapsed, len(failed))
+    )
+
+    result.result_code = ResultCode.FAIL if failed else ResultCode.DONE
+    result.result_data = {"files": len(files), "damaged": failed, "total_rows": total_rows}
+    ctx.logger.info("<------------- Finished verify")
+    return result